@@ -2,4 +2,4 @@
 
 set -xv
 
-sudo pip install numpy scipy pymongo weave
+sudo pip install numpy scipy pymongo
@@ -27,5 +27,6 @@ setup(
               'spearmint.transformations',
               'spearmint.utils',
               'spearmint.utils.database',],
+    package_data={'spearmint.grids': ['sobol_params.npy']},
     long_description=read('README.md'),
 )
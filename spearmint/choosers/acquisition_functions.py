@@ -200,49 +200,76 @@ def compute_ei(model, pred, ei_target=None, compute_grad=True):
     if pred.ndim == 1:
         pred = pred[None,:]
 
+    ei_values = model.values.min(axis=0)
+
+    # Treat the current state as a stack of one state
+    predictions = [p[np.newaxis] for p in model.predict(pred, compute_grad=compute_grad)]
+
     if not compute_grad:
-        func_m, func_v = model.predict(pred)
-    else:
-        (func_m,
-        func_v,
-        grad_xp_m,
-        grad_xp_v) = model.predict(pred, compute_grad=True)
-
-    if func_m.ndim == 1:
-        func_m = func_m[:,np.newaxis]
-    if func_v.ndim == 1:
-        func_v = func_v[:,np.newaxis]
-
-    if compute_grad:
-        if grad_xp_m.ndim == 2:
-            grad_xp_m = grad_xp_m[:,:,np.newaxis]
-        if grad_xp_v.ndim == 2:
-            grad_xp_v = grad_xp_v[:,:,np.newaxis]
+        return _ei_over_states(np.array([ei_values]), *predictions)[0]
 
-    ei_values = model.values.min(axis=0)
+    ei, grad_xp = _ei_over_states(np.array([ei_values]), *predictions)
+
+    return np.sum(ei), grad_xp[0].flatten()
+
+def compute_ei_over_hypers(model, pred, ei_target=None, compute_grad=True, num_states=None):
+    """Compute EI at pred under the first num_states hyperparameter states of the model.
+
+    Returns an array of shape (num_states, N) and, if compute_grad is True, the
+    gradients w.r.t. the inputs of shape (num_states, N, D). Averaging over the
+    first axis gives the same result as averaging compute_ei over the states.
+    """
+    # TODO: use ei_target
+    if pred.ndim == 1:
+        pred = pred[None,:]
+
+    if num_states is None:
+        num_states = model.num_states
+
+    # The best value can differ between states because of the fantasies
+    state = model.state
+    ei_values = []
+    for i in xrange(num_states):
+        model.set_state(i)
+        ei_values.append(model.values.min(axis=0))
+    if state is not None:
+        model.set_state(state)
 
-    ei_values = np.array(ei_values)
-    if ei_values.ndim == 0:
-        ei_values = np.array([[ei_values]])
+    predictions = [p[:num_states] for p in model.predict_over_hypers(pred, compute_grad=compute_grad)]
+
+    return _ei_over_states(np.array(ei_values), *predictions)
+
+def _ei_over_states(ei_values, func_m, func_v, grad_xp_m=None, grad_xp_v=None):
+    # The first axis of everything is over states and the last axis of
+    # the means and values is over fantasies
+    if func_m.ndim == 2:
+        func_m = func_m[:,:,np.newaxis]
+    if func_v.ndim == 2:
+        func_v = func_v[:,:,np.newaxis]
+
+    ei_values = ei_values.reshape((ei_values.shape[0], 1, -1))
 
     # Expected improvement
     func_s = np.sqrt(func_v)
     u      = (ei_values - func_m) / func_s
     ncdf   = sps.norm.cdf(u)
     npdf   = sps.norm.pdf(u)
-    ei     = np.mean(func_s*( u*ncdf + npdf),axis=1)
+    ei     = np.mean(func_s*( u*ncdf + npdf),axis=2)
 
-    if not compute_grad:
+    if grad_xp_m is None:
         return ei
 
-    ei = np.sum(ei)
+    if grad_xp_m.ndim == 3:
+        grad_xp_m = grad_xp_m[:,:,:,np.newaxis]
+    if grad_xp_v.ndim == 3:
+        grad_xp_v = grad_xp_v[:,:,:,np.newaxis]
 
     # Gradients of ei w.r.t. mean and variance            
     g_ei_m = -ncdf
     g_ei_s2 = 0.5*npdf / func_s
     
     # Gradient of ei w.r.t. the inputs
-    grad_xp = (grad_xp_m*np.tile(g_ei_m,(pred.shape[1],1))).T + (grad_xp_v.T*g_ei_s2).T
-    grad_xp = np.mean(grad_xp,axis=0)
+    grad_xp = grad_xp_m*g_ei_m[:,:,np.newaxis,:] + grad_xp_v*g_ei_s2[:,:,np.newaxis,:]
+    grad_xp = np.mean(grad_xp,axis=3)
 
-    return ei, grad_xp.flatten()
+    return ei, grad_xp
@@ -183,18 +183,21 @@
 # its Institution.
 
 
+import os
 import sys
+import atexit
+import tempfile
 import numpy          as np
 import numpy.random   as npr
 import scipy.optimize as spo
+import cPickle        as pickle
 import multiprocessing
 
 from collections import defaultdict
 
-from .acquisition_functions  import compute_ei
+from .acquisition_functions  import compute_ei, compute_ei_over_hypers
 from ..utils.grad_check      import check_grad
 from ..grids                 import sobol_grid
-from ..models.abstract_model import function_over_hypers
 from ..                      import models
 
 DEFAULT_GRIDSIZE  = 20000
@@ -204,6 +207,14 @@ DEFAULT_NUMDESIGN = 2
 DEFAULT_NUMSPRAY  = 10
 DEFAULT_SPRAYSTD  = 1e-3
 
+DEFAULT_GRID_CHUNK_SIZE = 2000
+
+DEFAULT_NUMRESTARTS = 20
+DEFAULT_ADAM_ITERS  = 200
+DEFAULT_ADAM_LR     = 0.05
+
+DEFAULT_PREDICTION_CACHE_MB = 256
+
 VERBOSE = False
 
 
@@ -211,6 +222,17 @@ def init(options):
     return DefaultChooser(options)
 
 
+def _optimize_pts(state_file, initializers, bounds, current_best):
+    """Optimize the acquisition function from each initializer, in a worker of the
+    pool, and return the optimized points with their acquisition values. The
+    chooser is loaded from state_file, which only exists during the
+    optimization."""
+    with open(state_file, 'rb') as f:
+        chooser = pickle.load(f)
+
+    return [chooser.optimize_pt(c, bounds, current_best, compute_grad=True) for c in initializers]
+
+
 class DefaultChooser(object):
     """class which which makes suggestions for new jobs
     
@@ -228,13 +250,28 @@ class DefaultChooser(object):
         self.num_spray = options.get('num-spray', DEFAULT_NUMSPRAY)
         self.spray_std = options.get('spray-std', DEFAULT_SPRAYSTD)
         self.check_grad = options.get('check-grad', False)
+        self.grid_chunk_size = int(options.get('grid-chunk-size', DEFAULT_GRID_CHUNK_SIZE))
+        self.prediction_cache_mb = float(options.get('prediction-cache-mb', DEFAULT_PREDICTION_CACHE_MB))
 
-        self.grid_subset = 20
+        chooser_args = options.get('chooser-args', {})
 
-        if 'chooser-args' in options:
-            self.parallel_opt = bool(options['chooser-args'].get('parallel-opt', False))
-        else:
-            self.parallel_opt = False
+        self.grid_subset  = int(chooser_args.get('num-restarts', DEFAULT_NUMRESTARTS))
+        self.parallel_opt = bool(chooser_args.get('parallel-opt', False))
+        self.num_workers  = int(chooser_args.get('num-workers', 0))
+
+        # 'lbfgs' optimizes each restart with L-BFGS, 'adam' all of them together
+        self.opt_method   = chooser_args.get('opt-method', 'lbfgs').lower()
+        self.adam_iters   = int(chooser_args.get('adam-iters', DEFAULT_ADAM_ITERS))
+        self.adam_lr      = float(chooser_args.get('adam-lr', DEFAULT_ADAM_LR))
+        if self.opt_method not in ['lbfgs', 'adam']:
+            raise Exception('Unknown optimization method: %s' % self.opt_method)
+
+        # parallel-opt without a number of workers uses one per core
+        if self.parallel_opt and self.num_workers == 0:
+            self.num_workers = multiprocessing.cpu_count()
+
+        self._pool       = None # Persistent pool of workers for the optimization
+        self._state_file = None # File the chooser is pickled to for the workers, during an optimization
 
         self.models      = {}
         self.objective   = {}
@@ -256,15 +293,7 @@ class DefaultChooser(object):
 
         # Create the grid of optimization initializers
         # Need to do it here because it's used in many places e.g. best
-        self.grid = sobol_grid.generate(self.num_dims, grid_size=self.grid_size, 
-                                        grid_seed=self.grid_seed)
-
-        # A useful hack: add previously visited points to the grid
-        for task_name, task in task_group.tasks.iteritems():
-            if task.has_valid_inputs():
-                self.grid = np.append(self.grid, task.valid_normalized_data_dict['inputs'], axis=0)
-            if task.has_pending():
-                self.grid = np.append(self.grid, task.valid_normalized_data_dict['pending'], axis=0)
+        self._build_grid(task_group)
 
         # A fallback in case you don't fit -- just submit this
         # index off the grid
@@ -313,7 +342,53 @@ class DefaultChooser(object):
 
         return new_hypers
 
+    def update_pending(self, task_group):
+        """Replace the pending points of the fitted models with those of
+        task_group, which must have the same completed jobs as the task group
+        given to fit. The hyperparameter samples are kept, so this is much
+        cheaper than fitting again, e.g. to make several suggestions in a row
+        with fantasies for the ones not yet run."""
+        if not self.isFit:
+            raise Exception("You must call fit() before calling update_pending()")
+
+        self.task_group = task_group
+        self._build_grid(task_group)
+        self.design_index = task_group.inputs.shape[0] + task_group.pending.shape[0]
+
+        for task_name, task in task_group.tasks.iteritems():
+            if task.type.lower() == 'objective':
+                data_dict = self.objective
+            else:
+                data_dict = self.constraints[task_name]
+
+            data_dict.update(task.valid_normalized_data_dict)
+
+            if task_name in self.models:
+                self.models[task_name].update_pending(data_dict['pending'])
+
+    def _build_grid(self, task_group):
+        self.grid = sobol_grid.generate(self.num_dims, grid_size=self.grid_size, 
+                                        grid_seed=self.grid_seed)
+
+        # A useful hack: add previously visited points to the grid
+        for task_name, task in task_group.tasks.iteritems():
+            if task.has_valid_inputs():
+                self.grid = np.append(self.grid, task.valid_normalized_data_dict['inputs'], axis=0)
+            if task.has_pending():
+                self.grid = np.append(self.grid, task.valid_normalized_data_dict['pending'], axis=0)
+
     def suggest(self):
+        # The models keep their predictions during a suggestion, so that
+        # the grid is only predicted on once by best() and the acquisition
+        for model in self.models.values():
+            model.enable_prediction_cache(self.prediction_cache_mb)
+        try:
+            return self._suggest()
+        finally:
+            for model in self.models.values():
+                model.disable_prediction_cache()
+
+    def _suggest(self):
         sys.stderr.write('Getting suggestion...\n')
         assert not np.any(self.grid < 0)
         assert not np.any(self.grid > 1)
@@ -338,18 +413,12 @@ class DefaultChooser(object):
         spray_points = npr.randn(self.num_spray, self.num_dims)*self.spray_std + current_best_location
         spray_points = np.minimum(np.maximum(spray_points,0.0),1.0)
         
-        # Compute EI on the grid
-        grid_pred = np.vstack((self.grid, spray_points))
-        grid_ei = self.acquisition_function_over_hypers(grid_pred, current_best, compute_grad=False)
+        # Compute EI on the grid, a chunk at a time, keeping only the points with highest EI
+        best_grid_pred, best_grid_ei = self.top_acquisition(current_best, self.grid, spray_points)
 
-        # Find the points on the grid with highest EI
-        best_grid_inds = np.argsort(grid_ei)[-self.grid_subset:]
-        best_grid_pred = grid_pred[best_grid_inds]
+        # The value of the top grid point (the top points are sorted by increasing EI)
+        best_grid_ei = best_grid_ei[-1]
 
-        # The index and value of the top grid point
-        best_grid_ind = np.argmax(grid_ei)
-        best_grid_ei  = grid_ei[best_grid_ind]
-        
         if VERBOSE:
             print 'Best EI before optimization: %f' % best_grid_ei
 
@@ -358,27 +427,36 @@ class DefaultChooser(object):
                 best_grid_pred[0], verbose=True)
 
         # Optimize the top points from the grid to get better points
-        cand = []
-        b = [(0,1)]*best_grid_pred.shape[1]# optimization bounds
-
-        if self.parallel_opt:
-            # Optimize each point in parallel
-            pool = multiprocessing.Pool(self.grid_subset)
-            results = [pool.apply_async(self.optimize_pt,args=(
-                    c,b,current_best,True)) for c in best_grid_pred]
-
-            for res in results:
-                cand.append(res.get(1e8))
-            pool.close()
-        else: 
-            # Optimize in series
-            for c in best_grid_pred:
-                cand.append(self.optimize_pt(c,b,current_best,compute_grad=True))
-        # Cand now stores the optimized points
-
-        # Compute one more time (re-computing is unnecessary, oh well... TODO)
-        cand = np.vstack(cand)
-        opt_ei = self.acquisition_function_over_hypers(cand, current_best, compute_grad=False)
+        if self.opt_method == 'adam':
+            # Optimize all the points together
+            cand, opt_ei = self.optimize_pts_adam(best_grid_pred, current_best)
+        else:
+            results = []
+            b = [(0,1)]*best_grid_pred.shape[1]# optimization bounds
+
+            if self.num_workers > 1:
+                # Optimize the points in parallel, splitting them between the workers.
+                # The workers only get the initializers and the name of the file with
+                # the fitted chooser, which is removed as soon as they are done.
+                self.start_workers()
+                self._write_state_file()
+                try:
+                    async_results = [self._pool.apply_async(_optimize_pts, args=(
+                            self._state_file,initializers,b,current_best)) 
+                            for initializers in np.array_split(best_grid_pred, self.num_workers) if initializers.shape[0] > 0]
+
+                    for res in async_results:
+                        results.extend(res.get(1e8))
+                finally:
+                    self._remove_state_file()
+            else: 
+                # Optimize in series
+                for c in best_grid_pred:
+                    results.append(self.optimize_pt(c,b,current_best,compute_grad=True))
+
+            # The optimizer already returns the acquisition value at each optimized point
+            cand   = np.vstack([opt_x for opt_x, opt_acq in results])
+            opt_ei = np.array([opt_acq for opt_x, opt_acq in results])
 
         # The index and value of the top optimized point
         best_opt_ind  = np.argmax(opt_ei)
@@ -393,7 +471,7 @@ class DefaultChooser(object):
         if best_opt_ei >= best_grid_ei:
             suggestion = cand[best_opt_ind]
         else:
-            suggestion = grid_pred[best_grid_ind]
+            suggestion = best_grid_pred[-1].copy()
 
         # Make sure BFGS didn't do anything weird with the boudns
         suggestion[suggestion > 1] = 1.0
@@ -405,6 +483,24 @@ class DefaultChooser(object):
         self.task_group.paramify_and_print(suggestion.flatten(), left_indent=16)
         return suggestion
 
+    def suggest_batch(self, q):
+        """Return q suggestions from a single fit, one per row.
+
+        Each suggestion is made with fantasies for the previous ones as
+        pending points (see update_pending), so that the batch is spread
+        out instead of repeating the same point. The suggestions are left
+        as pending points of the chooser's task group."""
+        suggestions = []
+        for i in xrange(q):
+            if i > 0:
+                pending = self.task_group.pending.reshape((-1, self.num_dims))
+                self.task_group.pending = np.vstack((pending, suggestions[-1][None]))
+                self.update_pending(self.task_group)
+
+            suggestions.append(self.suggest().flatten())
+
+        return np.vstack(suggestions)
+
     # TODO: add optimization in here
     def best(self):
         grid = self.grid
@@ -413,14 +509,9 @@ class DefaultChooser(object):
 
         # If unconstrained
         if self.numConstraints() == 0:
-            # Compute the GP mean
-            obj_mean, obj_var = obj_model.function_over_hypers(obj_model.predict, grid)
-
             # find the min and argmin of the GP mean
-            current_best_location = grid[np.argmin(obj_mean),:][None]
-            best_ind = np.argmin(obj_mean)
-            current_best_value = obj_mean[best_ind]
-            std_at_best = np.sqrt(obj_var[best_ind])
+            current_best_value, current_best_location, var_at_best = self.min_of_mean(grid)
+            std_at_best = np.sqrt(var_at_best)
 
             # un-normalize the min of mean to original units
             unnormalized_best_value = obj_task.unstandardize_mean(obj_task.unstandardize_variance(current_best_value))
@@ -444,17 +535,42 @@ class DefaultChooser(object):
 
         else:
 
-            mc = self.probabilistic_constraint(grid)
-            if not np.any(mc): 
-                # P-con is violated everywhere
-                # Compute the product of the probabilities, and return None for the current best value
-                probs = reduce(lambda x,y:x*y, [self.confidence(c, grid) for c in self.constraints], np.ones(grid.shape[0]))
+            # Find the min of the GP mean over the points where the
+            # probabilistic constraint holds, keeping track of the point most
+            # likely to satisfy the constraints in case there are none
+            current_best_value    = None
+            current_best_location = None
+            max_probs             = -np.inf
+            best_probs_location   = None
+            for chunk in self.grid_chunks(grid):
+                confs = [self.confidence(c, chunk) for c in self.constraints]
+
+                probs = reduce(np.multiply, confs, np.ones(chunk.shape[0]))
                 best_probs_ind = np.argmax(probs)
-                best_probs_location = grid[best_probs_ind,:][None]
+                if probs[best_probs_ind] > max_probs:
+                    max_probs           = probs[best_probs_ind]
+                    best_probs_location = chunk[best_probs_ind,:][None]
+
+                mc = reduce(np.logical_and,
+                    [conf >= self.task_group.tasks[c].options.get('min-confidence', 0.99)
+                        for c, conf in zip(self.constraints, confs)],
+                    np.ones(chunk.shape[0], dtype=bool))
+                if not np.any(mc):
+                    continue
+
+                value, location, var = self.min_of_mean(chunk, feasible=mc)
+                if current_best_value is None or value < current_best_value:
+                    current_best_value    = value
+                    current_best_location = location
+                    std_at_best           = np.sqrt(var)
+
+            if current_best_value is None:
+                # P-con is violated everywhere
+                # Return the location with the highest product of the probabilities, and None for the current best value
                 # TODO -- could use BFGS for this (unconstrained) optimization as well -- everytime for min of mean
 
                 sys.stderr.write('\nNo feasible region found (yet).\n')
-                sys.stderr.write('Maximum probability of satisfying constraints = %f\n' % np.max(probs))
+                sys.stderr.write('Maximum probability of satisfying constraints = %f\n' % max_probs)
                 sys.stderr.write('At location:    ')
                 self.task_group.paramify_and_print(self.task_group.from_unit(best_probs_location).flatten(), 
                                                    left_indent=16)
@@ -463,16 +579,6 @@ class DefaultChooser(object):
 
             # A feasible region has been found
 
-            # Compute GP mean and find minimum
-            mean, var = obj_model.function_over_hypers(obj_model.predict, grid)
-            valid_mean = mean[mc]
-            valid_var = var[mc]
-            best_ind = np.argmin(valid_mean)
-            current_best_location = (grid[mc])[best_ind,:][None]
-            ind = np.argmin(valid_mean)
-            current_best_value = valid_mean[ind]
-            std_at_best = np.sqrt(valid_var[ind])
-
             unnormalized_best = obj_task.unstandardize_mean(obj_task.unstandardize_variance(current_best_value))
             unnormalized_std_at_best = obj_task.unstandardize_variance(std_at_best) # not used -- not quite
             # right to report this -- i mean there is uncertainty in the constraints too
@@ -505,12 +611,69 @@ class DefaultChooser(object):
         # Return according to model, not observed
         return current_best_value, current_best_location
 
+    def grid_chunks(self, *grids):
+        """Iterate over the rows of the given grids in chunks of at most
+        grid_chunk_size points, so that the predictions on a large grid never
+        need more memory than those on a single chunk."""
+        for grid in grids:
+            for start in xrange(0, grid.shape[0], self.grid_chunk_size):
+                yield grid[start:start+self.grid_chunk_size]
+
+    def min_of_mean(self, grid, feasible=None):
+        """Return the minimum of the objective GP mean over the grid, the
+        location of the minimum and the predicted variance there. If given,
+        only the points where the boolean array feasible is True are
+        considered. The mean is still predicted on whole chunks of the grid,
+        so that the predictions are shared with the acquisition function."""
+        obj_model = self.models[self.objective['name']]
+
+        if feasible is None:
+            feasible = np.ones(grid.shape[0], dtype=bool)
+
+        best_value, best_location, var_at_best = None, None, None
+        for chunk, chunk_feasible in zip(self.grid_chunks(grid), self.grid_chunks(feasible)):
+            if not np.any(chunk_feasible):
+                continue
+
+            # Compute the GP mean
+            obj_mean, obj_var = [p.mean(axis=0) for p in obj_model.predict_over_hypers(chunk)]
+
+            best_ind = np.argmin(np.where(chunk_feasible, obj_mean, np.inf))
+            if best_value is None or obj_mean[best_ind] < best_value:
+                best_value    = obj_mean[best_ind]
+                best_location = chunk[best_ind,:][None]
+                var_at_best   = obj_var[best_ind]
+
+        return best_value, best_location, var_at_best
+
+    def top_acquisition(self, current_best, *grids):
+        """Evaluate the acquisition function on the grids one chunk at a time
+        and return the grid_subset points with the highest values, along with
+        these values, both sorted by increasing acquisition value."""
+        top_pred = np.zeros((0, self.num_dims))
+        top_acq  = np.zeros(0)
+        for chunk in self.grid_chunks(*grids):
+            chunk_acq = self.acquisition_function_over_hypers(chunk, current_best, compute_grad=False)
+
+            top_pred = np.vstack((top_pred, chunk))
+            top_acq  = np.append(top_acq, chunk_acq)
+            if top_acq.size > self.grid_subset:
+                keep = np.argpartition(top_acq, -self.grid_subset)[-self.grid_subset:]
+                top_pred = top_pred[keep]
+                top_acq  = top_acq[keep]
+
+        order = np.argsort(top_acq)
+        return top_pred[order], top_acq[order]
+
     def numConstraints(self):
         return len(self.constraints)
 
     # The confidence that conststraint c is satisfied
     def confidence(self, c, grid, compute_grad=False):
-        return self.models[c].function_over_hypers(self.models[c].pi, grid, compute_grad=compute_grad)
+        if not compute_grad:
+            return self.models[c].pi_over_hypers(grid).mean(axis=0)
+
+        return tuple(p.mean(axis=0) for p in self.models[c].pi_over_hypers(grid, compute_grad=True))
 
     # Returns a boolean array of size pred.shape[0] indicating whether the prob con-constraint is satisfied there
     def probabilistic_constraint(self, pred):
@@ -519,8 +682,61 @@ class DefaultChooser(object):
                 for c in self.constraints], 
                 np.ones(pred.shape[0], dtype=bool))
 
-    def acquisition_function_over_hypers(self, *args, **kwargs):
-        return function_over_hypers(self.models.values(), self.acquisition_function, *args, **kwargs)
+    def acquisition_function_over_hypers(self, cand, current_best, compute_grad=True):
+        """Compute the acquisition function averaged over the hyperparameter states.
+
+        This is the same as averaging acquisition_function over the states
+        with function_over_hypers, but the predictions for all states are
+        computed at once. Returns an array with the value at each candidate
+        and, if compute_grad is True, an array with the gradient at each
+        candidate.
+        """
+        obj_model = self.models[self.objective['name']]
+
+        if cand.ndim == 1:
+            cand = cand[None]
+
+        N_cand = cand.shape[0]
+
+        # Use the first n states of each model, where n is the min number of states
+        num_states = min([model.num_states for model in self.models.values()])
+
+        # Part that depends on the objective
+        if self.numConstraints() > 0 and current_best is None:
+            ei      = np.ones((num_states, N_cand))
+            ei_grad = np.zeros((num_states, N_cand, cand.shape[1]))
+        elif not compute_grad:
+            ei = compute_ei_over_hypers(obj_model, cand, current_best, compute_grad=False, num_states=num_states)
+        else:
+            ei, ei_grad = compute_ei_over_hypers(obj_model, cand, current_best, compute_grad=True, num_states=num_states)
+
+        # Part that depends on the constraints
+        p_valid, p_grad = list(), list()
+        for c in self.constraints:
+            if compute_grad:
+                pv, pvg = self.models[c].pi_over_hypers(cand, compute_grad=True)
+                p_valid.append(pv[:num_states])
+                p_grad.append(pvg[:num_states])
+            else:
+                p_valid.append(self.models[c].pi_over_hypers(cand, compute_grad=False)[:num_states])
+
+        p_valid_prod = reduce(np.multiply, p_valid, np.ones((num_states, N_cand)))
+
+        acq = np.mean(ei * p_valid_prod, axis=0)
+
+        if not compute_grad:
+            return acq
+
+        # Product rule over the objective and all the constraints
+        acq_grad = ei_grad * p_valid_prod[:,:,np.newaxis]
+        for i in xrange(self.numConstraints()):
+            pg = ei[:,:,np.newaxis] * p_grad[i]
+            for j in xrange(self.numConstraints()):
+                if j != i:
+                    pg = pg * p_valid[j][:,:,np.newaxis]
+            acq_grad = acq_grad + pg
+
+        return acq, np.mean(acq_grad, axis=0)
 
     def acquisition_function(self, cand, current_best, compute_grad=True):
         obj_model = self.models[self.objective['name']]
@@ -598,12 +814,92 @@ class DefaultChooser(object):
         ret = self.acquisition_function_over_hypers(cand, current_best, compute_grad=compute_grad)
 
         if isinstance(ret, tuple) or isinstance(ret, list):
-            return (-ret[0],-ret[1].flatten())
+            return (-np.sum(ret[0]),-ret[1].flatten())
         else:
-            return -ret
+            return -np.sum(ret)
+
+    def _write_state_file(self):
+        # Use shared memory if available so that the workers never hit the disk
+        directory = '/dev/shm' if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK) else None
+
+        fd, self._state_file = tempfile.mkstemp(prefix='spearmint-chooser-', suffix='.pkl', dir=directory)
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(self, f, pickle.HIGHEST_PROTOCOL)
+
+    def _remove_state_file(self):
+        if self._state_file is not None:
+            if os.path.exists(self._state_file):
+                os.remove(self._state_file)
+            self._state_file = None
+
+    def start_workers(self):
+        """Start the pool of workers of the parallel optimization, if there
+        is one and it is not started yet. The workers are forked from the
+        calling thread, so this should be called before starting any other
+        thread that uses the chooser."""
+        if self.num_workers > 1 and self._pool is None:
+            self._pool = multiprocessing.Pool(self.num_workers)
+            atexit.register(self.close)
+
+    def close(self):
+        """Stop the optimization workers and remove the file of the chooser state."""
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool = None
+        self._remove_state_file()
+
+    def __getstate__(self):
+        # The workers only need the fitted models, not the pool or the grid
+        state = self.__dict__.copy()
+        state['_pool']       = None
+        state['_state_file'] = None
+        state['grid']        = None
+        return state
+
+    def optimize_pts_adam(self, initializers, current_best, beta_1=0.9, beta_2=0.999, epsilon=1e-8, tol=1e-6):
+        """Maximize the acquisition function from all the initializers at once
+        with projected Adam in the unit hypercube. Each iteration takes a single
+        batched evaluation of the acquisition function and its gradient for all
+        the points. Returns the best point found from each initializer and the
+        acquisition function there."""
+        x = initializers.copy()
+        m = np.zeros(x.shape)
+        v = np.zeros(x.shape)
+
+        best_x   = x.copy()
+        best_acq = np.empty(x.shape[0])
+        best_acq.fill(-np.inf)
+
+        for t in xrange(1, self.adam_iters+2):
+            acq, acq_grad = self.acquisition_function_over_hypers(x, current_best, compute_grad=True)
+
+            # Keep the best point seen along each path
+            improved = acq > best_acq
+            best_x[improved]   = x[improved]
+            best_acq[improved] = acq[improved]
+
+            if t > self.adam_iters:
+                break
+
+            # Ascent step with a decaying learning rate, projected back on the bounds
+            m     = beta_1*m + (1-beta_1)*acq_grad
+            v     = beta_2*v + (1-beta_2)*acq_grad**2
+            lr    = self.adam_lr / np.sqrt(t)
+            step  = lr * (m/(1-beta_1**t)) / (np.sqrt(v/(1-beta_2**t)) + epsilon)
+            x_new = np.clip(x + step, 0.0, 1.0)
+
+            converged = np.max(np.abs(x_new - x)) < tol
+            x = x_new
+            if converged:
+                break
+
+        return best_x, best_acq
 
     def optimize_pt(self, initializer, bounds, current_best, compute_grad=True):
+        """Optimize the acquisition function from initializer with L-BFGS and
+        return the optimized point and the acquisition value there."""
         opt_x, opt_y, opt_info = spo.fmin_l_bfgs_b(self.acq_optimize_wrapper,
                 initializer.flatten(), args=(current_best,compute_grad),
                 bounds=bounds, disp=0, approx_grad=(not compute_grad))
-        return opt_x
+        # The wrapper returns the negated acquisition value, for minimization
+        return opt_x, -opt_y
@@ -183,8 +183,88 @@
 # its Institution.
 
 
+import os
+import sys
+import tempfile
+import numpy as np
+
+from collections import OrderedDict
+
 from .sobol import sobol
 
+# Increment this if the grids generated for the same arguments change, so
+# that stale grids in the disk cache are not picked up.
+CACHE_VERSION = 1
+
+# The number of grids kept in memory. Older grids are loaded again from the
+# memory-mapped disk cache, so only the grids in use need to be kept.
+MAX_GRIDS = 2
+
+# The grids most recently used by this process, keyed by
+# (num_dims, grid_size, grid_seed), least recently used first
+_grids = OrderedDict()
+
+def cache_dir():
+    """The directory of the disk cache of grids.  This is the value of the
+    SPEARMINT_GRID_CACHE environment variable if it is set, which can be
+    set to the empty string to disable the disk cache."""
+    return os.getenv('SPEARMINT_GRID_CACHE', os.path.join(os.path.expanduser('~'), '.spearmint', 'grids'))
+
 def generate(num_dims, grid_size=20000, grid_seed=0):
-    return sobol(grid_size+grid_seed, num_dims)[grid_seed:]
+    """Return the Sobol grid of grid_size points in num_dims dimensions,
+    skipping the first grid_seed points of the sequence.
+
+    The MAX_GRIDS most recent grids are memoized in memory, and all of them
+    in memory-mapped .npy files in cache_dir(), so fitting again with the
+    same grid does not regenerate it. The returned array is read-only as it
+    is shared between callers."""
+    key  = (num_dims, grid_size, grid_seed)
+    grid = _grids.pop(key, None)
+    if grid is None:
+        grid = _load_or_generate(*key)
+
+    _grids[key] = grid
+    while len(_grids) > MAX_GRIDS:
+        _grids.popitem(last=False)
+
+    return grid
+
+def _load_or_generate(num_dims, grid_size, grid_seed):
+    directory = cache_dir()
+    if not directory:
+        return _generate(num_dims, grid_size, grid_seed)
+
+    filename = os.path.join(directory, 'sobol-v%d-%d-%d-%d.npy' % (CACHE_VERSION, num_dims, grid_size, grid_seed))
+
+    if os.path.exists(filename):
+        try:
+            grid = np.load(filename, mmap_mode='r')
+            if grid.shape == (grid_size, num_dims):
+                return grid
+        except (IOError, ValueError):
+            pass
+
+    grid = _generate(num_dims, grid_size, grid_seed)
+
+    # Write to a temporary file and rename it so that concurrent processes
+    # never read a partially written grid
+    tmp_filename = None
+    try:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        fd, tmp_filename = tempfile.mkstemp(suffix='.npy', dir=directory)
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, grid)
+        os.rename(tmp_filename, filename)
+    except (IOError, OSError) as e:
+        sys.stderr.write('Could not cache the grid in %s: %s\n' % (directory, e))
+        if tmp_filename is not None and os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+        return grid
+
+    return np.load(filename, mmap_mode='r')
 
+def _generate(num_dims, grid_size, grid_seed):
+    grid = sobol(grid_size+grid_seed, num_dims)[grid_seed:]
+    grid.flags.writeable = False
+    return grid
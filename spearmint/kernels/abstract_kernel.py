@@ -209,5 +209,18 @@ class AbstractKernel(object):
     def cross_cov_grad_data(self, inputs_1, inputs_2):
         pass
 
+    # Both cross_cov and cross_cov_grad_data, for kernels that
+    # can share the computations between them
+    def cross_cov_and_grad_data(self, inputs_1, inputs_2):
+        return self.cross_cov(inputs_1, inputs_2), self.cross_cov_grad_data(inputs_1, inputs_2)
+
+    # The gradients wrt the hypers of a scalar function of cov(inputs), as a
+    # list of (hyper, gradient) pairs. V is the gradient of the function wrt
+    # cov(inputs), e.g. for the log marginal likelihood of a GP.
+    def cov_grad_hypers(self, inputs, V):
+        if self.hypers is None:
+            return []
+        raise NotImplementedError('%s does not implement gradients wrt its hypers.' % self.__class__.__name__)
+
 
 
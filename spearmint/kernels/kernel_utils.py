@@ -184,7 +184,6 @@
 
 
 import numpy as np
-import weave
 from scipy.spatial.distance import cdist
 
 def dist2(ls, x1, x2=None):
@@ -214,27 +213,11 @@ def grad_dist2(ls, x1, x2=None):
     # Rescale.
     x1 = x1 / ls
     x2 = x2 / ls
-    
-    N = x1.shape[0]
-    M = x2.shape[0]
-    D = x1.shape[1]
-    gX = np.zeros((x1.shape[0],x2.shape[0],x1.shape[1]))
 
-    code = \
-    """
-    for (int i=0; i<N; i++)
-      for (int j=0; j<M; j++)
-        for (int d=0; d<D; d++)
-          gX(i,j,d) = (2/ls(d))*(x1(i,d) - x2(j,d));
-    """
-    try:
-        scipy.weave.inline(code, ['x1','x2','gX','ls','M','N','D'], \
-                           type_converters=scipy.weave.converters.blitz, \
-                           compiler='gcc')
-    except:
-    # The C code weave above is 10x faster than this:
-        for i in xrange(0,x1.shape[0]):
-            gX[i,:,:] = 2*(x1[i,:] - x2[:,:])*(1/ls)
+    # gX[i,j,d] = (2/ls[d])*(x1[i,d] - x2[j,d]), scaled in place so
+    # that only one NxMxD array is allocated
+    gX  = x1[:,np.newaxis,:] - x2[np.newaxis,:,:]
+    gX *= 2/ls
 
     return gX
 
@@ -189,13 +189,14 @@ import kernel_utils
 from .abstract_kernel import AbstractKernel
 from ..utils          import priors
 from ..utils.param    import Param as Hyperparameter
+from ..utils.memo     import ArrayMemo
 
 SQRT_3 = np.sqrt(3.0)
 SQRT_5 = np.sqrt(5.0)
 
 
 class Matern52(AbstractKernel):
-    def __init__(self, num_dims, length_scale=None, name='Matern52'):
+    def __init__(self, num_dims, length_scale=None, name='Matern52', cache_budget=None):
         self.name     = name
         self.num_dims = num_dims
 
@@ -209,12 +210,29 @@ class Matern52(AbstractKernel):
 
         assert self.ls.value.shape[0] == self.num_dims
 
+        # The squared distances between the data inputs don't change while
+        # the hypers of the other kernels are sampled. Only the last ones
+        # are kept, because they take as much memory as the covariance.
+        self._memo = ArrayMemo(max_size=1, budget=cache_budget)
+
     @property
     def hypers(self):
         return self.ls
 
+    def _memo_dist2(self, inputs):
+        """the squared distances between the inputs scaled by the length
+        scales, reusing the last result for the same array and length scales"""
+        r2 = self._memo.get((inputs,), [self.ls.value])
+        if r2 is None:
+            r2 = self._memo.put((inputs,), [self.ls.value], np.abs(kernel_utils.dist2(self.ls.value, inputs, inputs)))
+
+        return r2
+
     def cov(self, inputs):
-        return self.cross_cov(inputs, inputs)
+        r2 = self._memo_dist2(inputs)
+        r  = np.sqrt(r2)
+
+        return (1.0 + SQRT_5*r + (5.0/3.0)*r2) * np.exp(-SQRT_5*r)
 
     def diag_cov(self, inputs):
         return np.ones(inputs.shape[0])
@@ -229,9 +247,31 @@ class Matern52(AbstractKernel):
     def cross_cov_grad_data(self, inputs_1, inputs_2):
         # NOTE: This is the gradient wrt the inputs of inputs_2
         # The gradient wrt the inputs of inputs_1 is -1 times this
+        return self.cross_cov_and_grad_data(inputs_1, inputs_2)[1]
+
+    def cov_grad_hypers(self, inputs, V):
+        r2 = self._memo_dist2(inputs)
+        r  = np.sqrt(r2)
+
+        # V times the derivative of the covariance wrt r2
+        M = -(5.0/6.0)*np.exp(-SQRT_5*r)*(1 + SQRT_5*r) * V
+
+        # r2 = sum_d (x_id - x_jd)^2 / ls_d^2, and sum_ij M_ij (x_id - x_jd)^2
+        # is computed without building the NxNxD array of differences
+        sq_diff = (inputs**2).T.dot(M.sum(0) + M.sum(1)) - 2*np.sum(inputs*M.dot(inputs), axis=0)
+
+        return [(self.ls, -2.0*sq_diff/self.ls.value**3)]
+
+    def cross_cov_and_grad_data(self, inputs_1, inputs_2):
+        # The distances and the exponential are computed once for both
         r2      = np.abs(kernel_utils.dist2(self.ls.value, inputs_1, inputs_2))
         r       = np.sqrt(r2)
-        grad_r2 = (5.0/6.0)*np.exp(-SQRT_5*r)*(1 + SQRT_5*r)
+        exp_r   = np.exp(-SQRT_5*r)
+        cov     = (1.0 + SQRT_5*r + (5.0/3.0)*r2) * exp_r
+        grad_r2 = (5.0/6.0)*exp_r*(1 + SQRT_5*r)
+
+        grad  = kernel_utils.grad_dist2(self.ls.value, inputs_1, inputs_2)
+        grad *= grad_r2[:,:,np.newaxis]
 
-        return grad_r2[:,:,np.newaxis] * kernel_utils.grad_dist2(self.ls.value, inputs_1, inputs_2)
+        return cov, grad
 
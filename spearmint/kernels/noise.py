@@ -219,3 +219,6 @@ class Noise(AbstractKernel):
     def cross_cov_grad_data(self, inputs_1, inputs_2):
        return np.zeros((inputs_1.shape[0],inputs_2.shape[0],self.num_dims))
 
+    def cov_grad_hypers(self, inputs, V):
+        return [(self.noise, np.atleast_1d(np.trace(V)))]
+
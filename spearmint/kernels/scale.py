@@ -183,6 +183,8 @@
 # its Institution.
 
 
+import numpy as np
+
 from .abstract_kernel import AbstractKernel
 from ..utils          import priors
 from ..utils.param    import Param as Hyperparameter
@@ -218,3 +220,11 @@ class Scale(AbstractKernel):
     def cross_cov_grad_data(self, inputs_1, inputs_2):
         return self.amp2.value*self.kernel.cross_cov_grad_data(inputs_1,inputs_2)
 
+    def cov_grad_hypers(self, inputs, V):
+        grad_amp2 = np.sum(V*self.kernel.cov(inputs))
+        return [(self.amp2, np.atleast_1d(grad_amp2))] + self.kernel.cov_grad_hypers(inputs, self.amp2.value*V)
+
+    def cross_cov_and_grad_data(self, inputs_1, inputs_2):
+        cov, grad = self.kernel.cross_cov_and_grad_data(inputs_1,inputs_2)
+        return self.amp2.value*cov, self.amp2.value*grad
+
@@ -203,3 +203,10 @@ class SumKernel(AbstractKernel):
     def cross_cov_grad_data(self, inputs_1, inputs_2):
         return reduce(lambda dK1, dK2: dK1+dK2, [kernel.cross_cov_grad_data(inputs_1,inputs_2) for kernel in self.kernels])
 
+    def cov_grad_hypers(self, inputs, V):
+        return [grad for kernel in self.kernels for grad in kernel.cov_grad_hypers(inputs, V)]
+
+    def cross_cov_and_grad_data(self, inputs_1, inputs_2):
+        covs, grads = zip(*[kernel.cross_cov_and_grad_data(inputs_1,inputs_2) for kernel in self.kernels])
+        return reduce(lambda K1, K2: K1+K2, covs), reduce(lambda dK1, dK2: dK1+dK2, grads)
+
@@ -183,7 +183,10 @@
 # its Institution.
 
 
+import numpy as np
+
 from .abstract_kernel import AbstractKernel
+from ..utils.memo     import ArrayMemo
 
 
 class TransformKernel(AbstractKernel):
@@ -191,19 +194,35 @@ class TransformKernel(AbstractKernel):
     This kernel applies a transformation to the inputs and gives 
     the transformed inputs to another kernel.
     """
-    def __init__(self, kernel, transformer, name='TransformKernel'):
+    def __init__(self, kernel, transformer, name='TransformKernel', cache_budget=None):
         self.name        = name
         self.kernel      = kernel
         self.transformer = transformer
 
+        # The data inputs are transformed again and again with the same
+        # transformation hypers, e.g. while sampling the other hypers or
+        # predicting under each state
+        self._memo = ArrayMemo(budget=cache_budget)
+
+    def _memo_forward_pass(self, inputs):
+        """transform the inputs, reusing the result for the same array and
+        transformation hypers. This doesn't set up the transformer for a
+        backward pass."""
+        hyper_values = [hyper.value for hyper in self.transformer.hypers]
+        tinputs      = self._memo.get((inputs,), hyper_values)
+        if tinputs is None:
+            tinputs = self._memo.put((inputs,), hyper_values, self.transformer.forward_pass(inputs))
+
+        return tinputs
+
     def cov(self, inputs):
-        return self.kernel.cov(self.transformer.forward_pass(inputs))
+        return self.kernel.cov(self._memo_forward_pass(inputs))
 
     def diag_cov(self, inputs):
         return self.kernel.diag_cov(self.transformer.forward_pass(inputs))
 
     def cross_cov(self, inputs_1, inputs_2):
-        return self.kernel.cross_cov(self.transformer.forward_pass(inputs_1),
+        return self.kernel.cross_cov(self._memo_forward_pass(inputs_1),
                 self.transformer.forward_pass(inputs_2))
 
     # This is the gradient wrt **inputs_2**
@@ -211,10 +230,34 @@ class TransformKernel(AbstractKernel):
         # NOTE: The ordering is very important here. The forward pass
         # changes the state of the transformer by storing intermediate
         # computations. These need to be used in the backward pass.
-        tinputs_1 = self.transformer.forward_pass(inputs_1)
+        tinputs_1 = self._memo_forward_pass(inputs_1)
         tinputs_2 = self.transformer.forward_pass(inputs_2)
         
         kernel_grad = self.kernel.cross_cov_grad_data(tinputs_1,tinputs_2)
 
         return self.transformer.backward_pass(kernel_grad)
 
+    def cov_grad_hypers(self, inputs, V):
+        # A regular forward pass, to set up the transformer for the backward pass
+        tinputs = self.transformer.forward_pass(inputs)
+        grads   = self.kernel.cov_grad_hypers(tinputs, V)
+
+        if self.transformer.hypers:
+            # The gradient wrt the transformed inputs. This assumes that the
+            # kernel is stationary, so that the gradient of cov[i,j] wrt
+            # tinputs[i] is -1 times the one wrt tinputs[j].
+            kernel_grad = self.kernel.cross_cov_grad_data(tinputs, tinputs)
+            V_inputs    = np.einsum('ij,ijd->jd', V + V.T, kernel_grad)
+            grads.extend(self.transformer.backward_pass_hypers(V_inputs))
+
+        return grads
+
+    def cross_cov_and_grad_data(self, inputs_1, inputs_2):
+        # The same ordering as in cross_cov_grad_data matters here
+        tinputs_1 = self._memo_forward_pass(inputs_1)
+        tinputs_2 = self.transformer.forward_pass(inputs_2)
+
+        cov, kernel_grad = self.kernel.cross_cov_and_grad_data(tinputs_1,tinputs_2)
+
+        return cov, self.transformer.backward_pass(kernel_grad)
+
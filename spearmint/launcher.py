@@ -189,7 +189,7 @@ import optparse
 import subprocess
 import numpy as np
 
-from spearmint.utils.database.mongodb import MongoDB
+from spearmint.utils.database import connect
 
 def main():
     parser = optparse.OptionParser(usage="usage: %prog [options]")
@@ -223,12 +223,12 @@ def launch(db_address, experiment_name, job_id):
     Launches a job from on a given id.
     """
 
-    db  = MongoDB(database_address=db_address)
-    job = db.load(experiment_name, 'jobs', {'id' : job_id})
+    db  = connect(db_address)
 
-    start_time        = time.time()
-    job['start time'] = start_time
-    db.save(job, experiment_name, 'jobs', {'id' : job_id})
+    # Record the start time and get the job in one round-trip
+    start_time = time.time()
+    job        = db.update({'start time' : start_time, 'modified time' : start_time},
+                           experiment_name, 'jobs', {'id' : job_id})
 
     sys.stderr.write("Job launching after %0.2f seconds in submission.\n" 
                      % (start_time-job['submit time']))
@@ -279,18 +279,20 @@ def launch(db_address, experiment_name, job_id):
         sys.stderr.write("Completed successfully in %0.2f seconds. [%s]\n" 
                          % (end_time-start_time, result))
         
-        job['values']   = result
-        job['status']   = 'complete'
-        job['end time'] = end_time
+        update_fields = {'values'        : result,
+                         'status'        : 'complete',
+                         'end time'      : end_time,
+                         'modified time' : end_time}
 
     else:
         sys.stderr.write("Job failed in %0.2f seconds.\n" % (end_time-start_time))
     
         # Update metadata.
-        job['status']   = 'broken'
-        job['end time'] = end_time
+        update_fields = {'status'        : 'broken',
+                         'end time'      : end_time,
+                         'modified time' : end_time}
 
-    db.save(job, experiment_name, 'jobs', {'id' : job_id})
+    db.update(update_fields, experiment_name, 'jobs', {'id' : job_id})
 
 def python_launcher(job):
     # Run a Python function
@@ -187,6 +187,7 @@ import optparse
 import importlib
 import time
 import os
+import threading
 
 import numpy as np
 
@@ -195,7 +196,7 @@ except ImportError: import json
 
 from collections import OrderedDict
 
-from spearmint.utils.database.mongodb import MongoDB
+from spearmint.utils.database         import connect
 from spearmint.tasks.task_group       import TaskGroup
 
 from spearmint.resources.resource import parse_resources_from_config
@@ -232,7 +233,7 @@ def get_options():
         options['tasks'] = {'main' : {'type' : 'OBJECTIVE', 'likelihood' : options.get('likelihood', 'GAUSSIAN')}}
 
     # Set DB address
-    db_address = parse_db_address(options)
+    db_address = parse_db_address(options, expt_dir)
     if 'database' not in options:
         options['database'] = {'name': 'spearmint', 'address': db_address}
     else:
@@ -258,13 +259,25 @@ def main():
     # Connect to the database
     db_address = options['database']['address']
     sys.stderr.write('Using database at %s.\n' % db_address)        
-    db         = MongoDB(database_address=db_address)
+    db         = connect(db_address)
+
+    # Keep the jobs in memory and only pull the ones that changed on each poll
+    job_cache  = JobCache(db, experiment_name)
+
+    # In pipelined mode each resource gets a background worker with its own
+    # chooser that keeps a queue of suggestions ready
+    pipelines = {}
+    if options.get('pipeline-depth', 0) > 0:
+        for resource_name, resource in resources.iteritems():
+            pipelines[resource_name] = SuggestionPipeline(chooser_module.init(options), resource.tasks, 
+                                                          db_address, expt_dir, options)
+            pipelines[resource_name].start()
     
     while True:
 
         for resource_name, resource in resources.iteritems():
 
-            jobs = load_jobs(db, experiment_name)
+            jobs = job_cache.refresh()
             # resource.printStatus(jobs)
 
             # If the resource is currently accepting more jobs
@@ -275,29 +288,30 @@ def main():
 
             while resource.acceptingJobs(jobs):
 
-                # Load jobs from DB 
-                # (move out of one or both loops?) would need to pass into load_tasks
-                jobs = load_jobs(db, experiment_name)
+                # Pull in any jobs that changed since the last poll
+                jobs = job_cache.refresh()
                 
                 # Remove any broken jobs from pending.
                 remove_broken_jobs(db, jobs, experiment_name, resources)
 
-                # Get a suggestion for the next job
-                suggested_job = get_suggestion(chooser, resource.tasks, db, expt_dir, options, resource_name)
-    
-                # Submit the job to the appropriate resource
-                process_id = resource.attemptDispatch(experiment_name, suggested_job, db_address, expt_dir)
-
-                # Set the status of the job appropriately (successfully submitted or not)
-                if process_id is None:
-                    suggested_job['status'] = 'broken'
-                    save_job(suggested_job, db, experiment_name)
+                # Get suggestions for the next jobs, as many as there are free slots
+                if resource_name in pipelines:
+                    suggested_jobs = [pipelines[resource_name].get_job(db, resource_name, jobs)]
                 else:
-                    suggested_job['status'] = 'pending'
-                    suggested_job['proc_id'] = process_id
-                    save_job(suggested_job, db, experiment_name)
+                    suggested_jobs = get_suggestions(chooser, resource.tasks, db, expt_dir, options, resource_name, 
+                                                     max(resource.numFreeSlots(jobs), 1), jobs)
+
+                for suggested_job in suggested_jobs:
+                    # Submit the job to the appropriate resource
+                    process_id = resource.attemptDispatch(experiment_name, suggested_job, db_address, expt_dir)
 
-                jobs = load_jobs(db, experiment_name)
+                    # Set the status of the job appropriately (successfully submitted or not)
+                    if process_id is None:
+                        update_job(suggested_job, db, experiment_name, {'status' : 'broken'})
+                    else:
+                        update_job(suggested_job, db, experiment_name, {'status' : 'pending', 'proc_id' : process_id})
+
+                jobs = job_cache.refresh()
 
                 # Print out the status of the resources
                 # resource.printStatus(jobs)
@@ -305,14 +319,14 @@ def main():
 
         # If no resources are accepting jobs, sleep
         # (they might be accepting if suggest takes a while and so some jobs already finished by the time this point is reached)
-        if tired(db, experiment_name, resources):
+        if tired(job_cache, resources):
             time.sleep(options.get('polling-time', 5))
 
-def tired(db, experiment_name, resources):
+def tired(job_cache, resources):
     """
     return True if no resources are accepting jobs
     """
-    jobs = load_jobs(db, experiment_name)
+    jobs = job_cache.refresh()
     for resource_name, resource in resources.iteritems():
         if resource.acceptingJobs(jobs):
             return False
@@ -323,17 +337,26 @@ def remove_broken_jobs(db, jobs, experiment_name, resources):
     Look through jobs and for those that are pending but not alive, set
     their status to 'broken'
     """
+    updates = []
     if jobs:
         for job in jobs:
             if job['status'] == 'pending':
                 if not resources[job['resource']].isJobAlive(job):
                     sys.stderr.write('Broken job %s detected.\n' % job['id'])
-                    job['status'] = 'broken'
-                    save_job(job, db, experiment_name)
+                    job['status']        = 'broken'
+                    job['modified time'] = time.time()
+                    updates.append(({'id' : job['id']}, {'status' : job['status'], 'modified time' : job['modified time']}))
+
+    # Mark all of them as broken in a single write
+    db.bulk_update(updates, experiment_name, 'jobs')
 
 # TODO: support decoupling i.e. task_names containing more than one task,
 #       and the chooser must choose between them in addition to choosing X
-def get_suggestion(chooser, task_names, db, expt_dir, options, resource_name):
+def get_suggestion(chooser, task_names, db, expt_dir, options, resource_name, jobs=None):
+    return get_suggestions(chooser, task_names, db, expt_dir, options, resource_name, 1, jobs)[0]
+
+def get_suggestions(chooser, task_names, db, expt_dir, options, resource_name, num_suggestions, jobs=None):
+    """fit the chooser once and create and save num_suggestions new jobs"""
 
     if len(task_names) == 0:
         raise Exception("Error: trying to obtain suggestion for 0 tasks ")
@@ -345,8 +368,11 @@ def get_suggestion(chooser, task_names, db, expt_dir, options, resource_name):
     # For now we aren't doing any multi-task, so the below is simpler
     # task_options = options["tasks"]
 
+    if jobs is None:
+        jobs = load_jobs(db, experiment_name)
+
     # Load the tasks from the database -- only those in task_names!
-    task_group = load_task_group(db, options, task_names)
+    task_group = load_task_group(db, options, task_names, jobs)
 
     # Load the model hypers from the database.
     hypers = load_hypers(db, experiment_name)
@@ -357,8 +383,24 @@ def get_suggestion(chooser, task_names, db, expt_dir, options, resource_name):
     # Save the hyperparameters to the database.
     save_hypers(hypers, db, experiment_name)
 
-    # Ask the chooser to actually pick one.
-    suggested_input = chooser.suggest()
+    # Ask the chooser to actually pick them.
+    if num_suggestions == 1:
+        suggested_inputs = [chooser.suggest()]
+    else:
+        suggested_inputs = chooser.suggest_batch(num_suggestions)
+
+    new_jobs = []
+    for suggested_input in suggested_inputs:
+        new_jobs.append(create_job(task_group.paramify(suggested_input), task_names, expt_dir, options, 
+                                   resource_name, jobs + new_jobs))
+
+    save_jobs(new_jobs, db, experiment_name)
+
+    return new_jobs
+
+def create_job(params, task_names, expt_dir, options, resource_name, jobs):
+    """return a new job with the given params, numbered after the given jobs"""
+    task_options = { task: options["tasks"][task] for task in task_names }
 
     # TODO: implelent this
     suggested_task = task_names[0]  
@@ -378,14 +420,11 @@ def get_suggestion(chooser, task_names, db, expt_dir, options, resource_name):
     else:
         raise Exception("language not specified for task %s" % suggested_task)
 
-
-    jobs = load_jobs(db, experiment_name)
-
     job_id = len(jobs) + 1
 
     job = {
         'id'          : job_id,
-        'params'      : task_group.paramify(suggested_input),
+        'params'      : params,
         'expt_dir'    : expt_dir,
         'tasks'       : task_names,
         'resource'    : resource_name,
@@ -397,8 +436,6 @@ def get_suggestion(chooser, task_names, db, expt_dir, options, resource_name):
         'end time'    : None
     }
 
-    save_job(job, db, experiment_name)
-
     return job
 
 def save_hypers(hypers, db, experiment_name):
@@ -408,7 +445,7 @@ def save_hypers(hypers, db, experiment_name):
 def load_hypers(db, experiment_name):
     return db.load(experiment_name, 'hypers')
 
-def load_jobs(db, experiment_name):
+def load_jobs(db, experiment_name, field_filters=None):
     """load the jobs from the database
     
     Returns
@@ -416,7 +453,7 @@ def load_jobs(db, experiment_name):
     jobs : list
         a list of jobs or an empty list
     """
-    jobs = db.load(experiment_name, 'jobs')
+    jobs = db.load(experiment_name, 'jobs', field_filters)
 
     if jobs is None:
         jobs = []
@@ -427,14 +464,234 @@ def load_jobs(db, experiment_name):
 
 def save_job(job, db, experiment_name):
     """save a job to the database"""
+    job['modified time'] = time.time()
     db.save(job, experiment_name, 'jobs', {'id' : job['id']})
 
-def load_task_group(db, options, task_names=None):
+def save_jobs(jobs, db, experiment_name):
+    """save several jobs to the database in a single write"""
+    modified_time = time.time()
+    for job in jobs:
+        job['modified time'] = modified_time
+    db.save_many(jobs, experiment_name, 'jobs')
+
+def update_job(job, db, experiment_name, update_fields):
+    """set some fields of a job, both in memory and in the database, in a
+    single round-trip"""
+    update_fields = dict(update_fields)
+    update_fields['modified time'] = time.time()
+
+    job.update(update_fields)
+    db.update(update_fields, experiment_name, 'jobs', {'id' : job['id']})
+
+class JobCache(object):
+    """keeps the jobs of an experiment in memory between polls
+
+    The first refresh loads every job. After that only the jobs whose
+    `modified time` (written by `save_job` and the launcher) is not older
+    than the newest one already seen are pulled from the database, so a
+    poll costs O(changed jobs) instead of O(all jobs).
+
+    The modification times come from the clocks of the machines that
+    write the jobs, and deleting a job leaves nothing to poll for, so
+    every `full_refresh_interval` seconds all the jobs are loaded again
+    and replace the cached ones.
+
+    Parameters
+    ----------
+    db : database object
+    experiment_name : str
+    overlap : float, optional
+        How many seconds before the newest modification already seen to
+        look back on each poll. This absorbs small clock skew between the
+        writers. Jobs that are pulled again are simply replaced.
+    full_refresh_interval : float, optional
+        How many seconds may pass between two full reloads. Updates missed
+        by the incremental polls, for example from a writer whose clock
+        is further behind than `overlap`, and deleted jobs are picked up
+        by the next full reload.
+    """
+    def __init__(self, db, experiment_name, overlap=60.0, full_refresh_interval=300.0):
+        self.db                    = db
+        self.experiment_name       = experiment_name
+        self.overlap               = overlap
+        self.full_refresh_interval = full_refresh_interval
+
+        self._jobs              = {}   # Jobs keyed by their id
+        self._last_modified     = None # Newest modification time seen so far
+        self._last_full_refresh = None # Local time of the last full reload
+
+    @property
+    def jobs(self):
+        """return the cached jobs as a list sorted by id"""
+        return [self._jobs[job_id] for job_id in sorted(self._jobs)]
+
+    def refresh(self):
+        """pull the jobs that changed since the last poll and return all jobs"""
+        now = time.time()
+
+        full_refresh = (self._last_full_refresh is None or
+                        now - self._last_full_refresh >= self.full_refresh_interval)
+        if full_refresh:
+            field_filters           = None
+            self._jobs              = {}
+            self._last_full_refresh = now
+        else:
+            field_filters = {'modified time' : {'$gte' : self._last_modified - self.overlap}}
+
+        for job in load_jobs(self.db, self.experiment_name, field_filters):
+            self._jobs[job['id']] = job
+
+            modified = job.get('modified time', None)
+            if modified is not None and (self._last_modified is None or modified > self._last_modified):
+                self._last_modified = modified
+
+        # Jobs written before modification times were recorded are all
+        # loaded by the first refresh, so start polling from now on.
+        if self._last_modified is None:
+            self._last_modified = now
+
+        return self.jobs
+
+class SuggestionPipeline(object):
+    """computes suggestions for a resource ahead of time in a background thread
+
+    The worker fits its own chooser whenever new results come in and then
+    keeps up to `pipeline-depth` suggestions ready. The pending jobs, the
+    queued suggestions and the suggestions taken but not yet seen in the
+    database are all treated as pending points, whose fantasies are
+    updated without refitting the hyperparameters, so that consecutive
+    suggestions are different. When new results come in the queued
+    suggestions are thrown away and the chooser is fit again.
+
+    Parameters
+    ----------
+    chooser : chooser object
+        Used only by the worker thread.
+    task_names : list
+    db_address : str
+        The worker opens its own connection to the database.
+    expt_dir : str
+    options : dict
+    """
+    def __init__(self, chooser, task_names, db_address, expt_dir, options):
+        self.chooser      = chooser
+        self.task_names   = task_names
+        self.db_address   = db_address
+        self.expt_dir     = expt_dir
+        self.options      = options
+        self.depth        = options['pipeline-depth']
+        self.polling_time = options.get('polling-time', 5)
+
+        self._queue     = [] # Suggestions ready to be dispatched
+        self._taken     = [] # Suggestions dispatched but maybe not yet seen by the worker
+        self._error     = None
+        self._stopped   = False
+        self._condition = threading.Condition()
+
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+
+    def start(self):
+        # Fork the workers of the chooser before the thread exists, as
+        # forking a process with threads only copies the calling thread
+        if hasattr(self.chooser, 'start_workers'):
+            self.chooser.start_workers()
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        self._thread.join()
+
+    def get_job(self, db, resource_name, jobs):
+        """wait for the next suggestion and create its job"""
+        with self._condition:
+            while not self._queue and self._error is None:
+                self._condition.wait(self.polling_time)
+            if self._error is not None:
+                raise self._error
+
+            suggestion = self._queue.pop(0)
+            self._taken.append(suggestion)
+            self._condition.notify_all()
+
+        job = create_job(suggestion['params'], self.task_names, self.expt_dir, self.options, resource_name, jobs)
+        save_job(job, db, self.options['experiment-name'])
+
+        with self._condition:
+            suggestion['id'] = job['id']
+
+        return job
+
+    def _run(self):
+        try:
+            self._work()
+        except Exception as e:
+            with self._condition:
+                self._error = e
+                self._condition.notify_all()
+            raise
+
+    def _work(self):
+        experiment_name = self.options['experiment-name']
+        task_options    = { task: self.options["tasks"][task] for task in self.task_names }
+
+        db           = connect(self.db_address)
+        job_cache    = JobCache(db, experiment_name)
+        num_complete = None
+
+        while True:
+            with self._condition:
+                if self._stopped:
+                    return
+
+            jobs = job_cache.refresh()
+
+            complete = len([job for job in jobs if job['status'] == 'complete'])
+            if complete != num_complete:
+                # New results: throw away the suggestions of the old model and fit again
+                with self._condition:
+                    self._queue = []
+                task_group = load_task_group(db, self.options, self.task_names, self._with_suggestions(jobs))
+                hypers     = self.chooser.fit(task_group, load_hypers(db, experiment_name), task_options)
+                save_hypers(hypers, db, experiment_name)
+                num_complete = complete
+            else:
+                with self._condition:
+                    if len(self._queue) >= self.depth:
+                        self._condition.wait(self.polling_time)
+                        continue
+
+                # Update the fantasies for the latest pending jobs and suggestions
+                task_group = load_task_group(db, self.options, self.task_names, self._with_suggestions(jobs))
+                self.chooser.update_pending(task_group)
+
+            params = task_group.paramify(self.chooser.suggest())
+
+            with self._condition:
+                self._queue.append({'params' : params})
+                self._condition.notify_all()
+
+    def _with_suggestions(self, jobs):
+        """return the jobs with the suggestions that are not in the database yet
+        added as pending jobs, and new jobs counted as pending as well"""
+        job_ids = set(job['id'] for job in jobs)
+
+        with self._condition:
+            self._taken = [s for s in self._taken if s.get('id') not in job_ids]
+            suggestions = self._taken + self._queue
+
+        jobs = [dict(job, status='pending') if job['status'] == 'new' else job for job in jobs]
+        return jobs + [{'params' : s['params'], 'status' : 'pending'} for s in suggestions]
+
+def load_task_group(db, options, task_names=None, jobs=None):
     if task_names is None:
         task_names = options['tasks'].keys()
     task_options = { task: options["tasks"][task] for task in task_names }
 
-    jobs = load_jobs(db, options['experiment-name'])
+    if jobs is None:
+        jobs = load_jobs(db, options['experiment-name'])
 
     task_group = TaskGroup(task_options, options['variables'])
 
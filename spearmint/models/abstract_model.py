@@ -214,6 +214,21 @@ class AbstractModel(object):
         """
         return function_over_hypers([self], fun, *fun_args, **fun_kwargs)
 
+    def predict_over_hypers(self, pred, compute_grad=False):
+        """Predict at pred under every stored hyperparameter sample.
+
+        Returns the same tuple as predict, but each array gets a leading axis
+        over the states. Averaging over that axis gives the same result as
+        function_over_hypers(self.predict, pred). Models that can predict for
+        all states at once should override this.
+        """
+        results = []
+        for i in xrange(self.num_states):
+            self.set_state(i)
+            results.append(self.predict(pred, compute_grad=compute_grad))
+
+        return tuple(np.array(result) for result in zip(*results))
+
 def function_over_hypers(models, fun, *fun_args, **fun_kwargs):
     """Compute the function fun while averaging over the stored hyperparameter samples of multiple models. 
     
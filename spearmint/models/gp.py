@@ -183,17 +183,28 @@
 # its Institution.
 
 import sys
+import copy
+import hashlib
 import logging
-import numpy        as np
-import numpy.random as npr
-import scipy.linalg as spla
-import scipy.stats  as sps
+import multiprocessing
+import numpy          as np
+import numpy.random   as npr
+import scipy.linalg   as spla
+import scipy.stats    as sps
+import scipy.optimize as spo
+
+from collections import OrderedDict
 
 from .abstract_model          import AbstractModel
 from ..utils.param            import Param as Hyperparameter
+from ..utils                  import param as hyperparameter_utils
 from ..kernels                import Matern52, Noise, Scale, SumKernel, TransformKernel
 from ..sampling.slice_sampler import SliceSampler
+from ..sampling.hmc_sampler   import HMCSampler, log_space_mask, log_space_logprob_and_grad
+from ..sampling.diagnostics   import split_chains, potential_scale_reduction, effective_sample_size
 from ..utils                  import priors
+from ..utils.linalg           import chol_extend
+from ..utils.memo             import CacheBudget, total_nbytes
 from ..transformations        import BetaWarp, Transformer
 
 try:
@@ -203,8 +214,13 @@ except:
     log    = logging.getLogger()
     print 'Not running from main.'
 
-DEFAULT_MCMC_ITERS = 10
-DEFAULT_BURNIN     = 100
+DEFAULT_MCMC_ITERS   = 10
+DEFAULT_BURNIN       = 100
+DEFAULT_MAX_CACHE_MB = 256
+DEFAULT_FIT_RESTARTS = 5
+DEFAULT_MAX_RHAT     = 1.1
+MIN_RHAT_SAMPLES     = 4 # The split R-hat needs two samples in each half
+RESTART_STD          = 0.5
 
 class GP(AbstractModel):
     """Gaussian process model
@@ -221,7 +237,48 @@ class GP(AbstractModel):
     mcmc_iters : int, optional
     burnin : int, optional
     thinning : int, optional
+    mcmc_adaptive : bool, optional
+        Continue the chain of the previous fit and choose the number of new
+        samples from the diagnostics of the chain, instead of always
+        collecting mcmc_iters samples. Default is False.
+    mcmc_min_iters : int, optional
+        The number of samples collected between two checks of the
+        diagnostics in the adaptive mode.
+    mcmc_max_iters : int, optional
+        The most samples collected by a fit in the adaptive mode.
+    mcmc_target_ess : float, optional
+        The effective sample size the adaptive mode collects samples until.
+    mcmc_max_rhat : float, optional
+        The largest potential scale reduction (R-hat) at which the adaptive
+        mode considers the chain converged.
+    mcmc_chains : int, optional
+        The number of independent chains, which split the mcmc_iters samples
+        between them. Default is 1.
+    mcmc_workers : int, optional
+        The number of processes the chains run in. Default is one per chain,
+        up to the number of cores.
     num_fantasies : int, optional
+    fit-mode : str, optional
+        `mcmc` (the default) samples the hyperparameters. `optimize` finds
+        their MAP values with L-BFGS, which gives a single state and so
+        much cheaper fits and predictions.
+    fit-restarts : int, optional
+        The number of L-BFGS runs in the optimize fit mode. The first one
+        starts from the current hypers, e.g. those of the previous fit.
+    sampler : str, optional
+        The sampler of the hyperparameters: `slice` (the default) slice
+        samples them in groups, `hmc` samples them all jointly with
+        Hamiltonian Monte Carlo, using the gradients of the likelihood.
+        Its step size is only adapted during burn-in. The gradients wrt
+        the warping parameters are finite differences of the beta cdf.
+    max_cache_mb : float, optional
+        Memory budget for everything the GP caches: the computations of the
+        states, the Cholesky factors kept for extending and the memos of
+        the kernels. When the
+        states don't all fit, the most recently used ones are kept.
+    cache_float32 : bool, optional
+        Store the cached computations in single precision, which halves
+        their memory use. Default is False.
     """
     def __init__(self, num_dims, **options):
         self.num_dims = num_dims
@@ -234,8 +291,28 @@ class GP(AbstractModel):
         self.mcmc_iters       = int(options.get("mcmc_iters", DEFAULT_MCMC_ITERS))
         self.burnin           = int(options.get("burnin", DEFAULT_BURNIN))
         self.thinning         = int(options.get("thinning", 0))
+        self.mcmc_adaptive    = bool(options.get("mcmc_adaptive", False))
+        self.mcmc_min_iters   = int(options.get("mcmc_min_iters", max(self.mcmc_iters//5, 1)))
+        self.mcmc_max_iters   = int(options.get("mcmc_max_iters", 5*self.mcmc_iters))
+        self.mcmc_target_ess  = float(options.get("mcmc_target_ess", self.mcmc_iters/2.0))
+        self.mcmc_max_rhat    = float(options.get("mcmc_max_rhat", DEFAULT_MAX_RHAT))
+        self.mcmc_chains      = int(options.get("mcmc_chains", 1))
+        self.mcmc_workers     = int(options.get("mcmc_workers", min(self.mcmc_chains, multiprocessing.cpu_count())))
+        self.sampler          = options.get("sampler", "slice").lower()
+        self.fit_mode         = options.get("fit-mode", "mcmc").lower()
+        self.fit_restarts     = int(options.get("fit-restarts", DEFAULT_FIT_RESTARTS))
+
+        if self.sampler not in ['slice', 'hmc']:
+            raise Exception('Unknown hyperparameter sampler: %s' % self.sampler)
+        if self.fit_mode not in ['mcmc', 'optimize']:
+            raise Exception('Unknown fit mode: %s' % self.fit_mode)
+        if self.mcmc_chains < 1:
+            raise Exception('mcmc_chains must be at least 1')
+        if self.mcmc_adaptive and self.mcmc_chains > 1:
+            raise Exception('The adaptive MCMC mode only supports a single chain')
 
         self._inputs = None # Matrix of data inputs
+        self._inputs_with_pending = (None, None, None) # The data and pending inputs stacked, with these inputs.
         self._values = None # Vector of data values
         self.pending = None # Matrix of pending inputs
         # TODO: support meta-data
@@ -246,12 +323,19 @@ class GP(AbstractModel):
         self.num_fantasies = options.get('num_fantasies', 1)  # TODO -- make in config
 
         self._caching                    = bool(options.get("caching", True))
-        self._cache_list                 = [] # Cached computations for re-use.
+        self._cache                      = OrderedDict() # Cached computations of each state, least recently used first.
+        self._chol_store                 = OrderedDict() # Recent Cholesky factors for each hypers, for extending, least recently used first.
+        self._chol_store_inputs          = None # The copy of the inputs the stored factors share.
+        self._prediction_cache           = None # Predictions over hypers, only kept while enabled.
+        self._prediction_cache_bytes     = 0
+        self._prediction_cache_max_bytes = 0
         self._hypers_list                = [] # Hyperparameter dicts for each state.
+        self._chain_hypers               = [] # Hyperparameter dicts of the last state of each chain.
         self._fantasy_values_list        = [] # Fantasy values generated from pending samples.
         self.state                       = None
         self._random_state               = npr.get_state()
         self._samplers                   = []
+        self.diagnostics                 = {} # Diagnostics of the chain of the last fit.
         self._use_mean_if_single_fantasy = True
         
         self._kernel            = None
@@ -260,8 +344,13 @@ class GP(AbstractModel):
         self.num_states   = 0
         self.chain_length = 0
 
-        self.max_cache_mb    = 256 # TODO -- make in config
+        self.max_cache_mb    = float(options.get("max_cache_mb", DEFAULT_MAX_CACHE_MB))
         self.max_cache_bytes = self.max_cache_mb*1024*1024
+        self.cache_dtype     = np.float32 if options.get("cache_float32", False) else np.float64
+
+        # The budget the caches of the GP and the memos of its kernels share
+        self._cache_budget = CacheBudget(self.max_cache_bytes)
+        self._cache_budget.register(self)
 
         self._build()
 
@@ -282,33 +371,211 @@ class GP(AbstractModel):
             param.value = param.initial_value
 
     def _pull_from_cache_or_compute(self):
-        if self.caching and len(self._cache_list) == self.num_states:
-            chol  = self._cache_list[self.state]['chol']
-            alpha = self._cache_list[self.state]['alpha']
+        cache = self._cache_get(self.state) if self.caching else None
+        if cache is not None:
+            chol  = cache['chol']
+            alpha = cache['alpha']
         else:
-            chol  = spla.cholesky(self.kernel.cov(self.inputs), lower=True)
+            chol  = self._compute_cholesky()
             alpha = spla.cho_solve((chol, True), self.values - self.mean.value)
 
+            if self.caching and self.state is not None:
+                # Don't evict other states for this one: when all the states
+                # are visited in turn that would leave none of them cached
+                self._cache_put(self.state, chol, alpha, evict=False)
+
         return chol, alpha
 
+    @property
+    def _cache_bytes(self):
+        """the memory used by all the caches under the budget, counting the
+        arrays they share once"""
+        return self._cache_budget.nbytes
+
+    @property
+    def cached_bytes(self):
+        """the memory held by the caches of the GP, for its cache budget"""
+        return total_nbytes(self._cache_arrays())
+
+    def _cache_arrays(self):
+        for cache in self._cache.itervalues():
+            yield cache['chol']
+            yield cache['alpha']
+        for entries in self._chol_store.itervalues():
+            for entry in entries:
+                yield entry['chol']
+                yield entry['inputs']
+
+    def _cache_fits(self, arrays):
+        """return whether caching these arrays, except those that are already
+        cached, stays within the budget"""
+        held = set(id(a) for a in self._cache_arrays())
+        return self._cache_budget.fits(total_nbytes(a for a in arrays if id(a) not in held))
+
+    def _make_room(self, arrays, evict_states=True):
+        """evict cached computations until the arrays fit in the budget, and
+        return whether they do. The memos of the kernels mostly serve the
+        sampling of the hypers and the stored factors only save
+        refactorizations, so they go first. The least recently used states
+        go last, if evict_states."""
+        while not self._cache_fits(arrays):
+            memos = [cache for cache in self._cache_budget.caches if cache is not self and cache.cached_bytes > 0]
+            if memos:
+                for memo in memos:
+                    memo.clear()
+            elif self._chol_store:
+                self._chol_store.popitem(last=False)
+            elif evict_states and self._cache:
+                self._cache.popitem(last=False)
+            else:
+                return False
+
+        return True
+
+    def _cache_get(self, state):
+        """return the cached computations of a state, or None if they are not
+        cached, and mark the state as the most recently used"""
+        cache = self._cache.pop(state, None)
+        if cache is None or cache['chol'].shape[0] != self.inputs.shape[0]:
+            return None
+
+        self._cache[state] = cache
+        return {
+            'chol'  : cache['chol'].astype(np.float64, copy=False),
+            'alpha' : cache['alpha'].astype(np.float64, copy=False)
+        }
+
+    def _cache_put(self, state, chol, alpha, evict=True):
+        """cache the computations of a state, if they fit in the memory
+        budget after evicting the least recently used states (if evict)"""
+        cache = {
+            'chol'  : chol.astype(self.cache_dtype, copy=False),
+            'alpha' : alpha.astype(self.cache_dtype, copy=False)
+        }
+        self._cache.pop(state, None)
+
+        arrays = [cache['chol'], cache['alpha']]
+        fits   = self._make_room(arrays) if evict else self._cache_fits(arrays)
+        if fits:
+            self._cache[state] = cache
+
+    def _chol_store_put(self, hypers, inputs, chol):
+        """store the Cholesky factor for some hypers for extending it later,
+        if it fits in the memory budget after evicting the factors of the
+        least recently used hypers"""
+        # The factors share a copy of the inputs
+        if self._chol_store_inputs is None or not np.array_equal(self._chol_store_inputs, inputs):
+            self._chol_store_inputs = inputs.copy()
+
+        entry = {
+            'hypers' : dict((name, copy.copy(value)) for name, value in hypers.iteritems()),
+            'inputs' : self._chol_store_inputs,
+            'chol'   : chol
+        }
+
+        # Keep the two most recent factors, e.g. with and without pending points
+        key     = _hypers_key(hypers)
+        entries = [e for e in self._chol_store.pop(key, []) if e['chol'].shape[0] != chol.shape[0]][-1:]
+
+        arrays = [chol, entry['inputs']] + [a for e in entries for a in (e['chol'], e['inputs'])]
+        if self._make_room(arrays, evict_states=False):
+            self._chol_store[key] = entries + [entry]
+
+    def _prune_chol_store(self, inputs=None, hypers_list=None):
+        """drop the stored factors that can't be extended any more: those
+        whose inputs are not a prefix of inputs, and those of hypers that
+        are not in hypers_list"""
+        keys = None if hypers_list is None else set(_hypers_key(hypers) for hypers in hypers_list)
+
+        for key in self._chol_store.keys():
+            entries = self._chol_store[key]
+            if keys is not None and key not in keys:
+                entries = []
+            if inputs is not None:
+                entries = [e for e in entries if e['inputs'].shape[0] <= inputs.shape[0]
+                           and np.array_equal(e['inputs'], inputs[:e['inputs'].shape[0]])]
+
+            if entries:
+                self._chol_store[key] = entries
+            else:
+                del self._chol_store[key]
+
+        if not self._chol_store:
+            self._chol_store_inputs = None
+
+    def _clear_cache(self):
+        self._cache = OrderedDict()
+
+    def _compute_cholesky(self):
+        """return the Cholesky factor of the kernel matrix of the current inputs
+
+        If a factor was already computed for the current hyperparameters on
+        a prefix of the inputs (e.g. before the pending points were appended,
+        or in an earlier fit before a new observation was) it is extended
+        with the new rows, which costs O(N^2*M) instead of O((N+M)^3) for M
+        new inputs.
+        """
+        inputs = self.inputs
+        hypers = dict((name, param.value) for name, param in self.params.iteritems())
+        chol   = None
+
+        if self.caching:
+            # Try the longest stored factor first
+            key     = _hypers_key(hypers)
+            entries = sorted(self._chol_store.pop(key, []), key=lambda e: -e['chol'].shape[0])
+            if entries:
+                self._chol_store[key] = entries
+            for entry in entries:
+                num_prev = entry['chol'].shape[0]
+                if num_prev > inputs.shape[0] or not _same_hypers(entry['hypers'], hypers) \
+                        or not np.array_equal(entry['inputs'], inputs[:num_prev]):
+                    continue
+
+                if num_prev == inputs.shape[0]:
+                    chol = entry['chol']
+                else:
+                    new_inputs = inputs[num_prev:]
+                    try:
+                        chol = chol_extend(entry['chol'],
+                                           self.kernel.cross_cov(entry['inputs'], new_inputs),
+                                           self.kernel.cov(new_inputs))
+                    except np.linalg.LinAlgError:
+                        chol = None
+                break
+
+        if chol is None:
+            chol = spla.cholesky(self.kernel.cov(inputs), lower=True)
+
+        if self.caching:
+            self._chol_store_put(hypers, inputs, chol)
+
+        return chol
+
     def _prepare_cache(self):
-        inputs_hash = hash(self.inputs.tostring())
+        # The factors of earlier states won't be extended any more
+        self._prune_chol_store(hypers_list=self._hypers_list)
+
         for i in xrange(self.num_states):
             self.set_state(i)
-            chol  = spla.cholesky(self.kernel.cov(self.inputs), lower=True)
+            chol  = self._compute_cholesky()
             alpha = spla.cho_solve((chol, True), self.values - self.mean.value)
-            cache_dict = {
-                'chol'  : chol,
-                'alpha' : alpha
-            }
-            self._cache_list.append(cache_dict)
+            self._cache_put(i, chol, alpha)
+
+        if len(self._cache) < self.num_states:
+            sys.stderr.write('Max memory limit of %d bytes reached. Caching intermediate computations '
+                             'for %d of %d states.\n' % (self.max_cache_bytes, len(self._cache), self.num_states))
 
     def _reset(self):
         """reset the GP
         """
-        self._cache_list          = []
         self._fantasy_values_list = []
         self._hypers_list         = []
+        self._chain_hypers        = []
+        self._clear_cache()
+        self._clear_prediction_cache()
+
+        # The stored factors can be extended with new observations
+        self._prune_chol_store(inputs=self.observed_inputs)
         
         self._reset_params()
         self.chain_length = 0
@@ -321,14 +588,14 @@ class GP(AbstractModel):
         transformer.add_layer(beta_warp)
 
         # Build the component kernels
-        input_kernel           = Matern52(self.num_dims)
+        input_kernel           = Matern52(self.num_dims, cache_budget=self._cache_budget)
         stability_noise_kernel = Noise(self.num_dims) # Even if noiseless we use some noise for stability
         scaled_input_kernel    = Scale(input_kernel)
         sum_kernel             = SumKernel(scaled_input_kernel, stability_noise_kernel)
         noise_kernel           = Noise(self.num_dims)
 
         # The final kernel applies the transformation.
-        self._kernel = TransformKernel(sum_kernel, transformer)
+        self._kernel = TransformKernel(sum_kernel, transformer, cache_budget=self._cache_budget)
 
         # Finally make a noisy version if necessary
         if not self.noiseless:
@@ -355,16 +622,27 @@ class GP(AbstractModel):
         }
 
         # Build the samplers
-        if self.noiseless:
-            self._samplers.append(SliceSampler(self.mean, amp2, compwise=False, thinning=self.thinning))
-        else:
+        to_sample = [self.mean, amp2]
+        if not self.noiseless:
             noise = noise_kernel.hypers
             self.params.update({'noise' : noise})
-            self._samplers.append(SliceSampler(self.mean, amp2, noise, compwise=False, thinning=self.thinning))
+            to_sample.append(noise)
+
+        if self.sampler == 'hmc':
+            self._samplers.append(HMCSampler(*(to_sample + [ls, beta_alpha, beta_beta]), thinning=self.thinning))
+        else:
+            self._samplers.append(SliceSampler(*to_sample, compwise=False, thinning=self.thinning))
+            self._samplers.append(SliceSampler(ls, beta_alpha, beta_beta, compwise=True, thinning=self.thinning))
 
-        self._samplers.append(SliceSampler(ls, beta_alpha, beta_beta, compwise=True, thinning=self.thinning))
+    def _adapt_samplers(self, adapt):
+        """turn the adaptation of the samplers that tune themselves on or off"""
+        for sampler in self._samplers:
+            if isinstance(sampler, HMCSampler):
+                sampler.adapt_step_size = adapt
 
     def _burn_samples(self, num_samples):
+        # The samplers may only tune themselves during burn-in
+        self._adapt_samplers(True)
         for i in xrange(num_samples):
             for sampler in self._samplers:
                 sampler.sample(self)
@@ -372,6 +650,8 @@ class GP(AbstractModel):
             self.chain_length += 1
 
     def _collect_samples(self, num_samples):
+        self._adapt_samplers(False)
+
         hypers_list = []
         for i in xrange(num_samples):
             for sampler in self._samplers:
@@ -382,6 +662,154 @@ class GP(AbstractModel):
 
         return hypers_list
 
+    def _collect_samples_adaptively(self, previous_hypers_list):
+        """return the hypers of the states after continuing the chain from the
+        states of the previous fit, previous_hypers_list. Samples are collected
+        mcmc_min_iters at a time until the effective sample size of the chain
+        reaches mcmc_target_ess and its split R-hat is below mcmc_max_rhat, or
+        mcmc_max_iters samples were collected.
+
+        The diagnostics are those of the log posterior of the states given the
+        current data. Those of the hypers themselves are too noisy on chains
+        this short, as some of them mix slowly. When the new data didn't move
+        the posterior, the previous states are still a good sample of it and
+        only a few new samples are needed. When the R-hat shows that the chain
+        drifted, its first half is discarded as burn-in, but never the last
+        mcmc_iters states. Until the chain has MIN_RHAT_SAMPLES states it is
+        too short to check, and sampling goes on. The last (up to)
+        mcmc_iters states of the chain are kept.
+        """
+        current_hypers = self.to_dict()['hypers']
+
+        chain = list(previous_hypers_list)
+        trace = []
+        for hypers in chain:
+            self._set_params_from_dict(hypers)
+            trace.append(self._log_posterior())
+
+        self._set_params_from_dict(current_hypers)
+
+        num_new = 0
+        rhat    = np.nan
+        ess     = 0.0
+        while num_new < self.mcmc_max_iters:
+            for i in xrange(min(self.mcmc_min_iters, self.mcmc_max_iters - num_new)):
+                chain += self._collect_samples(1)
+                trace.append(self._log_posterior())
+                num_new += 1
+
+            if len(trace) < MIN_RHAT_SAMPLES:
+                continue
+
+            samples = np.array(trace)[:,np.newaxis]
+            rhat    = potential_scale_reduction(split_chains(samples))[0]
+            ess     = effective_sample_size(samples)[0]
+
+            if rhat > self.mcmc_max_rhat:
+                # The chain drifted, e.g. because of the new data
+                num_drop = min(len(chain)//2, len(chain) - self.mcmc_iters)
+                if num_drop > 0:
+                    chain = chain[num_drop:]
+                    trace = trace[num_drop:]
+            elif ess >= self.mcmc_target_ess:
+                break
+
+        self.diagnostics = {'new samples' : num_new,
+                            'ess'         : ess,
+                            'rhat'        : rhat}
+
+        if self.mcmc_diagnostics:
+            log.info('Collected %d samples: effective sample size %.1f, R-hat %.3f' % (num_new, ess, rhat))
+
+        return chain[-self.mcmc_iters:]
+
+    def _collect_samples_in_chains(self, num_burn, chain_hypers=None):
+        """return the hypers of the states of mcmc_chains independent chains,
+        which run in parallel in a pool of mcmc_workers processes. Each chain
+        burns num_burn samples and then collects mcmc_iters/mcmc_chains
+        (rounded up), with its own random seed and a copy of the samplers.
+        The chains continue from chain_hypers, the last states of the chains
+        of the previous fit, or else all start from the current hypers. The
+        states are grouped by chain.
+        """
+        if not chain_hypers or len(chain_hypers) != self.mcmc_chains:
+            chain_hypers = [self.to_dict()['hypers']]*self.mcmc_chains
+
+        num_samples = int(np.ceil(float(self.mcmc_iters)/self.mcmc_chains))
+        seeds       = npr.randint(np.iinfo(np.int32).max, size=self.mcmc_chains)
+        chain_args  = [(chain_hypers[k], seeds[k], num_burn, num_samples) for k in xrange(self.mcmc_chains)]
+
+        if self.mcmc_workers > 1:
+            pool = multiprocessing.Pool(min(self.mcmc_workers, self.mcmc_chains))
+            try:
+                results = [pool.apply_async(_run_chain, (self,) + args) for args in chain_args]
+                chains  = [res.get(1e8) for res in results]
+            finally:
+                pool.terminate()
+        else:
+            # The chains are seeded, so leave the random state as it was
+            random_state = npr.get_state()
+            chains       = [_run_chain(copy.deepcopy(self), *args) for args in chain_args]
+            npr.set_state(random_state)
+
+        self.chain_length  += num_burn + num_samples
+        self._chain_hypers  = [chain[-1] for chain in chains]
+
+        # Compare the chains
+        samples = np.array([[_hypers_vector(hypers) for hypers in chain] for chain in chains])
+        # The R-hat of chains of a single sample is unknown
+        rhat    = np.max(potential_scale_reduction(samples)) if num_samples > 1 else np.nan
+        ess     = np.min(np.sum([effective_sample_size(chain) for chain in samples], axis=0))
+
+        self.diagnostics = {'chains' : self.mcmc_chains,
+                            'ess'    : ess,
+                            'rhat'   : rhat}
+
+        if self.mcmc_diagnostics:
+            log.info('Collected %d samples in %d chains: effective sample size %.1f, R-hat %.3f' %
+                (num_samples*self.mcmc_chains, self.mcmc_chains, ess, rhat))
+
+        return [hypers for chain in chains for hypers in chain]
+
+    def _log_posterior(self):
+        """return the log likelihood plus the log priors of the current hypers"""
+        return self.log_likelihood() + np.sum([np.sum(param.prior_logprob()) for param in self.params.values()])
+
+    def _optimize_hypers(self):
+        """return the MAP hypers, found with L-BFGS on the log likelihood plus
+        the log priors. The first run starts from the current hypers and the
+        others from random perturbations of them. The positive hypers are
+        optimized in log space, and this is the mode of their log: unlike
+        the mode of the hypers themselves it is well defined when a prior
+        has a spike at 0, like the horseshoe prior of the noise."""
+        params   = [self.params[name] for name in sorted(self.params)]
+        positive = log_space_mask(params)
+        x        = hyperparameter_utils.params_to_array(params)
+        z        = np.where(positive, np.log(np.where(positive, x, 1.0)), x)
+
+        def neg_logprob(z):
+            # The optimizer may try extreme values, where the priors underflow
+            with np.errstate(divide='ignore', over='ignore', invalid='ignore'):
+                lp, grad = log_space_logprob_and_grad(z, params, self, positive)
+            if grad is None:
+                # Outside of the support, a large value makes the line search back off
+                return 1e100, np.zeros(z.shape)
+            return -lp, -grad
+
+        best_z, best_value = z, neg_logprob(z)[0]
+        for i in xrange(self.fit_restarts):
+            z_init = z if i == 0 else z + RESTART_STD*npr.randn(z.size)
+            if neg_logprob(z_init)[0] >= 1e100:
+                continue
+
+            opt_z, opt_value, opt_info = spo.fmin_l_bfgs_b(neg_logprob, z_init, disp=0)
+            if opt_value < best_value:
+                best_z, best_value = opt_z, opt_value
+
+        hyperparameter_utils.set_params_from_array(params, np.where(positive, np.exp(best_z), best_z))
+
+        return self.to_dict()['hypers']
+
     def _collect_fantasies(self, pending):
         fantasy_values_list = []
         for i in xrange(self.num_states):
@@ -406,7 +834,14 @@ class GP(AbstractModel):
         if self.pending is None or len(self._fantasy_values_list) < self.num_states:
             return self._inputs
             
-        return np.vstack((self._inputs, self.pending)) # Could perhaps cache this to make it faster.
+        # Always return the same array for the same inputs, so that the
+        # kernels can remember computations on it
+        inputs, pending, inputs_with_pending = self._inputs_with_pending
+        if inputs is not self._inputs or pending is not self.pending:
+            inputs_with_pending       = np.vstack((self._inputs, self.pending))
+            self._inputs_with_pending = (self._inputs, self.pending, inputs_with_pending)
+
+        return inputs_with_pending
 
     @property
     def observed_inputs(self):
@@ -443,18 +878,8 @@ class GP(AbstractModel):
 
     @property
     def caching(self):
-        if not self._caching or self.num_states <= 0:
-            return False
-
-        # For now this only computes the cost of storing the Cholesky decompositions.
-        cache_mem_usage = (self._inputs.shape[0]**2) * self.num_states * 8. # Each double is 8 bytes.
-
-        if cache_mem_usage > self.max_cache_bytes:
-            sys.stderr.write('Max memory limit of %d bytes reached. Not caching intermediate computations.' % self.max_cache_bytes)
-
-            return False
-
-        return True
+        # The memory used is bounded by max_cache_mb (see _cache_put)
+        return self._caching and self.num_states > 0
 
     def set_state(self, state):
         self.state = state
@@ -468,6 +893,14 @@ class GP(AbstractModel):
 
         gp_dict['chain length'] = self.chain_length
 
+        # The adaptive mode continues the chain from these states
+        if self.mcmc_adaptive and self._hypers_list:
+            gp_dict['hypers list'] = self._hypers_list
+
+        # And the chains continue from their last states
+        if self.mcmc_chains > 1 and self._chain_hypers:
+            gp_dict['chain hypers'] = self._chain_hypers
+
         return gp_dict
 
     def from_dict(self, gp_dict):
@@ -496,16 +929,31 @@ class GP(AbstractModel):
         if hypers:
             self.from_dict(hypers)
 
-        if fit_hypers:
+        previous_hypers_list  = hypers.get('hypers list', []) if hypers else []
+        previous_chain_hypers = hypers.get('chain hypers', []) if hypers else []
+
+        if fit_hypers and self.fit_mode == 'optimize':
+            # A single state with the MAP hypers
+            self._hypers_list = [self._optimize_hypers()]
+            self.num_states   = 1
+        elif fit_hypers and self.mcmc_chains > 1:
+            # Burn samples in each chain (if needed) and collect samples from all of them
+            num_samples       = self.burnin if reburn or self.chain_length < self.burnin else 0
+            self._hypers_list = self._collect_samples_in_chains(num_samples, [] if reburn else previous_chain_hypers)
+            self.num_states   = len(self._hypers_list)
+        elif fit_hypers:
             # Burn samples (if needed)
             num_samples = self.burnin if reburn or self.chain_length < self.burnin else 0
             self._burn_samples(num_samples)
 
             # Now collect some samples
-            self._hypers_list = self._collect_samples(self.mcmc_iters)
+            if self.mcmc_adaptive:
+                self._hypers_list = self._collect_samples_adaptively([] if num_samples else previous_hypers_list)
+            else:
+                self._hypers_list = self._collect_samples(self.mcmc_iters)
 
             # Now we have more states
-            self.num_states = self.mcmc_iters
+            self.num_states = len(self._hypers_list)
         elif not self._hypers_list:
             # Just use the current hypers as the only state
             self._hypers_list = [self.to_dict()['hypers']]
@@ -525,6 +973,29 @@ class GP(AbstractModel):
 
         return self.to_dict()
 
+    def update_pending(self, pending):
+        """replace the pending inputs of a fitted GP and regenerate their fantasies
+
+        The hyperparameter samples are kept, so this is much cheaper than
+        fit: no MCMC is run, and with caching the Cholesky factors of the
+        observed inputs are only extended with the new pending inputs.
+        """
+        # Drop the old fantasies first so that the new ones are conditioned
+        # on the observed data only
+        self.pending              = None
+        self._fantasy_values_list = []
+        self._clear_cache()
+        self._clear_prediction_cache()
+
+        if pending is not None:
+            self.pending              = pending
+            self._fantasy_values_list = self._collect_fantasies(pending)
+
+        if self.caching:
+            self._prepare_cache()
+
+        self.set_state(len(self._hypers_list)-1)
+
     def log_likelihood(self):
         """
         GP Marginal likelihood
@@ -540,6 +1011,33 @@ class GP(AbstractModel):
         # Uses the identity that log det A = log prod diag chol A = sum log diag chol A
         return -np.sum(np.log(np.diag(chol)))-0.5*np.dot(self.observed_values - self.mean.value, solve)
 
+    def log_likelihood_and_grad(self, params):
+        """
+        GP Marginal likelihood and its gradient wrt the given hyperparameters,
+        as a flat array in the order of params_to_array(params).
+
+        Notes
+        -----
+        This is called by the gradient based samplers. It needs a single
+        Cholesky decomposition, like log_likelihood.
+        """
+        inputs = self.observed_inputs
+        values = self.observed_values - self.mean.value
+        chol   = spla.cholesky(self.kernel.cov(inputs), lower=True)
+        solve  = spla.cho_solve((chol, True), values)
+        ll     = -np.sum(np.log(np.diag(chol)))-0.5*np.dot(values, solve)
+
+        # The gradient wrt the covariance matrix is (solve solve^T - K^-1)/2
+        V     = 0.5*(np.outer(solve, solve) - spla.cho_solve((chol, True), np.eye(inputs.shape[0])))
+        grads = [(self.mean, np.atleast_1d(np.sum(solve)))] + self.kernel.cov_grad_hypers(inputs, V)
+
+        # Add up the gradients of each parameter, which may appear more than once
+        grad = []
+        for param in params:
+            grad.append(reduce(np.add, [g for p, g in grads if p is param], np.zeros(param.size())))
+
+        return ll, np.hstack(grad)
+
     def predict(self, pred, full_cov=False, compute_grad=False):
         inputs = self.inputs
         values = self.values
@@ -551,8 +1049,12 @@ class GP(AbstractModel):
         if pred.shape[1] != self.num_dims:
             raise Exception("Dimensionality of inputs must match dimensionality given at init time.")
 
-        # The primary covariances for prediction.
-        cand_cross = self.noiseless_kernel.cross_cov(inputs, pred)
+        # The primary covariances for prediction, and their gradients
+        # which share most of the computations
+        if compute_grad:
+            cand_cross, grad_cross = self.noiseless_kernel.cross_cov_and_grad_data(inputs, pred)
+        else:
+            cand_cross = self.noiseless_kernel.cross_cov(inputs, pred)
         
         chol, alpha = self._pull_from_cache_or_compute()
 
@@ -575,7 +1077,6 @@ class GP(AbstractModel):
         if not compute_grad:
             return func_m, func_v
 
-        grad_cross = self.noiseless_kernel.cross_cov_grad_data(inputs, pred)
         grad_xp_m  = np.tensordot(np.transpose(grad_cross, (1,2,0)), alpha, 1)
 
         # this should be faster than (and equivalent to) spla.cho_solve((chol, True),cand_cross))
@@ -610,6 +1111,130 @@ class GP(AbstractModel):
             var = self.noiseless_kernel.diag_cov(pred)
             return mean, var
 
+    def enable_prediction_cache(self, max_mb=256):
+        """keep the predictions of predict_over_hypers until disabled
+
+        While enabled, predicting again at the same locations (e.g. the grid
+        in best() and then in the acquisition function) returns the stored
+        arrays. The cached arrays are read-only. Nothing new is stored once
+        max_mb megabytes are used. The cache is dropped whenever the model
+        changes.
+        """
+        self._prediction_cache           = {}
+        self._prediction_cache_bytes     = 0
+        self._prediction_cache_max_bytes = int(max_mb*1024*1024)
+
+    def disable_prediction_cache(self):
+        self._prediction_cache       = None
+        self._prediction_cache_bytes = 0
+
+    def _clear_prediction_cache(self):
+        if self._prediction_cache is not None:
+            self._prediction_cache       = {}
+            self._prediction_cache_bytes = 0
+
+    def __getstate__(self):
+        # The cached predictions are only valid in this process, and the
+        # stored factors are only needed by the fits of this process
+        state = self.__dict__.copy()
+        state['_prediction_cache']       = None
+        state['_prediction_cache_bytes'] = 0
+        state['_chol_store']             = OrderedDict()
+        state['_chol_store_inputs']      = None
+        return state
+
+    def predict_over_hypers(self, pred, compute_grad=False):
+        """Predict at pred under all hyperparameter states at once.
+
+        When all the states are cached, each one only sets the hypers of the
+        kernel and solves against its cached factor, without going through
+        set_state. Returns the same arrays as predict with a leading axis
+        over the states.
+        """
+        if compute_grad or self._prediction_cache is None:
+            return self._predict_over_hypers(pred, compute_grad)
+
+        pred = np.ascontiguousarray(pred)
+        key  = (pred.shape, hashlib.sha1(pred).hexdigest())
+        if key in self._prediction_cache:
+            return self._prediction_cache[key]
+
+        predictions = self._predict_over_hypers(pred, compute_grad)
+
+        num_bytes = sum(p.nbytes for p in predictions)
+        if self._prediction_cache_bytes + num_bytes <= self._prediction_cache_max_bytes:
+            for p in predictions:
+                p.flags.writeable = False
+            self._prediction_cache[key]   = predictions
+            self._prediction_cache_bytes += num_bytes
+
+        return predictions
+
+    def _predict_over_hypers(self, pred, compute_grad):
+        if self.inputs is None or not self._all_states_cached():
+            # This goes through the states one by one
+            state       = self.state
+            predictions = super(GP, self).predict_over_hypers(pred, compute_grad=compute_grad)
+            self._restore_state(state)
+            return predictions
+
+        if pred.shape[1] != self.num_dims:
+            raise Exception("Dimensionality of inputs must match dimensionality given at init time.")
+
+        inputs = self.inputs
+        state  = self.state
+
+        predictions = []
+        for i in xrange(self.num_states):
+            # Only the kernel depends on the state, so just set the hypers
+            # and use the cached factor
+            self._set_params_from_dict(self._hypers_list[i])
+            cache = self._cache_get(i)
+            chol  = cache['chol']
+            alpha = cache['alpha']
+
+            if compute_grad:
+                cand_cross, grad_cross = self.noiseless_kernel.cross_cov_and_grad_data(inputs, pred)
+            else:
+                cand_cross = self.noiseless_kernel.cross_cov(inputs, pred)
+
+            # Predict the marginal means and variances at candidates.
+            beta   = spla.solve_triangular(chol, cand_cross, lower=True)
+            func_m = np.dot(cand_cross.T, alpha) + self.mean.value
+            func_v = self.noiseless_kernel.diag_cov(pred) - np.sum(beta**2, axis=0)
+
+            if not compute_grad:
+                predictions.append((func_m, func_v))
+                continue
+
+            # this is K^-1 cand_cross
+            gamma     = spla.solve_triangular(chol.T, beta, lower=False)
+            grad_xp_m = np.tensordot(np.transpose(grad_cross, (1,2,0)), alpha, 1)
+            grad_xp_v = -2.0*np.sum(gamma[:,:,np.newaxis] * grad_cross, axis=0)
+
+            # Make sure grad_xp_v has the same number of dimensions as grad_xp_m
+            if alpha.ndim > 1:
+                grad_xp_v = grad_xp_v[:,:,np.newaxis]
+
+            predictions.append((func_m, func_v, grad_xp_m, grad_xp_v))
+
+        self._restore_state(state)
+        return tuple(np.array(p) for p in zip(*predictions))
+
+    def _all_states_cached(self):
+        """return whether the computations of all states are cached for the
+        current inputs"""
+        if not self.caching or len(self._cache) != self.num_states:
+            return False
+
+        num_inputs = self.inputs.shape[0]
+        return all(i in self._cache and self._cache[i]['chol'].shape[0] == num_inputs
+                   for i in xrange(self.num_states))
+
+    def _restore_state(self, state):
+        if state is not None:
+            self.set_state(state)
+
 
     # -------------------------------------------------------- #
     #                                                          #
@@ -681,26 +1306,56 @@ class GP(AbstractModel):
     # pi = probability that the latent function value is greater than or equal to C
     # This is evaluated separately at each location in pred
     def pi(self, pred, C=0, compute_grad=False):
-        if not compute_grad:
-            mean, sigma2 = self.predict(pred, compute_grad=False)
-        else:
-            mean, sigma2, g_m_x, g_v_x = self.predict(pred, compute_grad=True)
-        sigma  = np.sqrt(sigma2)
-
-        C_minus_m = C-mean
-
-        # norm.sf = 1 - norm.cdf
-        prob = sps.norm.sf(C_minus_m/sigma)
-
-        if not compute_grad:
-            return prob
-        else:
-            # Gradient of pi w.r.t. GP mean
-            g_p_m = sps.norm.pdf( C_minus_m / sigma ) / sigma
-            # Gradient of pi w.r.t. GP variance (equals grad w.r.t. sigma / (2*sigma))
-            g_p_v = sps.norm.pdf( C_minus_m / sigma ) * C_minus_m / sigma2 / (2*sigma)
-            # Total derivative of pi w.r.t. inputs
-            grad_p = g_p_m[:,np.newaxis] * g_m_x + g_p_v[:,np.newaxis] * g_v_x
-            return prob, grad_p
-
-
+        return _pi_from_predictions(C, *self.predict(pred, compute_grad=compute_grad))
+
+    # The same as pi but for all hyperparameter states at once, with a
+    # leading axis over the states
+    def pi_over_hypers(self, pred, C=0, compute_grad=False):
+        return _pi_from_predictions(C, *self.predict_over_hypers(pred, compute_grad=compute_grad))
+
+def _pi_from_predictions(C, mean, sigma2, g_m_x=None, g_v_x=None):
+    """compute pi (and its gradient if the gradients of the predictions are given)"""
+    sigma  = np.sqrt(sigma2)
+
+    C_minus_m = C-mean
+
+    # norm.sf = 1 - norm.cdf
+    prob = sps.norm.sf(C_minus_m/sigma)
+
+    if g_m_x is None:
+        return prob
+    else:
+        # Gradient of pi w.r.t. GP mean
+        g_p_m = sps.norm.pdf( C_minus_m / sigma ) / sigma
+        # Gradient of pi w.r.t. GP variance (equals grad w.r.t. sigma / (2*sigma))
+        g_p_v = sps.norm.pdf( C_minus_m / sigma ) * C_minus_m / sigma2 / (2*sigma)
+        # Total derivative of pi w.r.t. inputs
+        grad_p = g_p_m[...,np.newaxis] * g_m_x + g_p_v[...,np.newaxis] * g_v_x
+        return prob, grad_p
+
+def _same_hypers(hypers_1, hypers_2):
+    """return True if two dicts of hyperparameter values are identical"""
+    if set(hypers_1.keys()) != set(hypers_2.keys()):
+        return False
+
+    return all(np.array_equal(hypers_1[name], hypers_2[name]) for name in hypers_1)
+
+def _hypers_key(hypers):
+    """return a hashable key that identifies a dict of hyperparameter values"""
+    return (tuple(sorted(hypers.keys())), _hypers_vector(hypers).tostring())
+
+def _run_chain(gp, hypers, seed, num_burn, num_samples):
+    """run a chain of the samplers of gp from hypers, with the random seed
+    seed, and return the hypers of its num_samples states after num_burn
+    burn-in samples. This is run by the workers of GP fits with several
+    chains."""
+    npr.seed(seed)
+    gp._set_params_from_dict(hypers)
+    gp._burn_samples(num_burn)
+
+    return gp._collect_samples(num_samples)
+
+def _hypers_vector(hypers):
+    """return the values in a dict of hyperparameter values as a vector,
+    in the order of their names"""
+    return np.hstack([np.ravel(hypers[name]) for name in sorted(hypers.keys())])
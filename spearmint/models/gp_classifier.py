@@ -185,22 +185,24 @@
 
 import copy
 import sys, logging
+import hashlib
 import numpy             as np
 import numpy.random      as npr
 import scipy.linalg      as spla
 import scipy.optimize    as spo
 import scipy.io          as sio
 import scipy.stats       as sps
-import weave
 
 
 from .gp                                     import GP
 from ..utils.param                           import Param as Hyperparameter
 from ..kernels                               import Matern52, Noise, Scale, SumKernel, TransformKernel
 from ..sampling.slice_sampler                import SliceSampler
+from ..sampling.hmc_sampler                  import HMCSampler
 from ..sampling.whitened_prior_slice_sampler import WhitenedPriorSliceSampler
 from ..sampling.elliptical_slice_sampler     import EllipticalSliceSampler
 from ..utils                                 import priors
+from ..utils.memo                            import ArrayMemo
 from ..transformations                       import BetaWarp, Transformer
 
 try:
@@ -210,24 +212,78 @@ except:
     log = logging.getLogger()
     print 'Not running from main.'
 
+LAPLACE_MAX_ITERS = 100
+LAPLACE_TOL       = 1e-8
+MIN_CURVATURE     = 1e-12
+
+def _row_digests(inputs):
+    """return a 64 bit digest of each row of inputs, which identifies the
+    inputs the latent values belong to without saving the inputs"""
+    inputs = np.ascontiguousarray(inputs, dtype=np.float64)
+    return np.array([np.frombuffer(hashlib.sha1(row.tobytes()).digest()[:8], dtype=np.uint64)[0]
+                     for row in inputs], dtype=np.uint64)
+
 class GPClassifier(GP):
+    """Gaussian process classifier
+
+    It takes the options of GP, and
+
+    inference : str, optional
+        `mcmc` (the default) samples the latent values along with the
+        hyperparameters. `laplace` replaces them by the Laplace
+        approximation of their posterior given the hyperparameters, which
+        are then sampled (or optimized, with the optimize fit mode) from
+        the approximate marginal likelihood. This needs a binomial
+        likelihood, and it makes the hmc sampler and the optimize fit mode
+        available.
+    ess-thinning : int, optional
+        The number of elliptical slice sampling steps of the latent values
+        for each sample of the hyperparameters with mcmc inference.
+    """
     def __init__(self, num_dims, **options):
-        self.counts = None
+        self.counts         = None
+        self._input_digests = np.zeros(0, dtype=np.uint64)
 
         log.debug('GP Classifier initialized with options: %s' % (options))
         self.ess_thinning = int(options.get("ess-thinning", 10))
+        self.inference    = options.get("inference", "mcmc").lower()
+
+        if self.inference not in ['mcmc', 'laplace']:
+            raise Exception('Unknown GP classifier inference: %s' % self.inference)
 
         self._set_likelihood(options)
     
         self.prior_whitening = options.get('prior-whitening', True)
 
-        sigmoid = options.get("sigmoid", "probit")
+        self.sigmoid_name = options.get("sigmoid", "probit")
+        self._set_sigmoid()
+        
+        # The constraint is that p=s(f) > 1-epsilon
+        # where s if the sigmoid and f is the latent function value, and p is the binomial probability
+        # This is only in more complicated situations. The main situation where this is used
+        # we want f>0. This is equivalent to epsilon=0.5 for the sigmoids we use
+        # The point is: do not set epsilon unless you know what you are doing!
+        # (and do not confuse it with delta, the min constraint confidence)
+        self._one_minus_epsilon = 1.0 - float(options.get("epsilon", 0.5))
+
+        if self.inference == 'laplace' and self.noiseless:
+            raise Exception('The Laplace approximation needs a binomial likelihood')
+
+        self.latent_values_list = []
+
+        super(GPClassifier, self).__init__(num_dims, **options)
+
+        # Recent Cholesky factors of the prior covariance of the latent values,
+        # which the samplers of the hypers and of the latent values share
+        self._prior_cov_chol_memo = ArrayMemo(max_size=2, budget=self._cache_budget)
+
+    def _set_sigmoid(self):
         if not self.noiseless:
-            if sigmoid == "probit":
+            if self.sigmoid_name == "probit":
                 self.sigmoid            = sps.norm.cdf
                 self.sigmoid_derivative = sps.norm.pdf   # not used
                 self.sigmoid_inverse    = sps.norm.ppf
-            elif sigmoid == "logistic":
+            elif self.sigmoid_name == "logistic":
                 self.sigmoid            = sps.logistic.cdf
                 self.sigmoid_derivative = sps.logistic.pdf
                 self.sigmoid_inverse    = sps.logistic.ppf
@@ -240,18 +296,17 @@ class GPClassifier(GP):
             self.sigmoid            = lambda x: np.greater_equal(x, 0)
             self.sigmoid_derivative = lambda x: 0.
             self.sigmoid_inverse    = lambda x: 0.
-        
-        # The constraint is that p=s(f) > 1-epsilon
-        # where s if the sigmoid and f is the latent function value, and p is the binomial probability
-        # This is only in more complicated situations. The main situation where this is used
-        # we want f>0. This is equivalent to epsilon=0.5 for the sigmoids we use
-        # The point is: do not set epsilon unless you know what you are doing!
-        # (and do not confuse it with delta, the min constraint confidence)
-        self._one_minus_epsilon = 1.0 - float(options.get("epsilon", 0.5))
 
-        self.latent_values_list = []
+    def __getstate__(self):
+        # The sigmoid functions can't be pickled, they are set again from their name
+        state = super(GPClassifier, self).__getstate__()
+        for name in ['sigmoid', 'sigmoid_derivative', 'sigmoid_inverse']:
+            del state[name]
+        return state
 
-        super(GPClassifier, self).__init__(num_dims, **options)
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._set_sigmoid()
 
     def _set_likelihood(self, options):
         self.likelihood = options.get('likelihood', 'binomial').lower()
@@ -277,19 +332,34 @@ class GPClassifier(GP):
 
         self._latent_values_list = []
 
-    def _set_latent_values_from_dict(self, latent_values_dict):
+    def _set_latent_values_from_dict(self, gp_dict):
         # Read in the latent values. For pre-existing data, just load them in
         # For new data, set them to a default.
-        default_latent_values = self.counts - 0.5
-
-        latent_values = np.zeros(self._inputs.shape[0])
-        for i in xrange(self._inputs.shape[0]):
-            key = str(hash(self._inputs[i].tostring()))
-            
-            if key in latent_values_dict:
-                latent_values[i] = latent_values_dict[key]
+        latent_values = np.array(self.counts - 0.5, dtype=float)
+        saved_values  = gp_dict['latent values']
+
+        if isinstance(saved_values, dict):
+            # The legacy format, with keys as hashes of the inputs
+            for i in xrange(self._inputs.shape[0]):
+                key = str(hash(self._inputs[i].tostring()))
+                if key in saved_values:
+                    latent_values[i] = saved_values[key]
+        else:
+            if 'latent input digests' in gp_dict:
+                saved_digests = gp_dict['latent input digests']
+            else:
+                saved_digests = _row_digests(gp_dict['latent inputs'])
+            num_saved = saved_digests.shape[0]
+
+            if num_saved <= self._input_digests.shape[0] and np.array_equal(saved_digests, self._input_digests[:num_saved]):
+                # The usual case: the new inputs were appended to the saved ones
+                latent_values[:num_saved] = saved_values
             else:
-                latent_values[i] = default_latent_values[i]
+                saved_index = dict((digest, i) for i, digest in enumerate(saved_digests))
+                for i, digest in enumerate(self._input_digests):
+                    j = saved_index.get(digest)
+                    if j is not None:
+                        latent_values[i] = saved_values[j]
 
         self.latent_values.value = latent_values
 
@@ -301,7 +371,7 @@ class GPClassifier(GP):
             for sampler in self._samplers:
                 sampler.sample(self)
 
-            self.latent_values_sampler.sample(self)
+            self._sample_latent_values()
 
             self.chain_length += 1
         # sys.stderr.write('\n')
@@ -317,7 +387,7 @@ class GPClassifier(GP):
             for sampler in self._samplers:
                 sampler.sample(self)
 
-            self.latent_values_sampler.sample(self)
+            self._sample_latent_values()
 
             current_dict = self.to_dict()
             hypers_list.append(current_dict['hypers'])
@@ -328,7 +398,20 @@ class GPClassifier(GP):
         # sys.stderr.write('\n')
         return hypers_list, latent_values_list
 
+    def _sample_latent_values(self):
+        if self.inference == 'laplace':
+            # The latent values are the mode of their approximate posterior
+            # under the hypers the samplers accepted
+            self.latent_values.value = self._laplace_approximation()['f']
+        else:
+            self.latent_values_sampler.sample(self)
+
     def _build(self):
+        if self.inference == 'mcmc' and self.sampler != 'slice':
+            raise Exception('GPClassifier only supports the slice sampler with mcmc inference, not %s.' % self.sampler)
+        if self.inference == 'mcmc' and self.fit_mode != 'mcmc':
+            raise Exception('GPClassifier only supports the mcmc fit mode with mcmc inference, not %s.' % self.fit_mode)
+
         self.params        = {}
         self.latent_values = None
 
@@ -342,12 +425,12 @@ class GPClassifier(GP):
         transformer.add_layer(beta_warp)
 
         # Build the component kernels
-        input_kernel      = Matern52(self.num_dims)
+        input_kernel      = Matern52(self.num_dims, cache_budget=self._cache_budget)
         ls                = input_kernel.hypers
         self.params['ls'] = ls
 
         # Now apply the transformation.
-        transform_kernel = TransformKernel(input_kernel, transformer)
+        transform_kernel = TransformKernel(input_kernel, transformer, cache_budget=self._cache_budget)
 
         # Add some perturbation for stability
         stability_noise = Noise(self.num_dims)
@@ -378,19 +461,32 @@ class GPClassifier(GP):
 
         # Build the samplers
         to_sample = [self.mean] if self.noiseless else [self.mean, amp2]
-        self._samplers.append(SliceSampler(*to_sample, compwise=False, thinning=self.thinning))
-        self._samplers.append(WhitenedPriorSliceSampler(ls, beta_alpha, beta_beta, compwise=True, thinning=self.thinning))
-        self.latent_values_sampler = EllipticalSliceSampler(self.latent_values, thinning=self.ess_thinning)
+        if self.inference == 'laplace' and self.sampler == 'hmc':
+            self._samplers.append(HMCSampler(*(to_sample + [ls, beta_alpha, beta_beta]), thinning=self.thinning))
+        elif self.inference == 'laplace':
+            self._samplers.append(SliceSampler(*to_sample, compwise=False, thinning=self.thinning))
+            self._samplers.append(SliceSampler(ls, beta_alpha, beta_beta, compwise=True, thinning=self.thinning))
+        else:
+            self._samplers.append(SliceSampler(*to_sample, compwise=False, thinning=self.thinning))
+            self._samplers.append(WhitenedPriorSliceSampler(ls, beta_alpha, beta_beta, compwise=True, thinning=self.thinning))
+            self.latent_values_sampler = EllipticalSliceSampler(self.latent_values, thinning=self.ess_thinning)
 
     @property
     def values(self):
+        # With the Laplace approximation the predictions are those of a GP
+        # with noisy observations of pseudo latent values (see _compute_cholesky)
+        if self.inference == 'laplace':
+            latent_values = self._laplace_pseudo_observations()[0]
+        else:
+            latent_values = self.observed_values
+
         if self.pending is None or len(self._fantasy_values_list) < self.num_states:
-            return self.observed_values
+            return latent_values
 
         if self.num_fantasies == 1:
-            return np.append(self.latent_values.value, self._fantasy_values_list[self.state].flatten(), axis=0)
+            return np.append(latent_values, self._fantasy_values_list[self.state].flatten(), axis=0)
         else:
-            return np.append(np.tile(self.latent_values.value[:,None], (1,self.num_fantasies)), self._fantasy_values_list[self.state], axis=0)
+            return np.append(np.tile(latent_values[:,None], (1,self.num_fantasies)), self._fantasy_values_list[self.state], axis=0)
 
     @property
     def observed_values(self):
@@ -402,16 +498,21 @@ class GPClassifier(GP):
     def set_state(self, state):
         self.state = state
         self._set_params_from_dict(self._hypers_list[state])
-        self._set_latent_values_from_dict(self._latent_values_list[state])
+        self.latent_values.value = self._latent_values_list[state].copy()
 
     def pi(self, pred, compute_grad=False):
         return super(GPClassifier, self).pi( pred, compute_grad=compute_grad, 
             C=self.sigmoid_inverse(self._one_minus_epsilon) )
 
+    def pi_over_hypers(self, pred, compute_grad=False):
+        return super(GPClassifier, self).pi_over_hypers( pred, compute_grad=compute_grad, 
+            C=self.sigmoid_inverse(self._one_minus_epsilon) )
+
     def fit(self, inputs, counts, pending=None, hypers=None, reburn=False, fit_hypers=True):
         # Set the data for the GP
-        self._inputs = inputs
-        self.counts  = counts
+        self._inputs        = inputs
+        self.counts         = counts
+        self._input_digests = _row_digests(inputs)
 
         # Reset the GP
         self._reset()
@@ -420,7 +521,13 @@ class GPClassifier(GP):
         if hypers:
             self.from_dict(hypers)
 
-        if fit_hypers:
+        if fit_hypers and self.fit_mode == 'optimize':
+            # A single state with the MAP hypers and the mode of the latent values
+            self._hypers_list        = [self._optimize_hypers()]
+            self._sample_latent_values()
+            self._latent_values_list = [self.to_dict()['latent values']]
+            self.num_states          = 1
+        elif fit_hypers:
             # Burn samples (if needed)
             num_samples = self.burnin if reburn or self.chain_length < self.burnin else 0
             self._burn_samples(num_samples)
@@ -451,6 +558,171 @@ class GPClassifier(GP):
 
         return self.to_dict()
 
+    def prior_cov_chol(self):
+        """return the Cholesky factor of the prior covariance of the latent
+        values under the current hypers. The recent factors are remembered,
+        so that the samplers of the hypers and of the latent values don't
+        factor the same matrix again."""
+        inputs       = self.observed_inputs
+        hyper_values = [self.params[name].value for name in sorted(self.params) if name != 'mean']
+
+        chol = self._prior_cov_chol_memo.get((inputs,), hyper_values)
+        if chol is None:
+            chol = spla.cholesky(self.noiseless_kernel.cov(inputs), lower=True)
+            chol = self._prior_cov_chol_memo.put((inputs,), hyper_values, chol)
+
+        return chol
+
+    def log_likelihood(self):
+        """
+        The marginal likelihood of the latent values, or with the Laplace
+        approximation the approximate marginal likelihood of the counts.
+        """
+        if self.inference == 'laplace':
+            return self._laplace_approximation()['log likelihood']
+
+        chol  = self.prior_cov_chol()
+        solve = spla.cho_solve((chol, True), self.observed_values - self.mean.value)
+
+        return -np.sum(np.log(np.diag(chol)))-0.5*np.dot(self.observed_values - self.mean.value, solve)
+
+    def log_likelihood_and_grad(self, params):
+        """
+        The Laplace approximation of the marginal likelihood of the counts and
+        its gradient wrt the given hyperparameters, as a flat array in the
+        order of params_to_array(params). The gradient includes the change of
+        the mode of the latent values with the hyperparameters.
+
+        Rasmussen and Williams (2006). Gaussian Processes for Machine
+        Learning, algorithm 5.1.
+        """
+        if self.inference != 'laplace':
+            raise Exception('The gradient of the likelihood needs the Laplace approximation')
+
+        laplace = self._laplace_approximation()
+        inputs  = self.observed_inputs
+        K       = laplace['K']
+        L       = laplace['L']
+        sW      = laplace['sW']
+        a       = laplace['a']
+        d3      = self._log_binomial_likelihood_derivatives(laplace['f'])[3]
+
+        # R = W^1/2 B^-1 W^1/2 = (K + W^-1)^-1 and C = L^-1 W^1/2 K
+        L_inv_sW = spla.solve_triangular(L, np.diag(sW), lower=True)
+        R        = np.dot(L_inv_sW.T, L_inv_sW)
+        C        = np.dot(L_inv_sW, K)
+
+        # The gradient through the mode of the latent values
+        s2 = 0.5*(np.diag(K) - np.sum(C**2, axis=0))*d3
+        u  = s2 - np.dot(R, np.dot(K, s2))
+
+        V     = 0.5*(np.outer(a, a) - R) + 0.5*(np.outer(u, a) + np.outer(a, u))
+        grads = [(self.mean, np.atleast_1d(np.sum(a) + np.sum(u)))] + self.kernel.cov_grad_hypers(inputs, V)
+
+        # Add up the gradients of each parameter, which may appear more than once
+        grad = []
+        for param in params:
+            grad.append(reduce(np.add, [g for p, g in grads if p is param], np.zeros(param.size())))
+
+        return laplace['log likelihood'], np.hstack(grad)
+
+    def _laplace_approximation(self):
+        """find the mode of the posterior of the latent values under the
+        current hypers with Newton's method, starting from the current latent
+        values, without changing them. Returns a dict with the mode
+        f, a = K^-1 (f - mean), the square roots sW of the curvatures of the
+        log likelihood, the Cholesky factor L of B = I + sW K sW, the prior
+        covariance K and the approximate log marginal likelihood.
+
+        Rasmussen and Williams (2006). Gaussian Processes for Machine
+        Learning, algorithm 3.1.
+        """
+        K = self.noiseless_kernel.cov(self.observed_inputs)
+        m = self.mean.value
+        f = self.latent_values.value
+        N = K.shape[0]
+
+        psi   = -np.inf
+        a_old = None
+        for i in xrange(LAPLACE_MAX_ITERS):
+            log_like, d1, d2 = self._log_binomial_likelihood_derivatives(f)[:3]
+
+            W  = np.maximum(-d2, MIN_CURVATURE)
+            sW = np.sqrt(W)
+            L  = spla.cholesky(np.eye(N) + sW[:,np.newaxis]*K*sW, lower=True)
+            b  = W*(f - m) + d1
+            a  = b - sW*spla.cho_solve((L, True), sW*np.dot(K, b))
+
+            f_new   = m + np.dot(K, a)
+            psi_new = -0.5*np.dot(a, f_new - m) + self._log_binomial_likelihood_derivatives(f_new)[0]
+
+            # Halve the step until the objective doesn't decrease
+            for j in xrange(10):
+                if psi_new >= psi or a_old is None:
+                    break
+                a       = 0.5*(a + a_old)
+                f_new   = m + np.dot(K, a)
+                psi_new = -0.5*np.dot(a, f_new - m) + self._log_binomial_likelihood_derivatives(f_new)[0]
+
+            converged = psi_new - psi < LAPLACE_TOL
+            f, psi, a_old = f_new, psi_new, a
+            if converged:
+                break
+
+        return {'f'              : f,
+                'a'              : a,
+                'sW'             : sW,
+                'L'              : L,
+                'K'              : K,
+                'log likelihood' : psi - np.sum(np.log(np.diag(L)))}
+
+    def _laplace_pseudo_observations(self):
+        """return the values and noise variances of the observations for
+        which a GP regression gives the Laplace approximation of the posterior
+        of the latent function: f + W^-1 grad log p(y|f) and W^-1, at the mode
+        f. With K the prior covariance, the mean of the latent values is then
+        K (K + W^-1)^-1 (f + W^-1 grad) = f and their covariance is
+        K - K (K + W^-1)^-1 K = (K^-1 + W)^-1, as in the approximation."""
+        f      = self.latent_values.value
+        d1, d2 = self._log_binomial_likelihood_derivatives(f)[1:3]
+        inv_W  = 1.0/np.maximum(-d2, MIN_CURVATURE)
+
+        return f + inv_W*d1, inv_W
+
+    def _compute_cholesky(self):
+        if self.inference != 'laplace':
+            return super(GPClassifier, self)._compute_cholesky()
+
+        # The pending points have noiseless fantasy values
+        noise = self._laplace_pseudo_observations()[1]
+        noise = np.append(noise, np.zeros(self.inputs.shape[0] - noise.shape[0]))
+
+        return spla.cholesky(self.kernel.cov(self.inputs) + np.diag(noise), lower=True)
+
+    def _log_binomial_likelihood_derivatives(self, y):
+        """return the binomial log likelihood of the latent values y and its
+        first, second and third derivatives wrt each of them"""
+        t = 2*self.counts - 1
+        z = t*y
+
+        if self.sigmoid_name == 'probit':
+            log_cdf = sps.norm.logcdf(z)
+            ratio   = np.exp(sps.norm.logpdf(z) - log_cdf)
+
+            d1 = t*ratio
+            d2 = -ratio*(z + ratio)
+            d3 = t*ratio*((z + ratio)*(z + 2*ratio) - 1)
+
+            return np.sum(log_cdf), d1, d2, d3
+        else:
+            p = sps.logistic.cdf(y)
+
+            d1 = self.counts - p
+            d2 = -p*(1 - p)
+            d3 = -p*(1 - p)*(1 - 2*p)
+
+            return -np.sum(np.logaddexp(0, -z)), d1, d2, d3
+
     def log_binomial_likelihood(self, y=None):
         # If no data, don't do anything
         if not self.has_data:
@@ -479,11 +751,10 @@ class GPClassifier(GP):
         for name, hyper in self.params.iteritems():
             gp_dict['hypers'][name] = hyper.value
 
-        # Save the latent values as a dict with keys as hashes of the data
-        # so that each latent value is associated with its input
-        # then when we load them in we know which ones are which
-        gp_dict['latent values'] = {str(hash(self._inputs[i].tostring())) : self.latent_values.value[i] 
-                for i in xrange(self._inputs.shape[0])}
+        # Save the latent values along with digests of the inputs they belong
+        # to, so that when we load them in we know which ones are which
+        gp_dict['latent values']        = self.latent_values.value.copy()
+        gp_dict['latent input digests'] = self._input_digests
 
         gp_dict['chain length'] = self.chain_length
 
@@ -491,7 +762,7 @@ class GPClassifier(GP):
 
     def from_dict(self, gp_dict):
         self._set_params_from_dict(gp_dict['hypers'])
-        self._set_latent_values_from_dict(gp_dict['latent values'])
+        self._set_latent_values_from_dict(gp_dict)
         self.chain_length = gp_dict['chain length']
 
 
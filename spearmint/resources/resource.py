@@ -327,6 +327,13 @@ class Resource(object):
 
         return True 
 
+    def numFreeSlots(self, jobs):
+        """How many more jobs can this resource currently accept?"""
+        if not self.acceptingJobs(jobs):
+            return 0
+
+        return self.max_concurrent - self.numPending(jobs)
+
     def printStatus(self, jobs):
         sys.stderr.write("%-12s: %5d pending %5d complete\n" %
             (self.name, self.numPending(jobs), self.numComplete(jobs)))
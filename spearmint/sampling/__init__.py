@@ -2,5 +2,6 @@ from abstract_sampler             import AbstractSampler
 from slice_sampler                import SliceSampler
 from whitened_prior_slice_sampler import WhitenedPriorSliceSampler
 from elliptical_slice_sampler     import EllipticalSliceSampler
+from hmc_sampler                  import HMCSampler
 
-__all__ = ["AbstractSampler", "SliceSampler", "WhitenedPriorSliceSampler", "EllipticalSliceSampler"]
\ No newline at end of file
+__all__ = ["AbstractSampler", "SliceSampler", "WhitenedPriorSliceSampler", "EllipticalSliceSampler", "HMCSampler"]
\ No newline at end of file
@@ -185,6 +185,8 @@
 
 from abc import ABCMeta, abstractmethod
 
+import scipy.linalg as spla
+
 from ..utils import param as hyperparameter_utils
 
 
@@ -210,6 +212,14 @@ class AbstractSampler(object):
     def sample(self, model):
         pass
 
+    def _prior_cov_chol(self, model):
+        """return the Cholesky factor of the prior covariance of the model at
+        its observed inputs, from the model if it remembers its factors"""
+        if hasattr(model, 'prior_cov_chol'):
+            return model.prior_cov_chol()
+
+        return spla.cholesky(model.noiseless_kernel.cov(model.inputs), lower=True)
+
     def print_diagnostics(self):
         params_array = hyperparameter_utils.params_to_array(self.params)
         for param in self.params:
@@ -205,9 +205,8 @@ class EllipticalSliceSampler(AbstractSampler):
         if not model.has_data:
             return np.zeros(0) # TODO this should be a sample from the prior...
 
-        prior_cov      = model.noiseless_kernel.cov(model.inputs)
-        prior_cov_chol = spla.cholesky(prior_cov, lower=True)
-        # Here get the Cholesky from model
+        # A model may remember the factor from the sampling of the hypers
+        prior_cov_chol = self._prior_cov_chol(model)
 
         params_array = hyperparameter_utils.params_to_array(self.params)
         for i in xrange(self.thinning + 1):
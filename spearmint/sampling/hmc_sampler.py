@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+# Spearmint
+#
+# Academic and Non-Commercial Research Use Software License and Terms
+# of Use
+#
+# Spearmint is a software package to perform Bayesian optimization
+# according to specific algorithms (the “Software”).  The Software is
+# designed to automatically run experiments (thus the code name
+# 'spearmint') in a manner that iteratively adjusts a number of
+# parameters so as to minimize some objective in as few runs as
+# possible.
+#
+# The Software was developed by Ryan P. Adams, Michael Gelbart, and
+# Jasper Snoek at Harvard University, Kevin Swersky at the
+# University of Toronto (“Toronto”), and Hugo Larochelle at the
+# Université de Sherbrooke (“Sherbrooke”), which assigned its rights
+# in the Software to Socpra Sciences et Génie
+# S.E.C. (“Socpra”). Pursuant to an inter-institutional agreement
+# between the parties, it is distributed for free academic and
+# non-commercial research use by the President and Fellows of Harvard
+# College (“Harvard”).
+#
+# Using the Software indicates your agreement to be bound by the terms
+# of this Software Use Agreement (“Agreement”). Absent your agreement
+# to the terms below, you (the “End User”) have no rights to hold or
+# use the Software whatsoever.
+#
+# Harvard agrees to grant hereunder the limited non-exclusive license
+# to End User for the use of the Software in the performance of End
+# User’s internal, non-commercial research and academic use at End
+# User’s academic or not-for-profit research institution
+# (“Institution”) on the following terms and conditions:
+#
+# 1.  NO REDISTRIBUTION. The Software remains the property Harvard,
+# Toronto and Socpra, and except as set forth in Section 4, End User
+# shall not publish, distribute, or otherwise transfer or make
+# available the Software to any other party.
+#
+# 2.  NO COMMERCIAL USE. End User shall not use the Software for
+# commercial purposes and any such use of the Software is expressly
+# prohibited. This includes, but is not limited to, use of the
+# Software in fee-for-service arrangements, core facilities or
+# laboratories or to provide research services to (or in collaboration
+# with) third parties for a fee, and in industry-sponsored
+# collaborative research projects where any commercial rights are
+# granted to the sponsor. If End User wishes to use the Software for
+# commercial purposes or for any other restricted purpose, End User
+# must execute a separate license agreement with Harvard.
+#
+# Requests for use of the Software for commercial purposes, please
+# contact:
+#
+# Office of Technology Development
+# Harvard University
+# Smith Campus Center, Suite 727E
+# 1350 Massachusetts Avenue
+# Cambridge, MA 02138 USA
+# Telephone: (617) 495-3067
+# Facsimile: (617) 495-9568
+# E-mail: otd@harvard.edu
+#
+# 3.  OWNERSHIP AND COPYRIGHT NOTICE. Harvard, Toronto and Socpra own
+# all intellectual property in the Software. End User shall gain no
+# ownership to the Software. End User shall not remove or delete and
+# shall retain in the Software, in any modifications to Software and
+# in any Derivative Works, the copyright, trademark, or other notices
+# pertaining to Software as provided with the Software.
+#
+# 4.  DERIVATIVE WORKS. End User may create and use Derivative Works,
+# as such term is defined under U.S. copyright laws, provided that any
+# such Derivative Works shall be restricted to non-commercial,
+# internal research and academic use at End User’s Institution. End
+# User may distribute Derivative Works to other Institutions solely
+# for the performance of non-commercial, internal research and
+# academic use on terms substantially similar to this License and
+# Terms of Use.
+#
+# 5.  FEEDBACK. In order to improve the Software, comments from End
+# Users may be useful. End User agrees to provide Harvard with
+# feedback on the End User’s use of the Software (e.g., any bugs in
+# the Software, the user experience, etc.).  Harvard is permitted to
+# use such information provided by End User in making changes and
+# improvements to the Software without compensation or an accounting
+# to End User.
+#
+# 6.  NON ASSERT. End User acknowledges that Harvard, Toronto and/or
+# Sherbrooke or Socpra may develop modifications to the Software that
+# may be based on the feedback provided by End User under Section 5
+# above. Harvard, Toronto and Sherbrooke/Socpra shall not be
+# restricted in any way by End User regarding their use of such
+# information.  End User acknowledges the right of Harvard, Toronto
+# and Sherbrooke/Socpra to prepare, publish, display, reproduce,
+# transmit and or use modifications to the Software that may be
+# substantially similar or functionally equivalent to End User’s
+# modifications and/or improvements if any.  In the event that End
+# User obtains patent protection for any modification or improvement
+# to Software, End User agrees not to allege or enjoin infringement of
+# End User’s patent against Harvard, Toronto or Sherbrooke or Socpra,
+# or any of the researchers, medical or research staff, officers,
+# directors and employees of those institutions.
+#
+# 7.  PUBLICATION & ATTRIBUTION. End User has the right to publish,
+# present, or share results from the use of the Software.  In
+# accordance with customary academic practice, End User will
+# acknowledge Harvard, Toronto and Sherbrooke/Socpra as the providers
+# of the Software and may cite the relevant reference(s) from the
+# following list of publications:
+#
+# Practical Bayesian Optimization of Machine Learning Algorithms
+# Jasper Snoek, Hugo Larochelle and Ryan Prescott Adams
+# Neural Information Processing Systems, 2012
+#
+# Multi-Task Bayesian Optimization
+# Kevin Swersky, Jasper Snoek and Ryan Prescott Adams
+# Advances in Neural Information Processing Systems, 2013
+#
+# Input Warping for Bayesian Optimization of Non-stationary Functions
+# Jasper Snoek, Kevin Swersky, Richard Zemel and Ryan Prescott Adams
+# Preprint, arXiv:1402.0929, http://arxiv.org/abs/1402.0929, 2013
+#
+# Bayesian Optimization and Semiparametric Models with Applications to
+# Assistive Technology Jasper Snoek, PhD Thesis, University of
+# Toronto, 2013
+#
+# 8.  NO WARRANTIES. THE SOFTWARE IS PROVIDED "AS IS." TO THE FULLEST
+# EXTENT PERMITTED BY LAW, HARVARD, TORONTO AND SHERBROOKE AND SOCPRA
+# HEREBY DISCLAIM ALL WARRANTIES OF ANY KIND (EXPRESS, IMPLIED OR
+# OTHERWISE) REGARDING THE SOFTWARE, INCLUDING BUT NOT LIMITED TO ANY
+# IMPLIED WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+# PURPOSE, OWNERSHIP, AND NON-INFRINGEMENT.  HARVARD, TORONTO AND
+# SHERBROOKE AND SOCPRA MAKE NO WARRANTY ABOUT THE ACCURACY,
+# RELIABILITY, COMPLETENESS, TIMELINESS, SUFFICIENCY OR QUALITY OF THE
+# SOFTWARE.  HARVARD, TORONTO AND SHERBROOKE AND SOCPRA DO NOT WARRANT
+# THAT THE SOFTWARE WILL OPERATE WITHOUT ERROR OR INTERRUPTION.
+#
+# 9.  LIMITATIONS OF LIABILITY AND REMEDIES. USE OF THE SOFTWARE IS AT
+# END USER’S OWN RISK. IF END USER IS DISSATISFIED WITH THE SOFTWARE,
+# ITS EXCLUSIVE REMEDY IS TO STOP USING IT.  IN NO EVENT SHALL
+# HARVARD, TORONTO OR SHERBROOKE OR SOCPRA BE LIABLE TO END USER OR
+# ITS INSTITUTION, IN CONTRACT, TORT OR OTHERWISE, FOR ANY DIRECT,
+# INDIRECT, SPECIAL, INCIDENTAL, CONSEQUENTIAL, PUNITIVE OR OTHER
+# DAMAGES OF ANY KIND WHATSOEVER ARISING OUT OF OR IN CONNECTION WITH
+# THE SOFTWARE, EVEN IF HARVARD, TORONTO OR SHERBROOKE OR SOCPRA IS
+# NEGLIGENT OR OTHERWISE AT FAULT, AND REGARDLESS OF WHETHER HARVARD,
+# TORONTO OR SHERBROOKE OR SOCPRA IS ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGES.
+#
+# 10. INDEMNIFICATION. To the extent permitted by law, End User shall
+# indemnify, defend and hold harmless Harvard, Toronto and Sherbrooke
+# and Socpra, their corporate affiliates, current or future directors,
+# trustees, officers, faculty, medical and professional staff,
+# employees, students and agents and their respective successors,
+# heirs and assigns (the "Indemnitees"), against any liability,
+# damage, loss or expense (including reasonable attorney's fees and
+# expenses of litigation) incurred by or imposed upon the Indemnitees
+# or any one of them in connection with any claims, suits, actions,
+# demands or judgments arising from End User’s breach of this
+# Agreement or its Institution’s use of the Software except to the
+# extent caused by the gross negligence or willful misconduct of
+# Harvard, Toronto or Sherbrooke or Socpra. This indemnification
+# provision shall survive expiration or termination of this Agreement.
+#
+# 11. GOVERNING LAW. This Agreement shall be construed and governed by
+# the laws of the Commonwealth of Massachusetts regardless of
+# otherwise applicable choice of law standards.
+#
+# 12. NON-USE OF NAME.  Nothing in this License and Terms of Use shall
+# be construed as granting End Users or their Institutions any rights
+# or licenses to use any trademarks, service marks or logos associated
+# with the Software.  You may not use the terms “Harvard” or
+# “University of Toronto” or “Université de Sherbrooke” or “Socpra
+# Sciences et Génie S.E.C.” (or a substantially similar term) in any
+# way that is inconsistent with the permitted uses described
+# herein. You agree not to use any name or emblem of Harvard, Toronto
+# or Sherbrooke, or any of their subdivisions for any purpose, or to
+# falsely suggest any relationship between End User (or its
+# Institution) and Harvard, Toronto and/or Sherbrooke, or in any
+# manner that would infringe or violate any of their rights.
+#
+# 13. End User represents and warrants that it has the legal authority
+# to enter into this License and Terms of Use on behalf of itself and
+# its Institution.
+
+
+import numpy        as np
+import numpy.random as npr
+
+from .abstract_sampler import AbstractSampler
+from ..utils           import param as hyperparameter_utils
+
+DEFAULT_STEP_SIZE          = 0.05
+DEFAULT_NUM_STEPS          = 20
+DEFAULT_TARGET_ACCEPT_RATE = 0.65
+
+
+def log_space_mask(params):
+    """return a boolean array which is True for the values of the params
+    that are positive under their prior, and so can be handled in log space"""
+    positive = []
+    for param in params:
+        value = np.asarray(param.value, dtype=float)
+        is_positive = np.all(value > 0) and param.prior.logprob(-value) == -np.inf
+        positive.append(np.repeat(is_positive, param.size()))
+
+    return np.hstack(positive)
+
+def log_space_logprob_and_grad(z, params, model, positive):
+    """compute the log probability of the params (priors and model log
+    likelihood) and its gradient at z, where the positive values are the
+    logs of the param values. Returns -inf and None where it is zero."""
+    x = np.where(positive, np.exp(z), z)
+    hyperparameter_utils.set_params_from_array(params, x)
+
+    lp = np.sum([param.prior_logprob() for param in params])
+    if not np.isfinite(lp):
+        return -np.inf, None
+
+    try:
+        ll, grad = model.log_likelihood_and_grad(params)
+    except np.linalg.LinAlgError:
+        return -np.inf, None
+
+    grad = grad + np.hstack([np.ones(param.size())*param.prior_grad_logprob() for param in params])
+
+    # The Jacobian of the change of variables
+    lp   = lp + ll + np.sum(z[positive])
+    grad = np.where(positive, grad*x + 1.0, grad)
+
+    if not np.isfinite(lp) or not np.all(np.isfinite(grad)):
+        return -np.inf, None
+
+    return lp, grad
+
+
+class HMCSampler(AbstractSampler):
+    """generate samples from a model using Hamiltonian Monte Carlo
+
+    This uses the gradients of the priors and of the model log likelihood,
+    which the model must provide with log_likelihood_and_grad(params), to
+    sample all the parameters jointly with few likelihood evaluations.
+
+    Parameters which are positive under their prior are sampled in log
+    space. The number of leapfrog steps of each trajectory is drawn
+    uniformly between 1 and num_steps, which avoids periodic trajectories
+    without having to tune their length. While adapt_step_size is True, the
+    step size is adapted towards target_accept_rate, with a decreasing rate
+    of adaptation. Adaptation must be turned off once burn-in is over, so
+    that the samples kept come from a fixed transition kernel.
+
+    The gradients only need to be approximate: the trajectories are accepted
+    or rejected with the exact log probability, so the chain still targets
+    the posterior, but poor gradients lower the acceptance rate. E.g. the
+    gradients of the GP wrt the BetaWarp parameters are central differences
+    of the beta cdf.
+
+    Parameters
+    ----------
+    *params_to_sample : args of type Params
+    **sampler_options
+        step_size, num_steps, target_accept_rate, adapt_step_size and thinning
+    """
+    def __init__(self, *params_to_sample, **sampler_options):
+        super(HMCSampler, self).__init__(*params_to_sample, **sampler_options)
+
+        self.step_size          = sampler_options.get('step_size', DEFAULT_STEP_SIZE)
+        self.num_steps          = sampler_options.get('num_steps', DEFAULT_NUM_STEPS)
+        self.target_accept_rate = sampler_options.get('target_accept_rate', DEFAULT_TARGET_ACCEPT_RATE)
+        self.adapt_step_size    = sampler_options.get('adapt_step_size', True)
+
+        self.num_samples = 0
+        self.num_accepts = 0
+
+    def logprob(self, x, model):
+        """compute the log probability of the parameters x, i.e. the sum of the
+        log priors and of the model log likelihood"""
+        hyperparameter_utils.set_params_from_array(self.params, x)
+
+        lp = np.sum([param.prior_logprob() for param in self.params])
+        if not np.isfinite(lp):
+            return lp
+
+        return lp + model.log_likelihood()
+
+    def sample(self, model):
+        """generate a new sample of the parameters, whose values are updated"""
+        positive = log_space_mask(self.params)
+        x        = hyperparameter_utils.params_to_array(self.params)
+        z        = np.where(positive, np.log(np.where(positive, x, 1.0)), x)
+
+        lp, grad = log_space_logprob_and_grad(z, self.params, model, positive)
+        if grad is None:
+            raise Exception("HMC sampler started at a point with %f logprob" % lp)
+
+        for i in xrange(self.thinning + 1):
+            z, lp, grad = self._trajectory(z, lp, grad, model, positive)
+
+        hyperparameter_utils.set_params_from_array(self.params, np.where(positive, np.exp(z), z))
+        self.current_ll = lp # for diagnostics
+
+    def _trajectory(self, z, lp, grad, model, positive):
+        """simulate one leapfrog trajectory from z and accept or reject its end"""
+        momentum     = npr.randn(z.size)
+        start_energy = -lp + 0.5*np.dot(momentum, momentum)
+
+        z_new, lp_new, grad_new = z, lp, grad
+        p = momentum + 0.5*self.step_size*grad
+        for step in xrange(npr.randint(1, self.num_steps+1)):
+            if step > 0:
+                p = p + self.step_size*grad_new
+            z_new = z_new + self.step_size*p
+            lp_new, grad_new = log_space_logprob_and_grad(z_new, self.params, model, positive)
+            if grad_new is None:
+                break
+
+        if grad_new is None:
+            accept_prob = 0.0
+        else:
+            p = p + 0.5*self.step_size*grad_new
+            with np.errstate(over='ignore'):
+                accept_prob = min(1.0, np.exp(start_energy - (-lp_new + 0.5*np.dot(p, p))))
+
+        # Adapt the step size, less and less as more samples are taken
+        self.num_samples += 1
+        if self.adapt_step_size:
+            self.step_size *= np.exp((accept_prob - self.target_accept_rate) / self.num_samples**0.6)
+
+        if npr.rand() < accept_prob:
+            self.num_accepts += 1
+            return z_new, lp_new, grad_new
+        else:
+            return z, lp, grad
+
+    def print_diagnostics(self):
+        super(HMCSampler, self).print_diagnostics()
+        print '    step size: %f, acceptance rate: %f' % (self.step_size, self.num_accepts / max(self.num_samples, 1.0))
@@ -205,8 +205,7 @@ class WhitenedPriorSliceSampler(AbstractSampler):
     """
 
     def _compute_implied_y(self, model, nu):
-        K_XX = model.noiseless_kernel.cov(model.inputs)
-        L    = spla.cholesky(K_XX, lower=True) 
+        L = self._prior_cov_chol(model)
         
         return np.dot(L, nu) + model.mean.value
 
@@ -237,8 +236,7 @@ class WhitenedPriorSliceSampler(AbstractSampler):
         params_array = hyperparameter_utils.params_to_array(self.params)
 
         if model.has_data:
-            K_XX      = model.noiseless_kernel.cov(model.inputs)
-            current_L = spla.cholesky(K_XX, lower=True)
+            current_L = self._prior_cov_chol(model)
             nu        = spla.solve_triangular(current_L, model.latent_values.value-model.mean.value, lower=True)
         else:
             nu = None # if no data
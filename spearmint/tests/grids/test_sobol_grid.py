@@ -183,14 +183,69 @@
 # its Institution.
 
 
+import os
+import shutil
+import tempfile
 import numpy as np
 
 from collections          import OrderedDict
 from spearmint.grids      import sobol_grid
 
+# The tests cache their grids in a temporary directory
+_directory = None
+_old_cache = None
+
+def setup():
+    global _directory, _old_cache
+    _directory = tempfile.mkdtemp()
+    _old_cache = os.environ.get('SPEARMINT_GRID_CACHE')
+    os.environ['SPEARMINT_GRID_CACHE'] = _directory
+
+def teardown():
+    sobol_grid._grids.clear()
+    if _old_cache is None:
+        del os.environ['SPEARMINT_GRID_CACHE']
+    else:
+        os.environ['SPEARMINT_GRID_CACHE'] = _old_cache
+    shutil.rmtree(_directory)
+
 def test_generate():
     grid = sobol_grid.generate(10, grid_size=100, grid_seed=1)
 
     assert grid.shape == (100,10)
     assert np.all(grid[0] == 0.5)
 
+
+def test_generate_cache():
+    directory = os.path.join(_directory, 'cache')
+    os.environ['SPEARMINT_GRID_CACHE'] = directory
+    try:
+        grid = sobol_grid.generate(3, grid_size=50, grid_seed=2)
+        assert len(os.listdir(directory)) == 1
+
+        # Memoized in memory
+        assert sobol_grid.generate(3, grid_size=50, grid_seed=2) is grid
+
+        # Loaded from the disk cache
+        sobol_grid._grids.clear()
+        cached = sobol_grid.generate(3, grid_size=50, grid_seed=2)
+        assert isinstance(cached, np.memmap)
+        assert np.all(cached == grid)
+        assert np.all(cached == sobol_grid.sobol(52, 3)[2:])
+        assert not cached.flags.writeable
+    finally:
+        sobol_grid._grids.clear()
+        os.environ['SPEARMINT_GRID_CACHE'] = _directory
+
+def test_generate_memo():
+    sobol_grid._grids.clear()
+
+    # Only the most recently used grids are kept in memory
+    grids = [sobol_grid.generate(2, grid_size=10, grid_seed=i) for i in xrange(sobol_grid.MAX_GRIDS)]
+    sobol_grid.generate(2, grid_size=10, grid_seed=0)
+    sobol_grid.generate(2, grid_size=10, grid_seed=sobol_grid.MAX_GRIDS)
+
+    assert len(sobol_grid._grids) == sobol_grid.MAX_GRIDS
+    assert (2, 10, 0) in sobol_grid._grids
+    assert (2, 10, 1) not in sobol_grid._grids
+    assert np.all(sobol_grid.generate(2, grid_size=10, grid_seed=1) == grids[1])
@@ -217,3 +217,49 @@ def test_matern_grad():
 
 
 
+
+def test_cross_cov_and_grad_data():
+    npr.seed(1)
+
+    N = 10
+    M = 5
+    D = 3
+
+    kernel = Matern52(D)
+
+    data1 = npr.randn(N,D)
+    data2 = npr.randn(M,D)
+
+    cov, grad = kernel.cross_cov_and_grad_data(data1, data2)
+    np.testing.assert_allclose(cov, kernel.cross_cov(data1, data2))
+    assert grad.shape == (N,M,D)
+
+    # The gradient of each entry of the covariance
+    eps = 1e-5
+    for j in xrange(D):
+        data2[:,j] += eps
+        cov_1 = kernel.cross_cov(data1, data2)
+        data2[:,j] -= 2*eps
+        cov_2 = kernel.cross_cov(data1, data2)
+        data2[:,j] += eps
+        np.testing.assert_allclose(grad[:,:,j], (cov_1 - cov_2) / (2*eps), rtol=1e-5, atol=1e-8)
+
+def test_memo():
+    npr.seed(1)
+
+    N = 10
+    D = 3
+
+    kernel = Matern52(D)
+    data   = npr.rand(N,D)
+
+    # Only the squared distances for the last inputs and length scales are kept
+    cov = kernel.cov(data)
+    np.testing.assert_allclose(cov, kernel.cross_cov(data, data))
+    assert len(kernel._memo._entries) == 1
+    assert kernel._memo.cached_bytes == N*N*8
+
+    kernel.ls.value = 2*kernel.ls.value
+    np.testing.assert_allclose(kernel.cov(data), kernel.cross_cov(data, data))
+    assert not np.allclose(kernel.cov(data), cov)
+    assert len(kernel._memo._entries) == 1
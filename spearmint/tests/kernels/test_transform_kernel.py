@@ -227,3 +227,34 @@ def test_grad():
 
 
 
+
+def test_memo():
+    npr.seed(1)
+
+    N = 10
+    M = 5
+    D = 3
+
+    beta_warp   = BetaWarp(D)
+    transformer = Transformer(D)
+    transformer.add_layer(beta_warp)
+
+    kernel = TransformKernel(Matern52(D), transformer)
+
+    data1 = npr.rand(N,D)
+    data2 = npr.rand(M,D)
+
+    cov     = kernel.cov(data1)
+    tinputs = kernel._memo_forward_pass(data1)
+    assert kernel._memo_forward_pass(data1) is tinputs
+    assert np.all(kernel.cov(data1) == cov)
+
+    # Changing the warping must not reuse the old transformed inputs
+    beta_warp.alpha.value = beta_warp.alpha.value*2
+    cov_2 = kernel.cov(data1)
+    assert kernel._memo_forward_pass(data1) is not tinputs
+    assert not np.allclose(cov_2, cov)
+
+    fresh_kernel = TransformKernel(Matern52(D), transformer)
+    np.testing.assert_allclose(cov_2, fresh_kernel.cov(data1))
+    np.testing.assert_allclose(kernel.cross_cov(data1, data2), fresh_kernel.cross_cov(data1, data2))
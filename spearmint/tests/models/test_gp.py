@@ -182,10 +182,14 @@
 # to enter into this License and Terms of Use on behalf of itself and
 # its Institution.
 
+import pickle
 import numpy        as np
 import numpy.random as npr
 
 from spearmint.models import GP
+from spearmint.models import gp as gp_module
+from spearmint.models.abstract_model import function_over_hypers
+from spearmint.utils import param as hyperparameter_utils
 
 def test_gp_init():
     gp = GP(5)
@@ -207,7 +211,7 @@ def test_fit():
 
     assert gp.chain_length == 15
     assert all([np.all(p.value != p.initial_value) for p in gp.params.values()])
-    assert len(gp._cache_list) == 10
+    assert len(gp._cache) == 10
     assert len(gp._hypers_list) == 10
     assert len(gp._fantasy_values_list) == 10
 
@@ -278,3 +282,368 @@ def test_predict():
     assert np.linalg.norm(dloss - dloss_est) < 1e-6
 
 
+
+def test_incremental_cholesky():
+    npr.seed(1)
+
+    N     = 10
+    Npend = 3
+    D     = 5
+
+    gp = GP(D, burnin=5)
+
+    inputs  = npr.rand(N,D)
+    pending = npr.rand(Npend,D)
+    W       = npr.randn(D,1)
+    vals    = inputs.dot(W).flatten() + np.sqrt(1e-3)*npr.randn(N)
+
+    gp.fit(inputs, vals, pending)
+
+    # The factors with pending points were extended from the ones
+    # computed for the fantasies and must match a full factorization
+    for i in xrange(gp.num_states):
+        gp.set_state(i)
+        chol = np.linalg.cholesky(gp.kernel.cov(gp.inputs))
+        np.testing.assert_allclose(gp._cache[i]['chol'], chol, rtol=1e-7, atol=1e-10)
+
+    # The stored factors count against the memory budget and are not pickled
+    assert len(gp._chol_store) == gp.num_states
+    assert gp._cache_bytes > sum(c['chol'].nbytes + c['alpha'].nbytes for c in gp._cache.values())
+    assert len(pickle.loads(pickle.dumps(gp))._chol_store) == 0
+
+    gp_small = GP(D, burnin=5, max_cache_mb=gp._cache_bytes/2.0/1024/1024)
+    gp_small.fit(inputs, vals, pending)
+    assert gp_small._cache_bytes <= gp_small.max_cache_bytes
+
+    # Refitting with more data and the same hypers gives the factor of all the data
+    more_inputs = np.vstack((inputs, npr.rand(2,D)))
+    more_vals   = more_inputs.dot(W).flatten()
+
+    gp.fit(inputs, vals, fit_hypers=False)
+
+    # The factor of the earlier data is extended, not computed again: the
+    # only factorization is of the block of the new inputs
+    calls = {'extend' : [], 'cholesky' : []}
+    def counted(name, func):
+        def inner(*args, **kwargs):
+            calls[name].append(args[0].shape[0])
+            return func(*args, **kwargs)
+        return inner
+
+    chol_extend, cholesky  = gp_module.chol_extend, gp_module.spla.cholesky
+    gp_module.chol_extend   = counted('extend', chol_extend)
+    gp_module.spla.cholesky = counted('cholesky', cholesky)
+    try:
+        gp.fit(more_inputs, more_vals, fit_hypers=False)
+    finally:
+        gp_module.chol_extend   = chol_extend
+        gp_module.spla.cholesky = cholesky
+
+    assert calls['extend'] == [N]
+    assert calls['cholesky'] == [2]
+
+    mu, v = gp.predict(more_inputs)
+    np.testing.assert_allclose(mu, more_vals, rtol=1e-3, atol=1e-3)
+    np.testing.assert_allclose(gp._cache[0]['chol'], np.linalg.cholesky(gp.kernel.cov(more_inputs)), rtol=1e-7, atol=1e-10)
+
+def test_predict_over_hypers():
+    npr.seed(1)
+
+    N     = 10
+    Npend = 3
+    Ntest = 4
+    D     = 5
+
+    gp = GP(D, burnin=5, num_fantasies=3)
+
+    inputs  = npr.rand(N,D)
+    pending = npr.rand(Npend,D)
+    pred    = npr.rand(Ntest,D)
+    W       = npr.randn(D,1)
+    vals    = inputs.dot(W).flatten() + np.sqrt(1e-3)*npr.randn(N)
+
+    gp.fit(inputs, vals, pending)
+
+    # The predictions from the cached states must average to the same as
+    # the loop over states
+    assert gp._all_states_cached()
+    looped  = function_over_hypers([gp], gp.predict, pred, compute_grad=True)
+    batched = gp.predict_over_hypers(pred, compute_grad=True)
+
+    for l, b in zip(looped, batched):
+        assert b.shape == (gp.num_states,) + l.shape
+        np.testing.assert_allclose(b.mean(axis=0), l, rtol=1e-7, atol=1e-10)
+
+def test_update_pending():
+    npr.seed(1)
+
+    N     = 10
+    Npend = 3
+    Ntest = 4
+    D     = 5
+
+    gp = GP(D, burnin=5, num_fantasies=1)
+
+    inputs  = npr.rand(N,D)
+    pending = npr.rand(Npend,D)
+    pred    = npr.rand(Ntest,D)
+    W       = npr.randn(D,1)
+    vals    = inputs.dot(W).flatten() + np.sqrt(1e-3)*npr.randn(N)
+
+    gp.fit(inputs, vals, pending)
+    hypers_list = gp._hypers_list
+    mean, var   = gp.predict_over_hypers(pred)
+
+    # Changing the pending points keeps the hypers and regenerates the fantasies
+    gp.update_pending(np.vstack((pending, npr.rand(2,D))))
+    assert gp._hypers_list is hypers_list
+    assert gp.inputs.shape[0] == N + Npend + 2
+    assert len(gp._fantasy_values_list) == gp.num_states
+
+    gp.update_pending(None)
+    assert gp.inputs.shape[0] == N
+
+    gp.update_pending(pending)
+    mean_2, var_2 = gp.predict_over_hypers(pred)
+    np.testing.assert_allclose(mean_2, mean, rtol=1e-7, atol=1e-10)
+    np.testing.assert_allclose(var_2, var, rtol=1e-7, atol=1e-10)
+
+def test_prediction_cache():
+    npr.seed(1)
+
+    N     = 10
+    Ntest = 4
+    D     = 5
+
+    gp = GP(D, burnin=5)
+
+    inputs  = npr.rand(N,D)
+    pred    = npr.rand(Ntest,D)
+    W       = npr.randn(D,1)
+    vals    = inputs.dot(W).flatten() + np.sqrt(1e-3)*npr.randn(N)
+
+    gp.fit(inputs, vals)
+    mean, var = gp.predict_over_hypers(pred)
+
+    gp.enable_prediction_cache()
+    predictions = gp.predict_over_hypers(pred)
+    assert gp.predict_over_hypers(pred.copy()) is predictions
+    assert not predictions[0].flags.writeable
+    np.testing.assert_allclose(predictions[0], mean)
+    np.testing.assert_allclose(predictions[1], var)
+
+    # Changing the model drops the cached predictions
+    gp.update_pending(npr.rand(2,D))
+    assert gp.predict_over_hypers(pred) is not predictions
+
+    # Nothing is cached past the memory limit
+    gp.enable_prediction_cache(max_mb=0)
+    assert gp.predict_over_hypers(pred) is not gp.predict_over_hypers(pred)
+
+    gp.disable_prediction_cache()
+    assert gp.predict_over_hypers(pred)[0].flags.writeable
+
+def test_cache_budget():
+    npr.seed(1)
+
+    N     = 10
+    Ntest = 4
+    D     = 5
+
+    inputs  = npr.rand(N,D)
+    pred    = npr.rand(Ntest,D)
+    W       = npr.randn(D,1)
+    vals    = inputs.dot(W).flatten() + np.sqrt(1e-3)*npr.randn(N)
+
+    # The same seed gives the same samples for each GP
+    npr.seed(2)
+    gp = GP(D, burnin=5)
+    gp.fit(inputs, vals)
+    mean, var = gp.predict_over_hypers(pred)
+
+    # Only the last states fit in the budget, which the kernel memos share
+    npr.seed(2)
+    state_bytes = (N*N + N)*8
+    gp_small = GP(D, burnin=5, max_cache_mb=3.5*state_bytes/1024./1024.)
+    gp_small.fit(inputs, vals)
+    num_cached = len(gp_small._cache)
+    assert 1 < num_cached <= 3
+    assert gp_small._cache.keys() == range(gp.num_states-num_cached, gp.num_states)
+    assert gp_small._cache_bytes <= gp_small.max_cache_bytes
+    assert not gp_small._all_states_cached()
+
+    # Predicting state by state leaves the state as it was
+    gp_small.set_state(0)
+    mean_small, var_small = gp_small.predict_over_hypers(pred)
+    assert gp_small.state == 0
+    assert gp_small.params['mean'].value == gp_small._hypers_list[0]['mean']
+    np.testing.assert_allclose(mean_small, mean, rtol=1e-7, atol=1e-10)
+    np.testing.assert_allclose(var_small, var, rtol=1e-7, atol=1e-10)
+
+    # The least recently used state is evicted first
+    gp_small._cache_get(gp.num_states-num_cached)
+    gp_small._cache_put(0, np.eye(N), np.zeros(N))
+    assert gp_small._cache.keys()[-2:] == [gp.num_states-num_cached, 0]
+    assert len(gp_small._cache) <= num_cached
+    assert gp_small._cache_bytes <= gp_small.max_cache_bytes
+
+    # Single precision halves the memory
+    npr.seed(2)
+    gp_float32 = GP(D, burnin=5, cache_float32=True)
+    gp_float32.fit(inputs, vals)
+    assert sum(c['chol'].nbytes + c['alpha'].nbytes for c in gp_float32._cache.values()) == gp.num_states*state_bytes/2
+
+    mean_float32, var_float32 = gp_float32.predict_over_hypers(pred)
+    np.testing.assert_allclose(mean_float32, mean, rtol=1e-4, atol=1e-4)
+    np.testing.assert_allclose(var_float32, var, rtol=1e-4, atol=1e-4)
+
+def test_log_likelihood_and_grad():
+    npr.seed(1)
+
+    eps = 1e-6
+    N   = 12
+    D   = 3
+
+    inputs = npr.rand(N,D)
+    vals   = np.sin(inputs.dot(npr.randn(D)))
+
+    gp = GP(D)
+    gp.fit(inputs, vals, fit_hypers=False)
+
+    gp.params['ls'].value         = npr.rand(D) + 0.5
+    gp.params['beta_alpha'].value = npr.rand(D) + 0.5
+    gp.params['beta_beta'].value  = npr.rand(D) + 0.5
+    gp.params['noise'].value      = 0.01
+    gp.params['amp2'].value       = 1.3
+    gp.params['mean'].value       = 0.2
+
+    params   = [gp.params[name] for name in ['mean', 'amp2', 'noise', 'ls', 'beta_alpha', 'beta_beta']]
+    ll, grad = gp.log_likelihood_and_grad(params)
+    np.testing.assert_allclose(ll, gp.log_likelihood())
+
+    params_array = hyperparameter_utils.params_to_array(params)
+    grad_est     = np.zeros(grad.shape)
+    for i in xrange(params_array.size):
+        params_array[i] += eps
+        hyperparameter_utils.set_params_from_array(params, params_array)
+        ll_1 = gp.log_likelihood()
+        params_array[i] -= 2*eps
+        hyperparameter_utils.set_params_from_array(params, params_array)
+        ll_2 = gp.log_likelihood()
+        params_array[i] += eps
+        grad_est[i] = (ll_1 - ll_2) / (2*eps)
+
+    np.testing.assert_allclose(grad, grad_est, rtol=1e-4, atol=1e-5)
+
+def test_fit_hmc():
+    npr.seed(1)
+
+    N = 15
+    D = 2
+
+    inputs = npr.rand(N,D)
+    vals   = np.sin(inputs.dot(npr.randn(D)))
+
+    gp = GP(D, burnin=5, mcmc_iters=5, sampler='hmc')
+    gp.fit(inputs, vals)
+
+    assert len(gp._hypers_list) == 5
+    mean, var = gp.predict(inputs)
+    np.testing.assert_allclose(mean, vals, atol=0.1)
+
+    # The step size is frozen once burn-in is over
+    step_size = gp._samplers[0].step_size
+    gp.fit(inputs, vals, hypers=gp.to_dict())
+    assert gp._samplers[0].step_size == step_size
+
+def test_fit_optimize():
+    npr.seed(1)
+
+    N = 15
+    D = 2
+
+    inputs = npr.rand(N,D)
+    vals   = np.sin(inputs.dot(npr.randn(D)))
+
+    gp     = GP(D, **{'fit-mode' : 'optimize'})
+    hypers = gp.fit(inputs, vals)
+
+    assert gp.num_states == 1
+    mean, var = gp.predict(inputs)
+    np.testing.assert_allclose(mean, vals, atol=0.1)
+
+    # Warm starting from these hypers can only improve on them
+    log_posterior = lambda gp: gp.log_likelihood() + sum([p.prior_logprob() for p in gp.params.values()])
+
+    gp_2 = GP(D, **{'fit-mode' : 'optimize', 'fit-restarts' : 1})
+    gp_2.fit(inputs, vals, hypers=hypers)
+    assert log_posterior(gp_2) >= log_posterior(gp) - 1e-8
+
+def test_fit_adaptive():
+    npr.seed(1)
+
+    N = 15
+    D = 2
+
+    inputs = npr.rand(N,D)
+    vals   = np.sin(inputs.dot(npr.randn(D)))
+
+    gp     = GP(D, mcmc_adaptive=True)
+    hypers = gp.fit(inputs, vals)
+
+    assert len(hypers['hypers list']) == gp.num_states
+    assert gp.num_states <= gp.mcmc_iters
+
+    # The chain continues from the previous states, without burn-in
+    gp_2     = GP(D, mcmc_adaptive=True)
+    hypers_2 = gp_2.fit(inputs, vals, hypers=hypers)
+
+    new_samples = gp_2.diagnostics['new samples']
+    assert hypers_2['chain length'] == hypers['chain length'] + new_samples
+    assert gp_2.mcmc_min_iters <= new_samples <= gp_2.mcmc_max_iters
+    assert gp_2.num_states <= gp_2.mcmc_iters
+
+    # A chain too short for the R-hat isn't taken to have drifted
+    gp_4 = GP(D, mcmc_adaptive=True, mcmc_iters=5, burnin=5)
+    gp_4.fit(inputs, vals)
+    assert gp_4.num_states >= 4
+    assert gp_4.diagnostics['new samples'] < gp_4.mcmc_max_iters
+
+    # Without the adaptive mode the states aren't saved
+    gp_3 = GP(D)
+    assert 'hypers list' not in gp_3.fit(inputs, vals, hypers=hypers)
+    assert gp_3.num_states == gp_3.mcmc_iters
+
+def test_fit_chains():
+    npr.seed(1)
+
+    N = 15
+    D = 2
+
+    inputs = npr.rand(N,D)
+    vals   = np.sin(inputs.dot(npr.randn(D)))
+
+    options = {'mcmc_chains' : 3, 'mcmc_iters' : 6, 'burnin' : 10}
+
+    npr.seed(2)
+    gp     = GP(D, mcmc_workers=1, **options)
+    hypers = gp.fit(inputs, vals)
+
+    assert gp.num_states == 6
+    assert gp.chain_length == 12
+    assert gp.diagnostics['chains'] == 3
+    assert len(hypers['chain hypers']) == 3
+
+    # Each chain has its own random seed, so the pool gives the same samples
+    npr.seed(2)
+    gp_2 = GP(D, mcmc_workers=3, **options)
+    gp_2.fit(inputs, vals)
+
+    for hypers_1, hypers_2 in zip(gp._hypers_list, gp_2._hypers_list):
+        for name in hypers_1:
+            np.testing.assert_array_equal(hypers_1[name], hypers_2[name])
+
+    # The chains continue from their last states, without burn-in
+    gp_3 = GP(D, mcmc_workers=1, **options)
+    gp_3.fit(inputs, vals, hypers=hypers)
+    assert gp_3.chain_length == 14
@@ -186,6 +186,7 @@ import numpy        as np
 import numpy.random as npr
 
 from spearmint.models import GPClassifier
+from spearmint.utils  import param as hyperparameter_utils
 
 def test_gp_init():
     gp = GPClassifier(5)
@@ -223,7 +224,7 @@ def test_fit():
 
     assert gp.chain_length == burnin + mcmc_iters
     assert all([np.all(p.value != p.initial_value) for p in gp.params.values()])
-    assert len(gp._cache_list) == mcmc_iters
+    assert len(gp._cache) == mcmc_iters
     assert len(gp._hypers_list) == mcmc_iters
     assert len(gp._latent_values_list) == mcmc_iters
     assert len(gp._fantasy_values_list) == mcmc_iters
@@ -286,4 +287,128 @@ def test_predict():
             pred[i,j] += eps
             dloss_est[i,j] = ((loss_1 - loss_2) / (2*eps))
 
-    assert np.linalg.norm(dloss - dloss_est) < 1e-5
\ No newline at end of file
+    assert np.linalg.norm(dloss - dloss_est) < 1e-5
+
+def test_laplace_log_likelihood_and_grad():
+    npr.seed(1)
+
+    eps = 1e-6
+    N   = 12
+    D   = 3
+
+    inputs = npr.rand(N,D)
+    vals   = inputs.dot(npr.randn(D)) > 0
+
+    for sigmoid in ['probit', 'logistic']:
+        gp = GPClassifier(D, inference='laplace', sigmoid=sigmoid)
+        gp.fit(inputs, vals, fit_hypers=False)
+
+        gp.params['ls'].value         = npr.rand(D) + 0.5
+        gp.params['beta_alpha'].value = npr.rand(D) + 0.5
+        gp.params['beta_beta'].value  = npr.rand(D) + 0.5
+        gp.params['amp2'].value       = 1.3
+        gp.params['mean'].value       = 0.2
+
+        params   = [gp.params[name] for name in ['mean', 'amp2', 'ls', 'beta_alpha', 'beta_beta']]
+        # The mode is found iteratively from the current latent values,
+        # which are left as they are
+        latent_values = gp.latent_values.value.copy()
+        ll, grad      = gp.log_likelihood_and_grad(params)
+        np.testing.assert_allclose(ll, gp.log_likelihood(), rtol=1e-5)
+        np.testing.assert_array_equal(gp.latent_values.value, latent_values)
+
+        # The gradient includes the change of the mode of the latent values
+        params_array = hyperparameter_utils.params_to_array(params)
+        grad_est     = np.zeros(grad.shape)
+        for i in xrange(params_array.size):
+            params_array[i] += eps
+            hyperparameter_utils.set_params_from_array(params, params_array)
+            ll_1 = gp.log_likelihood()
+            params_array[i] -= 2*eps
+            hyperparameter_utils.set_params_from_array(params, params_array)
+            ll_2 = gp.log_likelihood()
+            params_array[i] += eps
+            grad_est[i] = (ll_1 - ll_2) / (2*eps)
+
+        np.testing.assert_allclose(grad, grad_est, rtol=1e-4, atol=1e-6)
+
+def test_fit_laplace():
+    npr.seed(1)
+
+    N             = 10
+    D             = 5
+    num_pending   = 3
+    num_fantasies = 2
+
+    inputs     = np.vstack((0.1*npr.rand(N,D),npr.rand(N,D)))
+    inputs[12] = np.ones(D)
+    pending    = npr.rand(num_pending,D)
+    W          = npr.randn(D,1)
+    vals       = (inputs - inputs.mean(0)).dot(W).flatten() > 0
+
+    gp = GPClassifier(D, num_fantasies=num_fantasies, **{'inference' : 'laplace', 'fit-mode' : 'optimize'})
+    gp.fit(inputs, vals, pending)
+
+    assert gp.num_states == 1
+    assert gp.values.shape == (2*N + num_pending, num_fantasies)
+
+    # The latent values are the mode of their posterior, and the
+    # predictions at the inputs are centered on it
+    latent_values = gp.latent_values.value
+    assert np.all((latent_values > 0) == vals)
+
+    gp.pending = None
+    gp._clear_cache()
+    mean, var = gp.predict(inputs)
+    np.testing.assert_allclose(mean, latent_values, atol=1e-3)
+
+    probs = gp.pi(inputs)
+    assert np.all((probs > 0.5) == vals)
+
+def test_latent_values_dict():
+    npr.seed(1)
+
+    N = 10
+    D = 3
+
+    inputs = npr.rand(N,D)
+    vals   = inputs.dot(npr.randn(D)) > 0
+
+    gp = GPClassifier(D)
+    gp.fit(inputs, vals, fit_hypers=False)
+    gp.latent_values.value = npr.randn(N)
+    gp_dict = gp.to_dict()
+
+    # Only digests of the inputs are saved, and the saved values are a copy
+    assert 'latent inputs' not in gp_dict
+    assert gp_dict['latent input digests'].shape == (N,)
+    assert gp_dict['latent values'] is not gp.latent_values.value
+
+    # New inputs were appended
+    new_inputs = np.vstack((inputs, npr.rand(2,D)))
+    new_vals   = np.append(vals, [True, False])
+    gp_2 = GPClassifier(D)
+    gp_2.fit(new_inputs, new_vals, hypers=gp_dict, fit_hypers=False)
+    np.testing.assert_array_equal(gp_2.latent_values.value, np.append(gp_dict['latent values'], [0.5, -0.5]))
+
+    # The inputs were reordered
+    order = npr.permutation(N)
+    gp_3  = GPClassifier(D)
+    gp_3.fit(inputs[order], vals[order], hypers=gp_dict, fit_hypers=False)
+    np.testing.assert_array_equal(gp_3.latent_values.value, gp_dict['latent values'][order])
+
+    # The format with the inputs saved along with the latent values
+    inputs_dict = dict(gp_dict)
+    del inputs_dict['latent input digests']
+    inputs_dict['latent inputs'] = inputs
+    gp_5 = GPClassifier(D)
+    gp_5.fit(inputs[order], vals[order], hypers=inputs_dict, fit_hypers=False)
+    np.testing.assert_array_equal(gp_5.latent_values.value, gp_dict['latent values'][order])
+
+    # The legacy format, keyed by hashes of the inputs
+    legacy_dict = dict(gp_dict)
+    del legacy_dict['latent input digests']
+    legacy_dict['latent values'] = dict((str(hash(inputs[i].tostring())), gp_dict['latent values'][i]) for i in xrange(N))
+    gp_4 = GPClassifier(D)
+    gp_4.fit(inputs[order], vals[order], hypers=legacy_dict, fit_hypers=False)
+    np.testing.assert_array_equal(gp_4.latent_values.value, gp_dict['latent values'][order])
@@ -221,3 +221,19 @@ def test_backward_pass():
 
 
 
+
+def test_backward_pass_hypers():
+    npr.seed(1)
+
+    N = 10
+    D = 5
+
+    lin  = Linear(D)
+    data = npr.rand(N,D)
+    V    = npr.randn(N,D)
+    lin.forward_pass(data)
+    grad = lin.backward_pass_hypers(V)[0][1]
+
+    # Changing the inputs after the forward pass doesn't change the gradient
+    data[:] = 0.0
+    np.testing.assert_array_equal(lin.backward_pass_hypers(V)[0][1], grad)
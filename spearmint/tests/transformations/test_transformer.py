@@ -407,3 +407,63 @@ def test_add_layer():
     assert len(t.layer_transformations) == 2
     assert output_inds == range(10)
 
+
+def test_backward_pass_hypers():
+    npr.seed(1)
+
+    eps = 1e-6
+    N   = 4
+    D   = 3
+
+    beta_warp   = BetaWarp(D)
+    lin         = Linear(D)
+    transformer = Transformer(D)
+    transformer.add_layer(beta_warp)
+    transformer.add_layer(lin)
+
+    beta_warp.alpha.value = npr.rand(D) + 0.5
+    beta_warp.beta.value  = npr.rand(D) + 0.5
+
+    inputs = npr.rand(N,D)
+    V      = npr.randn(N,lin.num_factors)
+
+    transformer.forward_pass(inputs)
+    grads = transformer.backward_pass_hypers(V)
+    assert [hyper for hyper, grad in grads] == [lin.weights, beta_warp.alpha, beta_warp.beta]
+
+    # The gradient of sum(V*outputs) wrt each hyper
+    for hyper, grad in grads:
+        grad_est = np.zeros(grad.shape)
+        for i in xrange(grad.size):
+            hyper.value[i] += eps
+            loss_1 = np.sum(V*transformer.forward_pass(inputs))
+            hyper.value[i] -= 2*eps
+            loss_2 = np.sum(V*transformer.forward_pass(inputs))
+            hyper.value[i] += eps
+            grad_est[i] = (loss_1 - loss_2) / (2*eps)
+
+        np.testing.assert_allclose(grad, grad_est, rtol=1e-4, atol=1e-6)
+
+def test_permuted_inds():
+    npr.seed(1)
+
+    N = 6
+    D = 6
+
+    st1 = SimpleTransformation(2)
+    st2 = SimpleTransformation(3)
+
+    t = Transformer(D)
+    t.add_layer((st1,[4,1]), (st2,[2,3,5]))
+
+    inputs  = npr.rand(N,D)
+    outputs = t.forward_pass(inputs)
+    assert np.all(outputs == np.hstack((2*inputs[:,[4,1]], 2*inputs[:,[2,3,5]], inputs[:,[0]])))
+
+    # A stack of gradients, as for the gradients wrt several candidates
+    V    = npr.randn(3,N,D)
+    grad = t.backward_pass(V)
+    assert grad.shape == (3,N,D)
+    assert np.all(grad[...,[4,1]]   == 2*V[...,0:2]*inputs[:,[4,1]])
+    assert np.all(grad[...,[2,3,5]] == 2*V[...,2:5]*inputs[:,[2,3,5]])
+    assert np.all(grad[...,0]       == V[...,5])
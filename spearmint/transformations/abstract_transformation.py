@@ -201,6 +201,14 @@ class AbstractTransformation(object):
     def backward_pass(self, V):
         pass
 
+    # Like backward_pass, but returns the gradients wrt the hypers as a list
+    # of (hyper, gradient) pairs. V is the gradient of a scalar function wrt
+    # the outputs of the last forward pass, one row per input.
+    def backward_pass_hypers(self, V):
+        if self.hypers is None:
+            return []
+        raise NotImplementedError('%s does not implement gradients wrt its hypers.' % self.__class__.__name__)
+
     def output_num_dims(self):
         return self.num_dims
 
@@ -183,8 +183,8 @@
 # its Institution.
 
 import warnings
-import numpy       as np
-import scipy.stats as sps
+import numpy         as np
+import scipy.special as spec
 
 from .abstract_transformation import AbstractTransformation
 from ..utils                  import priors
@@ -234,24 +234,55 @@ class BetaWarp(AbstractTransformation):
 
         assert self.alpha.value.shape[0] == self.num_dims and self.beta.value.shape[0] == self.num_dims
 
+        self._log_beta = (None, None, None) # alpha, beta and the log of their beta function
+
     @property
     def hypers(self):
         return (self.alpha, self.beta)
 
+    def _log_beta_function(self, a, b):
+        """return the log of the beta function of a and b, which normalizes
+        the pdf, remembering it for the last values of a and b"""
+        last_a, last_b, log_beta = self._log_beta
+        if log_beta is None or not np.array_equal(last_a, a) or not np.array_equal(last_b, b):
+            log_beta       = spec.betaln(a, b)
+            self._log_beta = (np.copy(a), np.copy(b), log_beta)
+
+        return log_beta
+
+    # The beta cdf and pdf are computed with scipy.special directly, which
+    # avoids the argument checking of the distributions in scipy.stats
     @truncate_inputs
     def forward_pass(self, inputs):
-        self._inputs = inputs
+        self._inputs     = inputs
+        self._log_inputs = None
 
-        return sps.beta.cdf(inputs, self.alpha.value, self.beta.value)
+        return spec.betainc(self.alpha.value, self.beta.value, inputs)
 
     def backward_pass(self, V):
-        dx = sps.beta.pdf(self._inputs, self.alpha.value, self.beta.value)
-        dx[np.logical_not(np.isfinite(dx))] = 1.0
-
-        return dx*V
-
+        a, b = self.alpha.value, self.beta.value
 
+        # The logs of the inputs only depend on them, not on the parameters
+        if self._log_inputs is None:
+            with np.errstate(divide='ignore'):
+                self._log_inputs = (np.log(self._inputs), np.log1p(-self._inputs))
+        log_x, log_1mx = self._log_inputs
 
+        # x^(a-1) (1-x)^(b-1) / B(a,b), where 0*log(0) is 0 as in the pdf
+        with np.errstate(invalid='ignore', over='ignore'):
+            dx = np.exp(np.where(a == 1, 0.0, (a-1)*log_x) + np.where(b == 1, 0.0, (b-1)*log_1mx) - self._log_beta_function(a, b))
+        dx[np.logical_not(np.isfinite(dx))] = 1.0
 
+        return dx*V
 
+    def backward_pass_hypers(self, V):
+        # The derivatives of the beta cdf wrt its parameters have no closed
+        # form, so use central differences. Each dimension has its own
+        # parameters, so all the dimensions are perturbed at once.
+        a, b   = self.alpha.value, self.beta.value
+        eps_a  = 1e-6*np.maximum(a, 1.0)
+        eps_b  = 1e-6*np.maximum(b, 1.0)
+        dcdf_a = (spec.betainc(a+eps_a, b, self._inputs) - spec.betainc(a-eps_a, b, self._inputs)) / (2*eps_a)
+        dcdf_b = (spec.betainc(a, b+eps_b, self._inputs) - spec.betainc(a, b-eps_b, self._inputs)) / (2*eps_b)
 
+        return [(self.alpha, np.sum(dcdf_a*V, axis=0)), (self.beta, np.sum(dcdf_b*V, axis=0))]
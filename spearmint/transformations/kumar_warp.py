@@ -250,13 +250,43 @@ class KumarWarp(AbstractTransformation):
     @truncate_inputs
     def forward_pass(self, inputs):
         self._inputs = inputs
-        x = _kumaraswamy_cdf(inputs, self.alpha.value, self.beta.value)
+
+        # The powers x^a and (1-x^a)^b are shared with the backward passes
+        xa             = inputs**self.alpha.value
+        one_minus_xa   = 1.0 - xa
+        one_minus_xa_b = one_minus_xa**self.beta.value
+        self._powers   = (xa, one_minus_xa, one_minus_xa_b)
+
+        x = 1.0 - one_minus_xa_b
         assert(np.all(np.isfinite(x)))
 
         return x
 
     def backward_pass(self, V):
-        dx = _kumaraswamy_pdf(self._inputs, self.alpha.value, self.beta.value)
+        a, b = self.alpha.value, self.beta.value
+        xa, one_minus_xa, one_minus_xa_b = self._powers
+
+        # The pdf a b x^(a-1) (1-x^a)^(b-1) from the powers of the forward
+        # pass, except at 0 and 1 where they can't be divided
+        with np.errstate(divide='ignore', invalid='ignore'):
+            dx = a*b*(xa/self._inputs)*(one_minus_xa_b/one_minus_xa)
+
+        edges = np.logical_or(self._inputs == 0, one_minus_xa == 0)
+        if np.any(edges):
+            shape     = self._inputs.shape
+            dx[edges] = _kumaraswamy_pdf(self._inputs[edges], np.broadcast_to(a, shape)[edges], np.broadcast_to(b, shape)[edges])
         dx[np.logical_not(np.isfinite(dx))] = 1.0
 
         return dx*V
+
+    def backward_pass_hypers(self, V):
+        a, b = self.alpha.value, self.beta.value
+        xa, one_minus_xa, one_minus_xa_b = self._powers
+        with np.errstate(divide='ignore', invalid='ignore'):
+            dcdf_a = b*(one_minus_xa_b/one_minus_xa)*xa*np.log(self._inputs)
+            dcdf_b = -one_minus_xa_b*np.log(one_minus_xa)
+        # At 0 and 1 the derivatives are 0 in the limit
+        dcdf_a[np.logical_not(np.isfinite(dcdf_a))] = 0.0
+        dcdf_b[np.logical_not(np.isfinite(dcdf_b))] = 0.0
+
+        return [(self.alpha, np.sum(dcdf_a*V, axis=0)), (self.beta, np.sum(dcdf_b*V, axis=0))]
@@ -219,11 +219,18 @@ class Linear(AbstractTransformation):
         return self.num_factors
 
     def forward_pass(self, inputs):
+        # The Transformer may pass a view of its inputs, which the caller
+        # could change before the backward pass
+        self._inputs = inputs.copy()
+
         return inputs.dot(self.W)
 
     def backward_pass(self, V):
         return V.dot(self.W.T)
 
+    def backward_pass_hypers(self, V):
+        return [(self.weights, self._inputs.T.dot(V).flatten())]
+
 
 
 
@@ -220,5 +220,8 @@ class NormLin(AbstractTransformation):
 
         return JV_norm
 
+    def backward_pass_hypers(self, V):
+        return self._proj.backward_pass_hypers(V)
+
 
 
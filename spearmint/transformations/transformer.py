@@ -203,6 +203,10 @@ class Transformer(object):
         self.layer_remaining_inds  = []
         self.layer_output_dims     = []
 
+        # Per layer, the transformations with the columns they read and
+        # write, followed by the columns copied through, if any
+        self._layer_plans = []
+
     def add_layer(self, *layer_transformations):
         num_input_dims = self.layer_output_dims[-1] if self.layer_output_dims else self.num_dims
 
@@ -231,11 +235,27 @@ class Transformer(object):
             output_inds.append(list(np.arange(ndims)+i))
             i += ndims
 
+        self._layer_plans.append(self._plan_layer(transformations, t_inds, self.layer_remaining_inds[-1], output_inds))
+
         if len(layer_transformations) == 1:
             return output_inds[0]
         else:
             return output_inds
 
+    @property
+    def hypers(self):
+        """the hyperparameters of all the transformations, as a flat list"""
+        hypers = []
+        for transformations in self.layer_transformations:
+            for transformation in transformations:
+                t_hypers = transformation.hypers
+                if isinstance(t_hypers, (tuple, list)):
+                    hypers.extend(t_hypers)
+                elif t_hypers is not None:
+                    hypers.append(t_hypers)
+
+        return hypers
+
     def validate_layer(self, layer_inds):
         counts = defaultdict(int)
 
@@ -246,47 +266,82 @@ class Transformer(object):
         assert np.array(counts.keys()).max() < self.num_dims, 'Maximum index exceeds number of dimensions.'
         assert all([count == 1 for count in counts.values()]), 'Each index may only be used once.'
 
+    def _plan_layer(self, transformations, t_inds, remaining_inds, output_inds):
+        """the steps of a layer as (transformation, input columns, output
+        columns) triples, where the transformation None copies the columns
+        through. Columns are slices where they are contiguous."""
+        steps = [(transformation, _columns(inds), _columns(out_inds))
+                 for transformation, inds, out_inds in zip(transformations, t_inds, output_inds)]
+
+        if remaining_inds:
+            i = sum(map(len, output_inds))
+            steps.append((None, _columns(remaining_inds), slice(i, i+len(remaining_inds))))
+
+        return steps
+
     def forward_pass(self, inputs):
         assert self.layer_transformations, 'Transformer should contain transformations.'
-        
-        prev_layer = inputs
-        for transformations, t_inds, remaining_inds, output_num_dims in zip(self.layer_transformations,
-                                                                            self.layer_inds,
-                                                                            self.layer_remaining_inds,
-                                                                            self.layer_output_dims):
-
-            layer_out = np.zeros((prev_layer.shape[0], output_num_dims))
-            i = 0
-            for transformation, inds in zip(transformations, t_inds):
-                t_len = transformation.output_num_dims()
-                layer_out[:,i:i+t_len] = transformation.forward_pass(prev_layer[:,inds])
-                i += t_len
-
-            layer_out[:,i:] = prev_layer[:,remaining_inds]
+
+        layer_out = inputs
+        for steps, output_num_dims in zip(self._layer_plans, self.layer_output_dims):
             prev_layer = layer_out
+            layer_out  = np.empty((prev_layer.shape[0], output_num_dims))
+            for transformation, in_cols, out_cols in steps:
+                if transformation is None:
+                    layer_out[:,out_cols] = prev_layer[:,in_cols]
+                else:
+                    layer_out[:,out_cols] = transformation.forward_pass(prev_layer[:,in_cols])
 
         return layer_out
 
     def backward_pass(self, V):
         assert self.layer_transformations, 'Transformer should contain transformations.'
 
-        for transformations, t_inds, remaining_inds, output_num_dims in zip(
-                self.layer_transformations,
-                self.layer_inds,
-                self.layer_remaining_inds,
-                self.layer_output_dims)[::-1]:
+        for layer in xrange(len(self._layer_plans)-1, -1, -1):
+            V = self._layer_backward_pass(self._layer_plans[layer], V, self._layer_input_dims(layer))
 
-            JV = np.zeros(list(V.shape[:-1])+[len([i for inds in t_inds for i in inds]) + len(remaining_inds)])
-            i = 0
-            for transformation, inds in zip(transformations, t_inds):
-                t_len = transformation.output_num_dims()
-                JV[...,inds] = transformation.backward_pass(V[...,i:i+t_len])
-                i += t_len
+        return V
 
-            JV[...,remaining_inds] = V[...,i:]
-            V = JV
+    def backward_pass_hypers(self, V):
+        """return the gradients wrt the hypers of all the transformations, as
+        a list of (hyper, gradient) pairs. V is the gradient of a scalar
+        function wrt the outputs of the last forward pass."""
+        assert self.layer_transformations, 'Transformer should contain transformations.'
+
+        grads = []
+        for layer in xrange(len(self._layer_plans)-1, -1, -1):
+            steps = self._layer_plans[layer]
+            for transformation, in_cols, out_cols in steps:
+                if transformation is not None:
+                    grads.extend(transformation.backward_pass_hypers(V[...,out_cols]))
+
+            # Only the hypers of earlier layers need V at the inputs of this layer
+            if layer > 0:
+                V = self._layer_backward_pass(steps, V, self._layer_input_dims(layer))
+
+        return grads
+
+    def _layer_input_dims(self, layer):
+        return self.layer_output_dims[layer-1] if layer > 0 else self.num_dims
+
+    def _layer_backward_pass(self, steps, V, num_input_dims):
+        # Every input column is read by exactly one step, so each is written once
+        JV = np.empty(V.shape[:-1] + (num_input_dims,))
+        for transformation, in_cols, out_cols in steps:
+            if transformation is None:
+                JV[...,in_cols] = V[...,out_cols]
+            else:
+                JV[...,in_cols] = transformation.backward_pass(V[...,out_cols])
 
         return JV
 
+def _columns(inds):
+    """a slice for contiguous increasing indices, else an index array"""
+    inds = np.array(inds, dtype=np.intp)
+    if inds.size > 0 and np.all(np.diff(inds) == 1):
+        return slice(int(inds[0]), int(inds[-1])+1)
+
+    return inds
+
         
         
\ No newline at end of file
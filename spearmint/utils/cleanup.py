@@ -185,9 +185,9 @@
 
 import os
 import sys
-import pymongo
 import json
-from parsing import parse_db_address
+from parsing  import parse_db_address
+from database import connect
 
 
 def cleanup(path):
@@ -198,14 +198,13 @@ def cleanup(path):
     with open(os.path.join(path, 'config.json'), 'r') as f:
         cfg = json.load(f)
 
-    db_address = parse_db_address(cfg)
+    db_address = parse_db_address(cfg, path)
     print 'Cleaning up experiment %s in database at %s' % (cfg["experiment-name"], db_address)
 
-    client = pymongo.MongoClient(db_address)
-
-    db = client.spearmint
-    db[cfg["experiment-name"]]['jobs'].drop()
-    db[cfg["experiment-name"]]['hypers'].drop()
+    # Removing all the documents works the same with every database backend
+    db = connect(db_address)
+    db.remove(cfg["experiment-name"], 'jobs')
+    db.remove(cfg["experiment-name"], 'hypers')
 
 if __name__ == '__main__':
     cleanup(sys.argv[1])
\ No newline at end of file
@@ -185,28 +185,73 @@
 import zlib
 import numpy as np
 
+try:
+    from bson.binary import Binary
+except ImportError:
+    Binary = str
+
+# Arrays are stored as a dict with the raw (possibly compressed) bytes of the
+# array in a BSON binary, along with the codec, dtype and shape needed to
+# read them back.
+BINARY_TYPE   = 'binary array'
+
+# The legacy format: the zlib-compressed, base64-encoded bytes of a float64 array
 COMPRESS_TYPE = 'compressed array'
 
-# TODO: see if there is a better way to encode this than base64
-# It takes about 0.65 seconds to compress a 1000x1000 array on a 2011 Macbook air
-def compress_array(a):
-    return {'ctype'  : COMPRESS_TYPE,
+DEFAULT_CODEC = 'raw'
+
+# The codecs used to encode the bytes of arrays, mapping a name to a pair of
+# functions (compress, decompress) from a buffer to a string of bytes
+CODECS = {'raw'  : (lambda buf: buf, lambda buf: buf),
+          'zlib' : (lambda buf: zlib.compress(buf, 1), zlib.decompress)}
+
+try:
+    import lz4.block
+    CODECS['lz4'] = (lz4.block.compress, lz4.block.decompress)
+except ImportError:
+    pass
+
+def register_codec(name, compress, decompress):
+    """Make a codec available to compress_array and decompress_array.
+    compress takes a buffer and returns a string of bytes and decompress
+    does the opposite."""
+    CODECS[name] = (compress, decompress)
+
+def compress_array(a, codec=None):
+    codec = DEFAULT_CODEC if codec is None else codec
+    if codec not in CODECS:
+        raise Exception('Unknown array codec: %s' % codec)
+
+    a = np.ascontiguousarray(a)
+    return {'ctype'  : BINARY_TYPE,
+            'codec'  : codec,
+            'dtype'  : a.dtype.str,
             'shape'  : list(a.shape),
-            'value'  : (zlib.compress(a).encode('base64'))}
+            'value'  : Binary(CODECS[codec][0](a.tobytes()))}
 
-# It takes about 0.15 seconds to decompress a 1000x1000 array on a 2011 Macbook air
 def decompress_array(a):
-    return np.fromstring(zlib.decompress(a['value'].decode('base64'))).reshape(a['shape'])
+    """Return the array stored in the dict a. The array is a read-only view
+    on the bytes in a when they are not compressed."""
+    if a['ctype'] == COMPRESS_TYPE:
+        return np.frombuffer(zlib.decompress(a['value'].decode('base64')), dtype=np.float64).reshape(a['shape'])
+
+    if a['codec'] not in CODECS:
+        raise Exception('Unknown array codec: %s' % a['codec'])
+
+    return np.frombuffer(CODECS[a['codec']][1](a['value']), dtype=np.dtype(str(a['dtype']))).reshape(a['shape'])
+
+def is_compressed_array(c_container):
+    return c_container.get('ctype') in (BINARY_TYPE, COMPRESS_TYPE)
 
-def compress_nested_container(u_container):
+def compress_nested_container(u_container, codec=None):
     if isinstance(u_container, dict):
         cdict = {}
         for key, value in u_container.iteritems():
             if isinstance(value, dict) or isinstance(value, list):
-                cdict[key] = compress_nested_container(value)
+                cdict[key] = compress_nested_container(value, codec)
             else:
                 if isinstance(value, np.ndarray):
-                    cdict[key] = compress_array(value)
+                    cdict[key] = compress_array(value, codec)
                 else:
                     cdict[key] = value
 
@@ -215,10 +260,10 @@ def compress_nested_container(u_container):
         clist = []
         for value in u_container:
             if isinstance(value, dict) or isinstance(value, list):
-                clist.append(compress_nested_container(value))
+                clist.append(compress_nested_container(value, codec))
             else:
                 if isinstance(value, np.ndarray):
-                    clist.append(compress_array(value))
+                    clist.append(compress_array(value, codec))
                 else:
                     clist.append(value)
 
@@ -226,7 +271,7 @@ def compress_nested_container(u_container):
 
 def decompress_nested_container(c_container):
     if isinstance(c_container, dict):
-        if c_container.has_key('ctype') and c_container['ctype'] == COMPRESS_TYPE:
+        if is_compressed_array(c_container):
             try:
                 return decompress_array(c_container)
             except:
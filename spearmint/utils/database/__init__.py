@@ -0,0 +1,14 @@
+# Addresses of SQLite databases are the path of the file after this prefix.
+SQLITE_SCHEME = 'sqlite://'
+
+def connect(database_address, database_name='spearmint'):
+    """Connect to the database at database_address, which is either the
+    address of a MongoDB server or sqlite:// followed by the path of an
+    SQLite file. The backends are imported here so that using one does not
+    require the dependencies of the other."""
+    if database_address.startswith(SQLITE_SCHEME):
+        from sqlitedb import SQLiteDB
+        return SQLiteDB(database_address[len(SQLITE_SCHEME):], database_name=database_name)
+    else:
+        from mongodb import MongoDB
+        return MongoDB(database_address=database_address, database_name=database_name)
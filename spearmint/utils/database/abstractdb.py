@@ -194,4 +194,20 @@ class AbstractDB(object):
 
     @abstractmethod
     def load(self, collection_name, expt_id):
+        pass
+
+    @abstractmethod
+    def save_many(self, save_docs, experiment_name, experiment_field, key='id'):
+        pass
+
+    @abstractmethod
+    def update(self, update_fields, experiment_name, experiment_field, field_filters):
+        pass
+
+    @abstractmethod
+    def bulk_update(self, updates, experiment_name, experiment_field):
+        pass
+
+    @abstractmethod
+    def remove(self, experiment_name, experiment_field, field_filters={}):
         pass
\ No newline at end of file
@@ -187,26 +187,72 @@ import time
 import pymongo
 import numpy.random as npr
 
+from pymongo                     import ReplaceOne, UpdateOne, ReturnDocument
+from pymongo.errors              import OperationFailure
+
 from abstractdb                  import AbstractDB
 from spearmint.utils.compression import compress_nested_container, decompress_nested_container
 
+# Fields to index in each collection, so that documents can be looked up by
+# id and polled by modification time without scanning the collection.
+INDEXED_FIELDS = {'jobs' : ['id', 'modified time']}
+
+# Indexed fields whose values are unique, so that a save filtered on one of
+# them can't be ambiguous.
+UNIQUE_FIELDS = {'jobs' : ['id']}
+
 class MongoDB(AbstractDB):
     def __init__(self, database_address='localhost', database_name='spearmint'):
         try:
             self.client = pymongo.MongoClient(database_address)
             self.db     = self.client[database_name]
-            
-            # Get the ID of this connection for locking.
-            self.myId = self.db.last_status()['connectionId']
+
+            # The client connects lazily, so check that the server is there.
+            self.client.admin.command('ping')
         except:
             raise Exception('Could not establish a connection to MongoDB.')
 
+        self._unique_fields = {}
+
+    def _collection(self, experiment_name, experiment_field):
+        """Return the collection, creating its indexes the first time it is used."""
+        dbcollection = self.db[experiment_name][experiment_field]
+
+        if (experiment_name, experiment_field) not in self._unique_fields:
+            unique_fields = set()
+            for field in INDEXED_FIELDS.get(experiment_field, []):
+                unique = field in UNIQUE_FIELDS.get(experiment_field, [])
+                try:
+                    dbcollection.create_index(field, unique=unique)
+                except OperationFailure:
+                    # E.g. a collection indexed before the index was unique
+                    if not unique:
+                        raise
+                    dbcollection.create_index(field)
+                else:
+                    if unique:
+                        unique_fields.add(field)
+            self._unique_fields[(experiment_name, experiment_field)] = unique_fields
+
+        return dbcollection
+
+    def _is_unique_filter(self, experiment_name, experiment_field, field_filters):
+        """Whether field_filters match at most one document, because they
+        require a value of a unique field."""
+        unique_fields = self._unique_fields[(experiment_name, experiment_field)]
+        return any(field in field_filters and not isinstance(field_filters[field], dict)
+                   for field in unique_fields)
+
     def save(self, save_doc, experiment_name, experiment_field, field_filters=None):
         """
         Saves a document into the database.
         Compresses any numpy arrays so that they can be saved to MongoDB.
         field_filters must return at most one document, otherwise it is not clear
-        which one to update and an exception will be raised.
+        which one to update and an exception will be raised. The document is
+        replaced by save_doc, or save_doc is inserted if there is none. This
+        is a single write when field_filters require a value of a unique
+        field (e.g. the id of a job), otherwise the documents are counted
+        first.
         """
 
         if field_filters is None:
@@ -214,26 +260,60 @@ class MongoDB(AbstractDB):
 
         save_doc = compress_nested_container(save_doc)
 
-        dbcollection = self.db[experiment_name][experiment_field]
-        dbdocs       = list(dbcollection.find(field_filters))
+        dbcollection = self._collection(experiment_name, experiment_field)
+        if not self._is_unique_filter(experiment_name, experiment_field, field_filters) and \
+                dbcollection.count_documents(field_filters, limit=2) > 1:
+            raise Exception('Ambiguous save attempted. Field filters returned more than one document.')
 
-        upsert = False
+        result = dbcollection.replace_one(field_filters, save_doc, upsert=True)
 
-        if len(dbdocs) > 1:
-            raise Exception('Ambiguous save attempted. Field filters returned more than one document.')
-        elif len(dbdocs) == 1:
-            dbdoc = dbdocs[0]
+        if result.upserted_id is not None:
+            return result.upserted_id
         else:
-            #sys.stderr.write('Document not found, inserting new document.\n')
-            upsert = True
+            return result.matched_count > 0
 
-        #TODO: change this to find_and_modify
-        result = dbcollection.update(field_filters, save_doc, upsert=upsert)
+    def save_many(self, save_docs, experiment_name, experiment_field, key='id'):
+        """
+        Saves several documents into the database in a single bulk write.
+        Each document replaces the one with the same value of the field key,
+        or is inserted if there is none.
+        """
+        if len(save_docs) == 0:
+            return
 
-        if upsert:
-            return result['upserted']
-        else:
-            return result['updatedExisting']
+        requests = [ReplaceOne({key : save_doc[key]}, compress_nested_container(save_doc), upsert=True)
+                    for save_doc in save_docs]
+
+        return self._collection(experiment_name, experiment_field).bulk_write(requests, ordered=False)
+
+    def update(self, update_fields, experiment_name, experiment_field, field_filters):
+        """
+        Sets the fields in update_fields on the document matching field_filters
+        with an atomic find-and-modify, and returns the updated document (or
+        None if no document matched).
+        """
+        dbcollection = self._collection(experiment_name, experiment_field)
+        dbdoc        = dbcollection.find_one_and_update(field_filters,
+                                                        {'$set' : compress_nested_container(update_fields)},
+                                                        return_document=ReturnDocument.AFTER)
+
+        if dbdoc is None:
+            return None
+        return decompress_nested_container(dbdoc)
+
+    def bulk_update(self, updates, experiment_name, experiment_field):
+        """
+        Applies several updates in a single bulk write. updates is a list
+        of (field_filters, update_fields) pairs, and the fields in update_fields
+        are set on the document matching field_filters.
+        """
+        if len(updates) == 0:
+            return
+
+        requests = [UpdateOne(field_filters, {'$set' : compress_nested_container(update_fields)})
+                    for field_filters, update_fields in updates]
+
+        return self._collection(experiment_name, experiment_field).bulk_write(requests, ordered=False)
 
     def load(self, experiment_name, experiment_field, field_filters=None):
         # Return a list of documents from the database, decompressing any numpy arrays
@@ -241,7 +321,7 @@ class MongoDB(AbstractDB):
         if field_filters is None:
             field_filters = {}
 
-        dbcollection = self.db[experiment_name][experiment_field]
+        dbcollection = self._collection(experiment_name, experiment_field)
         dbdocs       = list(dbcollection.find(field_filters))
 
         if len(dbdocs) == 0:
@@ -252,5 +332,4 @@ class MongoDB(AbstractDB):
             return [decompress_nested_container(dbdoc) for dbdoc in dbdocs]
 
     def remove(self, experiment_name, experiment_field, field_filters={}):
-        self.db[experiment_name][experiment_field].remove(field_filters)
-
+        self.db[experiment_name][experiment_field].delete_many(field_filters)
@@ -0,0 +1,397 @@
+# -*- coding: utf-8 -*-
+# Spearmint
+#
+# Academic and Non-Commercial Research Use Software License and Terms
+# of Use
+#
+# Spearmint is a software package to perform Bayesian optimization
+# according to specific algorithms (the “Software”).  The Software is
+# designed to automatically run experiments (thus the code name
+# 'spearmint') in a manner that iteratively adjusts a number of
+# parameters so as to minimize some objective in as few runs as
+# possible.
+#
+# The Software was developed by Ryan P. Adams, Michael Gelbart, and
+# Jasper Snoek at Harvard University, Kevin Swersky at the
+# University of Toronto (“Toronto”), and Hugo Larochelle at the
+# Université de Sherbrooke (“Sherbrooke”), which assigned its rights
+# in the Software to Socpra Sciences et Génie
+# S.E.C. (“Socpra”). Pursuant to an inter-institutional agreement
+# between the parties, it is distributed for free academic and
+# non-commercial research use by the President and Fellows of Harvard
+# College (“Harvard”).
+#
+# Using the Software indicates your agreement to be bound by the terms
+# of this Software Use Agreement (“Agreement”). Absent your agreement
+# to the terms below, you (the “End User”) have no rights to hold or
+# use the Software whatsoever.
+#
+# Harvard agrees to grant hereunder the limited non-exclusive license
+# to End User for the use of the Software in the performance of End
+# User’s internal, non-commercial research and academic use at End
+# User’s academic or not-for-profit research institution
+# (“Institution”) on the following terms and conditions:
+#
+# 1.  NO REDISTRIBUTION. The Software remains the property Harvard,
+# Toronto and Socpra, and except as set forth in Section 4, End User
+# shall not publish, distribute, or otherwise transfer or make
+# available the Software to any other party.
+#
+# 2.  NO COMMERCIAL USE. End User shall not use the Software for
+# commercial purposes and any such use of the Software is expressly
+# prohibited. This includes, but is not limited to, use of the
+# Software in fee-for-service arrangements, core facilities or
+# laboratories or to provide research services to (or in collaboration
+# with) third parties for a fee, and in industry-sponsored
+# collaborative research projects where any commercial rights are
+# granted to the sponsor. If End User wishes to use the Software for
+# commercial purposes or for any other restricted purpose, End User
+# must execute a separate license agreement with Harvard.
+#
+# Requests for use of the Software for commercial purposes, please
+# contact:
+#
+# Office of Technology Development
+# Harvard University
+# Smith Campus Center, Suite 727E
+# 1350 Massachusetts Avenue
+# Cambridge, MA 02138 USA
+# Telephone: (617) 495-3067
+# Facsimile: (617) 495-9568
+# E-mail: otd@harvard.edu
+#
+# 3.  OWNERSHIP AND COPYRIGHT NOTICE. Harvard, Toronto and Socpra own
+# all intellectual property in the Software. End User shall gain no
+# ownership to the Software. End User shall not remove or delete and
+# shall retain in the Software, in any modifications to Software and
+# in any Derivative Works, the copyright, trademark, or other notices
+# pertaining to Software as provided with the Software.
+#
+# 4.  DERIVATIVE WORKS. End User may create and use Derivative Works,
+# as such term is defined under U.S. copyright laws, provided that any
+# such Derivative Works shall be restricted to non-commercial,
+# internal research and academic use at End User’s Institution. End
+# User may distribute Derivative Works to other Institutions solely
+# for the performance of non-commercial, internal research and
+# academic use on terms substantially similar to this License and
+# Terms of Use.
+#
+# 5.  FEEDBACK. In order to improve the Software, comments from End
+# Users may be useful. End User agrees to provide Harvard with
+# feedback on the End User’s use of the Software (e.g., any bugs in
+# the Software, the user experience, etc.).  Harvard is permitted to
+# use such information provided by End User in making changes and
+# improvements to the Software without compensation or an accounting
+# to End User.
+#
+# 6.  NON ASSERT. End User acknowledges that Harvard, Toronto and/or
+# Sherbrooke or Socpra may develop modifications to the Software that
+# may be based on the feedback provided by End User under Section 5
+# above. Harvard, Toronto and Sherbrooke/Socpra shall not be
+# restricted in any way by End User regarding their use of such
+# information.  End User acknowledges the right of Harvard, Toronto
+# and Sherbrooke/Socpra to prepare, publish, display, reproduce,
+# transmit and or use modifications to the Software that may be
+# substantially similar or functionally equivalent to End User’s
+# modifications and/or improvements if any.  In the event that End
+# User obtains patent protection for any modification or improvement
+# to Software, End User agrees not to allege or enjoin infringement of
+# End User’s patent against Harvard, Toronto or Sherbrooke or Socpra,
+# or any of the researchers, medical or research staff, officers,
+# directors and employees of those institutions.
+#
+# 7.  PUBLICATION & ATTRIBUTION. End User has the right to publish,
+# present, or share results from the use of the Software.  In
+# accordance with customary academic practice, End User will
+# acknowledge Harvard, Toronto and Sherbrooke/Socpra as the providers
+# of the Software and may cite the relevant reference(s) from the
+# following list of publications:
+#
+# Practical Bayesian Optimization of Machine Learning Algorithms
+# Jasper Snoek, Hugo Larochelle and Ryan Prescott Adams
+# Neural Information Processing Systems, 2012
+#
+# Multi-Task Bayesian Optimization
+# Kevin Swersky, Jasper Snoek and Ryan Prescott Adams
+# Advances in Neural Information Processing Systems, 2013
+#
+# Input Warping for Bayesian Optimization of Non-stationary Functions
+# Jasper Snoek, Kevin Swersky, Richard Zemel and Ryan Prescott Adams
+# Preprint, arXiv:1402.0929, http://arxiv.org/abs/1402.0929, 2013
+#
+# Bayesian Optimization and Semiparametric Models with Applications to
+# Assistive Technology Jasper Snoek, PhD Thesis, University of
+# Toronto, 2013
+#
+# 8.  NO WARRANTIES. THE SOFTWARE IS PROVIDED "AS IS." TO THE FULLEST
+# EXTENT PERMITTED BY LAW, HARVARD, TORONTO AND SHERBROOKE AND SOCPRA
+# HEREBY DISCLAIM ALL WARRANTIES OF ANY KIND (EXPRESS, IMPLIED OR
+# OTHERWISE) REGARDING THE SOFTWARE, INCLUDING BUT NOT LIMITED TO ANY
+# IMPLIED WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+# PURPOSE, OWNERSHIP, AND NON-INFRINGEMENT.  HARVARD, TORONTO AND
+# SHERBROOKE AND SOCPRA MAKE NO WARRANTY ABOUT THE ACCURACY,
+# RELIABILITY, COMPLETENESS, TIMELINESS, SUFFICIENCY OR QUALITY OF THE
+# SOFTWARE.  HARVARD, TORONTO AND SHERBROOKE AND SOCPRA DO NOT WARRANT
+# THAT THE SOFTWARE WILL OPERATE WITHOUT ERROR OR INTERRUPTION.
+#
+# 9.  LIMITATIONS OF LIABILITY AND REMEDIES. USE OF THE SOFTWARE IS AT
+# END USER’S OWN RISK. IF END USER IS DISSATISFIED WITH THE SOFTWARE,
+# ITS EXCLUSIVE REMEDY IS TO STOP USING IT.  IN NO EVENT SHALL
+# HARVARD, TORONTO OR SHERBROOKE OR SOCPRA BE LIABLE TO END USER OR
+# ITS INSTITUTION, IN CONTRACT, TORT OR OTHERWISE, FOR ANY DIRECT,
+# INDIRECT, SPECIAL, INCIDENTAL, CONSEQUENTIAL, PUNITIVE OR OTHER
+# DAMAGES OF ANY KIND WHATSOEVER ARISING OUT OF OR IN CONNECTION WITH
+# THE SOFTWARE, EVEN IF HARVARD, TORONTO OR SHERBROOKE OR SOCPRA IS
+# NEGLIGENT OR OTHERWISE AT FAULT, AND REGARDLESS OF WHETHER HARVARD,
+# TORONTO OR SHERBROOKE OR SOCPRA IS ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGES.
+#
+# 10. INDEMNIFICATION. To the extent permitted by law, End User shall
+# indemnify, defend and hold harmless Harvard, Toronto and Sherbrooke
+# and Socpra, their corporate affiliates, current or future directors,
+# trustees, officers, faculty, medical and professional staff,
+# employees, students and agents and their respective successors,
+# heirs and assigns (the "Indemnitees"), against any liability,
+# damage, loss or expense (including reasonable attorney's fees and
+# expenses of litigation) incurred by or imposed upon the Indemnitees
+# or any one of them in connection with any claims, suits, actions,
+# demands or judgments arising from End User’s breach of this
+# Agreement or its Institution’s use of the Software except to the
+# extent caused by the gross negligence or willful misconduct of
+# Harvard, Toronto or Sherbrooke or Socpra. This indemnification
+# provision shall survive expiration or termination of this Agreement.
+#
+# 11. GOVERNING LAW. This Agreement shall be construed and governed by
+# the laws of the Commonwealth of Massachusetts regardless of
+# otherwise applicable choice of law standards.
+#
+# 12. NON-USE OF NAME.  Nothing in this License and Terms of Use shall
+# be construed as granting End Users or their Institutions any rights
+# or licenses to use any trademarks, service marks or logos associated
+# with the Software.  You may not use the terms “Harvard” or
+# “University of Toronto” or “Université de Sherbrooke” or “Socpra
+# Sciences et Génie S.E.C.” (or a substantially similar term) in any
+# way that is inconsistent with the permitted uses described
+# herein. You agree not to use any name or emblem of Harvard, Toronto
+# or Sherbrooke, or any of their subdivisions for any purpose, or to
+# falsely suggest any relationship between End User (or its
+# Institution) and Harvard, Toronto and/or Sherbrooke, or in any
+# manner that would infringe or violate any of their rights.
+#
+# 13. End User represents and warrants that it has the legal authority
+# to enter into this License and Terms of Use on behalf of itself and
+# its Institution.
+
+import os
+import re
+import sqlite3
+import cPickle as pickle
+
+from abstractdb import AbstractDB
+
+# Fields stored in their own columns so that filters on them run in SQL,
+# mapped to the names of the columns.
+INDEXED_FIELDS = {'id' : 'id', 'modified time' : 'modified'}
+
+# The operators of MongoDB filters that are supported, as SQL and in Python
+OPERATORS = {'$gt'  : ('>',  lambda x, y: x >  y),
+             '$gte' : ('>=', lambda x, y: x >= y),
+             '$lt'  : ('<',  lambda x, y: x <  y),
+             '$lte' : ('<=', lambda x, y: x <= y),
+             '$ne'  : (None, lambda x, y: x != y),
+             '$in'  : (None, lambda x, y: x in y)}
+
+class SQLiteDB(AbstractDB):
+    """
+    A database stored in a single SQLite file, with the same semantics as
+    the MongoDB database for the documents and filters used by Spearmint,
+    so that experiments can be run on a single machine without a server.
+
+    Documents are pickled into one table. Their 'id' and 'modified time'
+    fields are also stored in indexed columns so that filters on them are
+    done by SQLite; filters on any other field are applied after loading.
+    The file is in WAL mode and every write is a transaction that takes the
+    write lock up front, so several launchers can use it at the same time.
+    """
+    def __init__(self, database_path, database_name='spearmint', timeout=60.0):
+        if not re.match(r'^\w+$', database_name):
+            raise Exception('Invalid database name: %s' % database_name)
+
+        database_path = os.path.realpath(os.path.expanduser(database_path))
+        if not os.path.isdir(os.path.dirname(database_path)):
+            os.makedirs(os.path.dirname(database_path))
+
+        try:
+            # Transactions are managed explicitly (see _write)
+            self.connection = sqlite3.connect(database_path, timeout=timeout, isolation_level=None)
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('PRAGMA synchronous=NORMAL')
+        except sqlite3.Error:
+            raise Exception('Could not open the database at %s.' % database_path)
+
+        self.table = database_name
+        with self._write() as cursor:
+            cursor.execute('CREATE TABLE IF NOT EXISTS %s (rowid INTEGER PRIMARY KEY, '
+                           'experiment TEXT, field TEXT, id, modified REAL, doc BLOB)' % self.table)
+            cursor.execute('CREATE INDEX IF NOT EXISTS %s_id ON %s (experiment, field, id)' % (self.table, self.table))
+            cursor.execute('CREATE INDEX IF NOT EXISTS %s_modified ON %s (experiment, field, modified)' % (self.table, self.table))
+
+    def _write(self):
+        return _Transaction(self.connection)
+
+    def save(self, save_doc, experiment_name, experiment_field, field_filters=None):
+        """
+        Saves a document into the database.
+        field_filters must return at most one document, otherwise it is not clear
+        which one to update and an exception will be raised.
+        """
+        with self._write() as cursor:
+            rows = self._find(cursor, experiment_name, experiment_field, field_filters)
+
+            if len(rows) > 1:
+                raise Exception('Ambiguous save attempted. Field filters returned more than one document.')
+            elif len(rows) == 1:
+                self._replace(cursor, rows[0][0], save_doc)
+                return True
+            else:
+                return self._insert(cursor, experiment_name, experiment_field, save_doc)
+
+    def save_many(self, save_docs, experiment_name, experiment_field, key='id'):
+        """
+        Saves several documents into the database in a single transaction.
+        Each document replaces the one with the same value of the field key,
+        or is inserted if there is none.
+        """
+        with self._write() as cursor:
+            for save_doc in save_docs:
+                rows = self._find(cursor, experiment_name, experiment_field, {key : save_doc[key]})
+                if rows:
+                    self._replace(cursor, rows[0][0], save_doc)
+                else:
+                    self._insert(cursor, experiment_name, experiment_field, save_doc)
+
+    def update(self, update_fields, experiment_name, experiment_field, field_filters):
+        """
+        Sets the fields in update_fields on the document matching field_filters
+        in a single transaction, and returns the updated document (or None if
+        no document matched).
+        """
+        with self._write() as cursor:
+            return self._update_one(cursor, update_fields, experiment_name, experiment_field, field_filters)
+
+    def bulk_update(self, updates, experiment_name, experiment_field):
+        """
+        Applies several updates in a single transaction. updates is a list
+        of (field_filters, update_fields) pairs, and the fields in update_fields
+        are set on the document matching field_filters.
+        """
+        with self._write() as cursor:
+            for field_filters, update_fields in updates:
+                self._update_one(cursor, update_fields, experiment_name, experiment_field, field_filters)
+
+    def load(self, experiment_name, experiment_field, field_filters=None):
+        # Return a list of documents from the database
+        docs = [doc for rowid, doc in self._find(self.connection.cursor(), experiment_name, experiment_field, field_filters)]
+
+        if len(docs) == 0:
+            return None
+        elif len(docs) == 1:
+            return docs[0]
+        else:
+            return docs
+
+    def remove(self, experiment_name, experiment_field, field_filters={}):
+        with self._write() as cursor:
+            if not field_filters:
+                # Everything in the collection, without loading it
+                cursor.execute('DELETE FROM %s WHERE experiment = ? AND field = ?' % self.table,
+                               (experiment_name, experiment_field))
+            else:
+                rows = self._find(cursor, experiment_name, experiment_field, field_filters)
+                cursor.executemany('DELETE FROM %s WHERE rowid = ?' % self.table, [(rowid,) for rowid, doc in rows])
+
+    def _find(self, cursor, experiment_name, experiment_field, field_filters):
+        """Return the (rowid, document) pairs of the documents matching field_filters."""
+        if field_filters is None:
+            field_filters = {}
+
+        # Filter on the indexed fields in SQL
+        where  = ['experiment = ?', 'field = ?']
+        values = [experiment_name, experiment_field]
+        for field, column in INDEXED_FIELDS.iteritems():
+            if field not in field_filters:
+                continue
+
+            condition = field_filters[field]
+            if isinstance(condition, dict):
+                for op, value in condition.iteritems():
+                    if op in OPERATORS and OPERATORS[op][0] is not None:
+                        where.append('%s %s ?' % (column, OPERATORS[op][0]))
+                        values.append(value)
+            else:
+                where.append('%s = ?' % column)
+                values.append(condition)
+
+        cursor.execute('SELECT rowid, doc FROM %s WHERE %s ORDER BY rowid' % (self.table, ' AND '.join(where)), values)
+        rows = [(rowid, pickle.loads(str(doc))) for rowid, doc in cursor.fetchall()]
+
+        # And on everything in Python
+        return [(rowid, doc) for rowid, doc in rows if _matches(doc, field_filters)]
+
+    def _insert(self, cursor, experiment_name, experiment_field, doc):
+        cursor.execute('INSERT INTO %s (experiment, field, id, modified, doc) VALUES (?, ?, ?, ?, ?)' % self.table,
+                       (experiment_name, experiment_field, doc.get('id'), doc.get('modified time'), _dumps(doc)))
+        return cursor.lastrowid
+
+    def _replace(self, cursor, rowid, doc):
+        cursor.execute('UPDATE %s SET id = ?, modified = ?, doc = ? WHERE rowid = ?' % self.table,
+                       (doc.get('id'), doc.get('modified time'), _dumps(doc), rowid))
+
+    def _update_one(self, cursor, update_fields, experiment_name, experiment_field, field_filters):
+        rows = self._find(cursor, experiment_name, experiment_field, field_filters)
+        if len(rows) == 0:
+            return None
+
+        rowid, doc = rows[0]
+        doc.update(update_fields)
+        self._replace(cursor, rowid, doc)
+
+        return doc
+
+class _Transaction(object):
+    """A write transaction that takes the database lock when it begins, so
+    that concurrent writers wait for each other instead of failing when they
+    try to upgrade a read lock."""
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.cursor = self.connection.cursor()
+        self.cursor.execute('BEGIN IMMEDIATE')
+        return self.cursor
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.cursor.execute('COMMIT')
+        else:
+            self.cursor.execute('ROLLBACK')
+
+def _dumps(doc):
+    return sqlite3.Binary(pickle.dumps(doc, pickle.HIGHEST_PROTOCOL))
+
+def _matches(doc, field_filters):
+    """Whether the document matches the MongoDB-style field_filters."""
+    for field, condition in field_filters.iteritems():
+        if field not in doc:
+            return False
+
+        if isinstance(condition, dict) and all(op.startswith('$') for op in condition):
+            for op, value in condition.iteritems():
+                if op not in OPERATORS:
+                    raise Exception('Unsupported filter operator: %s' % op)
+                if not OPERATORS[op][1](doc[field], value):
+                    return False
+        elif doc[field] != condition:
+            return False
+
+    return True
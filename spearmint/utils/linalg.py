@@ -184,7 +184,6 @@
 
 
 import numpy as np
-import scipy.weave
 import scipy.linalg as spla
 
 # Update Cholesky decomposition to include a single extra
@@ -196,77 +195,44 @@ import scipy.linalg as spla
 # Jasper Snoek
 # Assumes L = chol(A[:-1,:-1])
 def fast_chol_add(L, A): 
-    U = L.T
-
-    # Add a row and column to U
     # Assume that you can pass in a cholesky that's the same
     # size as the kernel (then the last row/col will be clobbered)
-    if U.shape[0] < A.shape[0]:
-        G = np.zeros(A.shape)
-        G[:U.shape[0], :U.shape[1]] = U
-        U = G
-    
-    (rows,cols) = A.shape
+    N = A.shape[0]-1
+    L = L[:N,:N]
+
+    L_update = np.zeros(A.shape)
+    L_update[:N,:N] = L
+
+    isPosDef = 1
 
-    isPosDef = 1;
-    j = rows-1    
-    try:
-        code = \
-        """
-        double s = 0;
-        for (int i=0; i<cols; i++) {
-            s = A(i,j);
-            for (int ind=0; ind<i; ind++)
-                s -= U(ind,i) * U(ind,j);
+    # The new row is L\a and the new diagonal is what is left of A[-1,-1]
+    row = spla.solve_triangular(L, A[:N,N], lower=True) if N > 0 else np.zeros(0)
+    s   = A[N,N] - np.dot(row, row)
 
-            if (i == j) {
-                if (s <= 0) {
-                    isPosDef = 0;
-                    U(i,i) = 0;
-                }
-                else {
-                    U(i,i) = sqrt(s);
-                }
-            } else {
-                if (U(i,i) > 0) {
-                    U(i,j) = s / U(i,i);
-                }
-                else {
-                    U(i,j) = 0;
-                }
-            }
-        }
-        """
-        scipy.weave.inline(code, ['U','A','j','isPosDef','rows','cols'], \
-                               type_converters=scipy.weave.converters.blitz, \
-                               compiler='gcc')
-    except:
-        k = np.arange(cols)
-        for i in xrange(cols):
-            j = rows-1;
-            s = A[i,j] - np.dot(U[k[:i],i].T,U[k[:i],j])
-            if i == j:
-                if s <= 0:
-                    isPosDef = 0
-                    U[i,i] = 0
-                else:
-                    U[i,i] = np.sqrt(s)
-            else:
-                if U[i,i] > 0:
-                    U[i,j] = s / U[i,i]
-                else:
-                    U[i,j] = 0
+    if s <= 0:
+        isPosDef = 0
+        s        = 0.0
 
-    L = U.T
-    return L, isPosDef
+    L_update[N,:N] = row
+    L_update[N,N]  = np.sqrt(s)
+
+    return L_update, isPosDef
 
 # If L = cholesky(A[:N,:N]) then this will compute L2 = cholesky(A)
 # with O(M*N^2) work where M = A.shape[0] - N
 def chol_add(L, A):
     N = L.shape[0]
-    S12 = spla.solve_triangular(L, A[:N,N:], lower=True)
-    S22 = spla.cholesky(A[N:,N:] - S12.T.dot(S12)).T
-    L_update = np.zeros(A.shape)
+    return chol_extend(L, A[:N,N:], A[N:,N:])
+
+# The same as chol_add but only takes the blocks of the new matrix that
+# are not already covered by L, i.e. A12 = A[:N,N:] and A22 = A[N:,N:].
+# This means the caller never has to build the full matrix.
+def chol_extend(L, A12, A22):
+    N = L.shape[0]
+    M = A22.shape[0]
+    S12 = spla.solve_triangular(L, A12, lower=True)
+    S22 = spla.cholesky(A22 - S12.T.dot(S12), lower=True)
+    L_update = np.zeros((N+M, N+M))
     L_update[:N,:N] = L
     L_update[N:,:N] = S12.T
     L_update[N:,N:] = S22
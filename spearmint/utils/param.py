@@ -256,6 +256,9 @@ class Param(object):
     def prior_logprob(self):
         return self.prior.logprob(self.value)
 
+    def prior_grad_logprob(self):
+        return self.prior.grad_logprob(self.value)
+
     # For MCMC diagnostics -- or maybe will be used for initialization at some point
     def sample_from_prior(self):
         if hasattr(self.prior, 'sample'):
@@ -191,6 +191,9 @@ import sys
 import os
 import json
 
+from database import SQLITE_SCHEME
+
+DEFAULT_SQLITE_FILE = 'spearmint.db'
 
 
 # For converting a string of args into a dict of args
@@ -222,12 +225,22 @@ def parse_args(argTypes, args):
     return opt
 
 
-def parse_db_address(cfg):
+def parse_db_address(cfg, expt_dir='.'):
+    """Return the address of the database. With the "sqlite" backend the
+    address is the path of the database file, relative to the experiment
+    directory, and defaults to spearmint.db in that directory."""
     
     db_address = os.getenv('SPEARMINT_DB_ADDRESS')
     if db_address is None:
-        if 'database' in cfg and 'address' in cfg['database']:
-            db_address = cfg['database']['address']
+        database = cfg.get('database', {})
+        if database.get('backend', 'mongodb').lower() == 'sqlite':
+            db_path    = database.get('address', DEFAULT_SQLITE_FILE)
+            if db_path.startswith(SQLITE_SCHEME):
+                db_path = db_path[len(SQLITE_SCHEME):]
+            db_path    = os.path.expanduser(db_path)
+            db_address = SQLITE_SCHEME + os.path.join(os.path.realpath(expt_dir), db_path)
+        elif 'address' in database:
+            db_address = database['address']
         else:
             db_address = 'localhost'
 
@@ -198,6 +198,18 @@ class AbstractPrior(object):
     def logprob(self, x):
         pass
 
+    # The gradient of logprob wrt x, with the shape of x. This uses central
+    # differences unless the prior implements it.
+    def grad_logprob(self, x, eps=1e-6):
+        x    = np.array(x, dtype=float)
+        grad = np.zeros(x.shape)
+        for i in np.ndindex(*x.shape):
+            x_plus, x_minus = x.copy(), x.copy()
+            x_plus[i]  += eps
+            x_minus[i] -= eps
+            grad[i] = (self.logprob(x_plus) - self.logprob(x_minus)) / (2*eps)
+        return grad
+
     # Some of these are "improper priors" and I cannot sample from them
     # In this case the sample method will just return None
     # (or could raise an exception)
@@ -221,6 +233,9 @@ class Tophat(AbstractPrior):
         else:
             return 0.  # More correct is -np.log(self.xmax-self.xmin), but constants don't matter
 
+    def grad_logprob(self, x):
+        return np.zeros(np.shape(x))
+
     def sample(self, n_samples):
         return self.xmin + npr.rand(n_samples) * (self.xmax-self.xmin)
 
@@ -243,6 +258,10 @@ class Horseshoe(AbstractPrior):
         # (or am I wrong and for the univariate case we have it analytically?)
         return np.sum(np.log(np.log(1 + 3.0 * (self.scale/x)**2) ) )
 
+    def grad_logprob(self, x):
+        u = 3.0 * (self.scale/x)**2
+        return (-2.0*u/x) / ((1 + u) * np.log(1 + u))
+
     def sample(self, n_samples):
         # Sample from standard half-cauchy distribution
         lamda = np.abs(npr.standard_cauchy(size=n_samples))
@@ -259,6 +278,10 @@ class Lognormal(AbstractPrior):
     def logprob(self, x):
         return np.sum(sps.lognorm.logpdf(x, self.scale, loc=self.mean))
 
+    def grad_logprob(self, x):
+        x = np.asarray(x) - self.mean
+        return -(1.0 + np.log(x)/self.scale**2) / x
+
     def sample(self, n_samples):
         return npr.lognormal(mean=self.mean, sigma=self.scale, size=n_samples)
 
@@ -278,6 +301,10 @@ class LognormalTophat(AbstractPrior):
         else:
             return np.sum(sps.lognorm.logpdf(x, self.scale, loc=self.mean))
 
+    def grad_logprob(self, x):
+        x = np.asarray(x) - self.mean
+        return -(1.0 + np.log(x)/self.scale**2) / x
+
     def sample(self, n_samples):
         raise Exception('Sampling of LognormalTophat is not implemented.')
 
@@ -293,6 +320,10 @@ class LognormalOnSquare(Lognormal):
         # log p_y(y) = log p_x(x) - log(dy/dx)
         return Lognormal.logprob(self, x) - np.log(dy_dx)
 
+    def grad_logprob(self, y):
+        x = np.sqrt(y)
+        return Lognormal.grad_logprob(self, x) / (2*x) - 1.0/(2*y)
+
     def sample(self, n_samples):
         return Lognormal.sample(self, n_samples)**2
 
@@ -311,6 +342,9 @@ class Exponential(AbstractPrior):
     def logprob(self, x):
         return np.sum(sps.expon.logpdf(x, scale=self.mean))
 
+    def grad_logprob(self, x):
+        return -np.ones(np.shape(x)) / self.mean
+
     def sample(self, n_samples):
         return npr.exponential(scale=self.mean, size=n_samples)
 
@@ -324,6 +358,9 @@ class Gaussian(AbstractPrior):
     def logprob(self, x):
         return np.sum(sps.norm.logpdf(x, loc=self.mu, scale=self.sigma))
 
+    def grad_logprob(self, x):
+        return -(np.asarray(x) - self.mu) / self.sigma**2
+
     def sample(self, n_samples):
         return self.mu + npr.randn(n_samples) * self.sigma
 
@@ -338,6 +375,9 @@ class MultivariateNormal(AbstractPrior):
     def logprob(self, x):
         return sps.multivariate_normal.logpdf(x, mean=self.mu, cov=self.cov)
 
+    def grad_logprob(self, x):
+        return -np.linalg.solve(self.cov, np.asarray(x) - self.mu)
+
     def sample(self, n_samples):
         return npr.multivariate_normal(self.mu, self.cov, size=n_samples).T.squeeze()
 
@@ -348,21 +388,39 @@ class NoPrior(AbstractPrior):
     def logprob(self, x):
         return 0.0
 
+    def grad_logprob(self, x):
+        return np.zeros(np.shape(x))
+
 # This class takes in another prior in its constructor
 # And gives you the nonnegative version (actually the positive version, to be numerically safe)
 class NonNegative(AbstractPrior):
     def __init__(self, prior):
         self.prior = prior
+        self._set_sample()
 
-        if hasattr(prior, 'sample'):
+    def _set_sample(self):
+        if hasattr(self.prior, 'sample'):
             self.sample = lambda n_samples: np.abs(self.prior.sample(n_samples))
 
+    def __getstate__(self):
+        # The sample function can't be pickled, it is set again from the prior
+        state = self.__dict__.copy()
+        state.pop('sample', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._set_sample()
+
     def logprob(self, x):
         if np.any(x <= 0): 
             return -np.inf
         else:
             return self.prior.logprob(x)# + np.log(2.0)
         # Above: the log(2) makes it correct, but we don't ever care about it I think
+
+    def grad_logprob(self, x):
+        return self.prior.grad_logprob(x)
         
 
 # This class allows you to compose a list priors
@@ -378,6 +436,9 @@ class ProductOfPriors(AbstractPrior):
             lp += prior.logprob(x)
         return lp
 
+    def grad_logprob(self, x):
+        return reduce(add, [prior.grad_logprob(x) for prior in self.priors])
+
 # class Binomial(AbstractPrior):
 #     def __init__(self, p, n):
 #         self.p = p